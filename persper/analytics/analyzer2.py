@@ -1,17 +1,26 @@
 import asyncio
 import collections.abc
 import logging
+import os
+import pickle
 import re
+import shutil
 import sys
+import tempfile
+import threading
 import time
 from abc import ABC
-from typing import List, Optional, Set, Union, Dict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Union
 
 from git import Commit, Diff, DiffIndex, Repo
 
+from persper.analytics.checkpoint import AnalysisCheckpoint
 from persper.analytics.commit_classifier import CommitClassifier
-from persper.analytics.git_tools import diff_with_commit, get_contents
+from persper.analytics.commit_scheduler import CommitScheduler
+from persper.analytics.git_tools import BlobReader, diff_with_commit, get_contents
 from persper.analytics.graph_server import CommitSeekingMode, GraphServer
+from persper.analytics.history_index import HistoryIndex, lazy_commit
 from persper.analytics.score import commit_overall_scores
 
 _logger = logging.getLogger(__name__)
@@ -24,8 +33,26 @@ class Analyzer:
                  commit_classifier: Optional[CommitClassifier] = None,
                  skip_rewind_diff: bool = False,
                  monolithic_commit_lines_threshold: int = 5000,
-                 monolithic_file_bytes_threshold: int = 200000):
+                 monolithic_file_bytes_threshold: int = 200000,
+                 prefetch_depth: int = 0,
+                 prefetch_memory_limit: int = 256 * 1024 * 1024,
+                 checkpoint_dir: Optional[str] = None,
+                 checkpoint_interval: int = 100,
+                 commit_scheduler: Optional[CommitScheduler] = None,
+                 history_index: Optional[HistoryIndex] = None):
         # skip_rewind_diff will skip diff, but rewind commit start/end will still be notified to the GraphServer.
+        # prefetch_depth is the number of commits whose diff and file contents are prepared ahead of the GraphServer
+        # on a thread pool; 0 disables prefetching. prefetch_memory_limit (in bytes) pauses prefetching while the
+        # prepared file contents waiting for the GraphServer exceed it.
+        # checkpoint_dir enables incremental checkpoints (see `AnalysisCheckpoint`), saved every
+        # checkpoint_interval visited commits and at the end of `analyze`. If the directory already contains
+        # a checkpoint, `analyze` resumes from it. This requires a GraphServer whose `get_graph` returns the
+        # CallCommitGraph it is building, e.g. CGraphServer; other graphs (e.g. CompactCallCommitGraph) raise
+        # CheckpointError.
+        # commit_scheduler decides the order of the commits to analyze (see `commit_scheduler`);
+        # by default they are visited in git's topological order.
+        # history_index (see `HistoryIndex`) provides the parents of the commits, so that planning the analysis
+        # does not read every commit object.
         self._repositoryRoot = repositoryRoot
         self._graphServer = graphServer
         self._repo = Repo(repositoryRoot)
@@ -40,24 +67,40 @@ class Analyzer:
         self._skip_rewind_diff = skip_rewind_diff
         self._monolithic_commit_lines_threshold = monolithic_commit_lines_threshold
         self._monolithic_file_bytes_threshold = monolithic_file_bytes_threshold
+        self._prefetch_depth = prefetch_depth
+        self._prefetch_memory_limit = prefetch_memory_limit
+        self._checkpoint_dir = checkpoint_dir
+        self._checkpoint_interval = checkpoint_interval
+        self._checkpoint: Optional[AnalysisCheckpoint] = None
+        self._commit_scheduler = commit_scheduler
+        self._history_index = history_index
         self._call_commit_graph = None
+        self._blob_reader = BlobReader(self._repo)
 
     def __getstate__(self):
         state = self.__dict__.copy()
         state.pop("_repo", None)
+        state.pop("_blob_reader", None)
         state.pop("_s_visitedCommits", None)
         state["_originCommit"] = self._originCommit.hexsha if self._originCommit else None
         state["_terminalCommit"] = self._terminalCommit.hexsha if self._terminalCommit else None
         state.pop("_observer", None)
+        state.pop("_checkpoint", None)
         return state
 
     def __setstate__(self, state):
         self.__dict__.update(state)
         self._repo = Repo(self._repositoryRoot)
+        self._blob_reader = BlobReader(self._repo)
         self.originCommit = state["_originCommit"]
         self.terminalCommit = state["_terminalCommit"]
         self._s_visitedCommits = _ReadOnlySet(self._visitedCommits)
         self._observer: AnalyzerObserver = emptyAnalyzerObserver
+        self.__dict__.setdefault("_checkpoint_dir", None)
+        self.__dict__.setdefault("_checkpoint_interval", 100)
+        self.__dict__.setdefault("_commit_scheduler", None)
+        self.__dict__.setdefault("_history_index", None)
+        self._checkpoint = None
 
     @property
     def graphServer(self):
@@ -167,146 +210,364 @@ class Analyzer:
 
     async def analyze(self, maxAnalyzedCommits=None, suppressStdOutLogs=False):
         self._call_commit_graph = None
-        commitSpec = self._terminalCommit
-        if self._originCommit:
-            commitSpec = self._originCommit.hexsha + ".." + self._terminalCommit.hexsha
+        analyzedCommits = 0
+        self._graphServer.before_analyze()
+        try:
+            self._openCheckpoint()
+            steps = self._iterAnalysisSteps(maxAnalyzedCommits)
+            if self._prefetch_depth > 0:
+                async with _CommitPrefetcher(self, steps, self._prefetch_depth,
+                                             self._prefetch_memory_limit) as prefetcher:
+                    async for step, prepared in prefetcher:
+                        analyzedCommits = await self._runAnalysisStep(step, prepared, suppressStdOutLogs)
+            else:
+                for step in steps:
+                    prepared = None
+                    if step.seekingMode is not None:
+                        prepared = self._prepareCommit(step.commit, step.parentCommit, step.seekingMode,
+                                                       self._repo, self._blob_reader)
+                    analyzedCommits = await self._runAnalysisStep(step, prepared, suppressStdOutLogs)
+        except Exception as ex:
+            self._closeCheckpoint()
+            self._graphServer.after_analyze(ex)
+            raise
+        else:
+            self._closeCheckpoint()
+            self._graphServer.after_analyze(None)
+        return analyzedCommits
+
+    async def analyze_sharded(self, shards: int, maxAnalyzedCommits=None, suppressStdOutLogs=False):
+        """
+        Same as `analyze`, but splits the commits to analyze into `shards` contiguous ranges
+        (in topological order), whose diffs are read and parsed in one worker process per range.
+        The graph updates of all the commits are then applied in the same order as `analyze` does,
+        so the resulting graph is exactly the same.
 
+        The GraphServer must be able to compute the graph updates of a commit without the graph,
+        i.e. implement `compute_updates`, `apply_updates` and `copy_for_worker` as CGraphServer does.
+        """
+        for name in ("compute_updates", "apply_updates", "copy_for_worker"):
+            if not hasattr(self._graphServer, name):
+                raise NotImplementedError("{0} does not support sharded analysis.".format(
+                    type(self._graphServer).__name__))
+        self._call_commit_graph = None
         analyzedCommits = 0
         self._graphServer.before_analyze()
+        shardDir = tempfile.mkdtemp(prefix="analyzer-shards-")
+        executor = ProcessPoolExecutor(max_workers=shards)
+        futures = []
         try:
-            for commit in self._repo.iter_commits(commitSpec,
-                                                  topo_order=True, reverse=True, first_parent=self._firstParentOnly):
-                def printCommitStatus(level, status: str):
-                    message = commit.message.lstrip()[:32].rstrip()
-                    message = re.sub(r"\s+", " ", message)
-                    # note the commit # here only indicates the ordinal of current commit in current analysis session
-                    if not suppressStdOutLogs:
-                        print("Commit #{0} {1} ({2}): {3}".format(
-                            analyzedCommits, commit.hexsha, message, status))
-                    _logger.log(level, "Commit #%d %s (%s): %s",
-                                analyzedCommits, commit.hexsha, message, status)
-                lastCommit = self._graphServer.get_workspace_commit_hexsha()
-                if maxAnalyzedCommits and analyzedCommits >= maxAnalyzedCommits:
-                    _logger.warning("Max analyzed commits reached.")
-                    break
-                if commit.hexsha in self._visitedCommits:
-                    printCommitStatus(logging.DEBUG, "Already visited.")
-                    continue
-                if len(commit.parents) > 1 and not self._firstParentOnly:
-                    # merge commit
-                    # GraphServer should processes connection of current graph, but does not process LOC diff.
-                    # We assume GraphServer is actually independent of the value of `lastCommit`;
-                    # thus there is no need to rewind.
-                    printCommitStatus(logging.INFO, "Going forward (merge).")
-                    await self._analyzeCommit(commit, lastCommit, CommitSeekingMode.MergeCommit)
-                else:
-                    expectedParentCommit = None
-                    message = None
-                    if len(commit.parents) == 0:
-                        message = "Going forward (initial commit)."
-                        expectedParentCommit = None
-                    else:
-                        if len(commit.parents) > 1:
-                            assert self._firstParentOnly
-                            # We trust git would traverse along first parent.
-                            # _firstParentOnly will make merge commit author take the merit of all the merged changes.
-                            message = "Going forward (merge)."
-                        else:
-                            message = "Going forward."
-                        expectedParentCommit = commit.parents[0].hexsha
-                    if lastCommit != expectedParentCommit:
-                        printCommitStatus(logging.INFO, "Rewind to parent: {0}.".format(expectedParentCommit or "<empty>"))
-                        # jumping to the parent commit first
-                        await self._analyzeCommit(expectedParentCommit, lastCommit, CommitSeekingMode.Rewind)
-                    # then go on with current commit
-                    printCommitStatus(logging.INFO, message)
-                    await self._analyzeCommit(commit, expectedParentCommit, CommitSeekingMode.NormalForward)
-                self._visitedCommits.add(commit.hexsha)
-                analyzedCommits += 1
+            self._openCheckpoint()
+            steps = list(self._iterAnalysisSteps(maxAnalyzedCommits))
+            forwardSteps = [step for step in steps
+                            if step.seekingMode in (CommitSeekingMode.NormalForward, CommitSeekingMode.MergeCommit)]
+            options = {
+                "commit_classifier": self._commit_classifier,
+                "monolithic_commit_lines_threshold": self._monolithic_commit_lines_threshold,
+                "monolithic_file_bytes_threshold": self._monolithic_file_bytes_threshold,
+            }
+            workerServer = self._graphServer.copy_for_worker()
+            for i in range(shards):
+                shard = forwardSteps[len(forwardSteps) * i // shards:len(forwardSteps) * (i + 1) // shards]
+                if shard:
+                    futures.append(executor.submit(
+                        _prepareShard, self._repositoryRoot, workerServer, options,
+                        [(step.commit.hexsha, step.parentCommit, step.seekingMode) for step in shard],
+                        os.path.join(shardDir, "shard-{0}".format(i))))
+            results = _iterShardResults(futures)
+            for step in steps:
+                prepared = None
+                if step.seekingMode is not None:
+                    prepared = _PreparedCommit(step.commit, step.parentCommit, step.seekingMode)
+                    if step.seekingMode != CommitSeekingMode.Rewind:
+                        prepared.seekingMode, prepared.updates, prob = await results.__anext__()
+                        if prob is not None and step.commit.hexsha not in self._clf_results:
+                            self._clf_results[step.commit.hexsha] = prob
+                analyzedCommits = await self._runAnalysisStep(step, prepared, suppressStdOutLogs)
         except Exception as ex:
+            self._closeCheckpoint()
             self._graphServer.after_analyze(ex)
             raise
         else:
+            self._closeCheckpoint()
             self._graphServer.after_analyze(None)
+        finally:
+            # the shards not started yet on failure
+            for future in futures:
+                future.cancel()
+            executor.shutdown()
+            shutil.rmtree(shardDir, ignore_errors=True)
         return analyzedCommits
 
+    def _commitSpec(self) -> Dict:
+        return {
+            "terminal": self._terminalCommit.hexsha,
+            "origin": self._originCommit.hexsha if self._originCommit else None,
+            "firstParentOnly": self._firstParentOnly,
+        }
+
+    def _listCommits(self, spec: Dict) -> List[str]:
+        """
+        Lists the commits `_iterAnalysisSteps` visits, in git's topological order.
+        """
+        args = ["--topo-order", "--reverse"]
+        if spec["firstParentOnly"]:
+            args.append("--first-parent")
+        args.append(spec["origin"] + ".." + spec["terminal"] if spec["origin"] else spec["terminal"])
+        return self._repo.git.rev_list(*args).split()
+
+    def _openCheckpoint(self):
+        if not self._checkpoint_dir:
+            return
+        graph = self._graphServer.get_graph()
+        if self._checkpoint is None:
+            checkpoint = AnalysisCheckpoint(self._checkpoint_dir, self._checkpoint_interval)
+            if checkpoint.exists():
+                visited, clf_results = checkpoint.restore(graph, self._listCommits)
+                self._visitedCommits.update(visited)
+                self._clf_results.update(clf_results)
+            else:
+                checkpoint.create(graph)
+            self._checkpoint = checkpoint
+        else:
+            # closed at the end of the last analysis run
+            self._checkpoint.reopen()
+        spec = self._commitSpec()
+        self._checkpoint.set_commits(spec, self._listCommits(spec), self._visitedCommits)
+        self._checkpoint.save()
+        self._checkpoint.attach(graph)
+
+    def _closeCheckpoint(self):
+        if self._checkpoint is not None:
+            self._checkpoint.save()
+            self._checkpoint.close()
+
+    def _iterAnalysisSteps(self, maxAnalyzedCommits=None):
+        """
+        Plans the sequence of commits to be sent to the GraphServer, in topological order.
+        The workspace commit is tracked here rather than queried from the GraphServer,
+        so that the steps can be planned (and prefetched) ahead of their analysis.
+        """
+        commitSpec = self._terminalCommit
+        if self._originCommit:
+            commitSpec = self._originCommit.hexsha + ".." + self._terminalCommit.hexsha
+
+        analyzedCommits = 0
+        lastCommit = self._graphServer.get_workspace_commit_hexsha()
+        if self._history_index is not None:
+            # the commits are listed in one git call, and not read until they are analyzed
+            commits = [lazy_commit(self._repo, sha) for sha in self._listCommits(self._commitSpec())]
+        else:
+            commits = self._repo.iter_commits(commitSpec,
+                                              topo_order=True, reverse=True, first_parent=self._firstParentOnly)
+        if self._commit_scheduler is not None:
+            commits = list(commits)
+            # the visited commits are skipped without touching the workspace
+            commits = [c for c in commits if c.hexsha in self._visitedCommits] + \
+                self._commit_scheduler.schedule([c for c in commits if c.hexsha not in self._visitedCommits],
+                                                lastCommit, self._firstParentOnly)
+        for commit in commits:
+            if maxAnalyzedCommits and analyzedCommits >= maxAnalyzedCommits:
+                _logger.warning("Max analyzed commits reached.")
+                break
+            if commit.hexsha in self._visitedCommits:
+                yield _AnalysisStep(None, None, None, commit, analyzedCommits, logging.DEBUG, "Already visited.")
+                continue
+            parents = self._commitParents(commit)
+            if len(parents) > 1 and not self._firstParentOnly:
+                # merge commit
+                # GraphServer should processes connection of current graph, but does not process LOC diff.
+                # We assume GraphServer is actually independent of the value of `lastCommit`;
+                # thus there is no need to rewind.
+                yield _AnalysisStep(commit, lastCommit, CommitSeekingMode.MergeCommit,
+                                    commit, analyzedCommits, logging.INFO, "Going forward (merge).")
+            else:
+                expectedParentCommit = None
+                message = None
+                if len(parents) == 0:
+                    message = "Going forward (initial commit)."
+                    expectedParentCommit = None
+                else:
+                    if len(parents) > 1:
+                        assert self._firstParentOnly
+                        # We trust git would traverse along first parent.
+                        # _firstParentOnly will make merge commit author take the merit of all the merged changes.
+                        message = "Going forward (merge)."
+                    else:
+                        message = "Going forward."
+                    expectedParentCommit = parents[0]
+                if lastCommit != expectedParentCommit:
+                    # jumping to the parent commit first
+                    yield _AnalysisStep(self._parentCommit(expectedParentCommit), lastCommit, CommitSeekingMode.Rewind,
+                                        commit, analyzedCommits, logging.INFO,
+                                        "Rewind to parent: {0}.".format(expectedParentCommit or "<empty>"))
+                # then go on with current commit
+                yield _AnalysisStep(commit, expectedParentCommit, CommitSeekingMode.NormalForward,
+                                    commit, analyzedCommits, logging.INFO, message)
+            # GraphServer asserts its workspace commit equals the one seen in the last start_commit.
+            lastCommit = commit.hexsha
+            analyzedCommits += 1
+
+    def _commitParents(self, commit: Commit) -> List[str]:
+        if self._history_index is not None and self._history_index.covers(commit.hexsha):
+            return self._history_index.parents(commit.hexsha)
+        return [parent.hexsha for parent in commit.parents]
+
+    def _parentCommit(self, hexsha: Optional[str]) -> Commit:
+        if self._history_index is not None and hexsha in self._history_index:
+            return lazy_commit(self._repo, hexsha)
+        return self._repo.commit(hexsha)
+
+    async def _runAnalysisStep(self, step: "_AnalysisStep", prepared: Optional["_PreparedCommit"],
+                               suppressStdOutLogs: bool) -> int:
+        """
+        Applies a planned step to the GraphServer.
+        Returns the number of commits analyzed so far in current analysis session.
+        """
+        commit = step.targetCommit
+        message = commit.message.lstrip()[:32].rstrip()
+        message = re.sub(r"\s+", " ", message)
+        # note the commit # here only indicates the ordinal of current commit in current analysis session
+        if not suppressStdOutLogs:
+            print("Commit #{0} {1} ({2}): {3}".format(
+                step.ordinal, commit.hexsha, message, step.status))
+        _logger.log(step.level, "Commit #%d %s (%s): %s",
+                    step.ordinal, commit.hexsha, message, step.status)
+        if prepared is None:
+            return step.ordinal
+        await self._applyCommit(prepared)
+        if step.seekingMode == CommitSeekingMode.Rewind:
+            return step.ordinal
+        self._visitedCommits.add(commit.hexsha)
+        if self._checkpoint is not None:
+            self._checkpoint.record_commit(commit.hexsha, self._clf_results.get(commit.hexsha))
+        return step.ordinal + 1
+
     async def _analyzeCommit(self, commit: Union[Commit, str], parentCommit: Union[Commit, str],
                              seekingMode: CommitSeekingMode):
         """
         parentCommit can be None.
         """
-        if type(commit) != Commit:
-            commit = self._repo.commit(commit)
+        prepared = self._prepareCommit(commit, parentCommit, seekingMode, self._repo, self._blob_reader)
+        await self._applyCommit(prepared)
 
-        # filter monolithic commit
-        seekingMode = self._filter_monolithic_commit(commit, seekingMode)
+    def _prepareCommit(self, commit: Union[Commit, str], parentCommit: Union[Commit, str],
+                       seekingMode: CommitSeekingMode, repo: Repo, blobReader: BlobReader,
+                       filterFiles: Callable[[Set[str]], Set[str]] = None) -> "_PreparedCommit":
+        """
+        Does the git I/O of a commit: diff, file-level filter and file contents.
+        This method can run on a worker thread as long as `repo` and `blobReader` are not shared
+        with other threads, and `filterFiles` calls `GraphServer.filter_file` on the thread owning
+        the GraphServer.
 
-        # t0: Total time usage
+        filterFiles: gets the file names passing `GraphServer.filter_file` out of the given ones.
+        Defaults to calling `filter_file` on the current thread.
+        """
         t0 = time.monotonic()
-        self._observer.onBeforeCommit(self, commit, seekingMode)
-
-        # t1: start_commit time
-        t1 = time.monotonic()
-        result = self._graphServer.start_commit(commit.hexsha, seekingMode,
-                                                commit.author.name, commit.author.email, commit.message)
-        if asyncio.iscoroutine(result):
-            await result
+        if type(commit) != Commit:
+            commit = repo.commit(commit)
 
-        t1 = time.monotonic() - t1
-        diff_index = None
         if self._skip_rewind_diff and seekingMode == CommitSeekingMode.Rewind:
             _logger.info("Skipped diff for rewinding commit.")
+            diffIndex = None
         else:
-            diff_index = diff_with_commit(self._repo, commit, parentCommit)
+            diffIndex = diff_with_commit(repo, commit, parentCommit)
 
-        # commit classification
-        if self._commit_classifier and commit.hexsha not in self._clf_results:
-            prob = self._commit_classifier.predict(commit, diff_index, self._repo)
-            self._clf_results[commit.hexsha] = prob
+        # the files passing the file-level filter, in one call
+        selectedFiles = set()
+        if diffIndex:
+            selectedFiles = (filterFiles or self._filterFiles)(
+                set(fname for diff in diffIndex for fname in _get_fnames(diff) if fname))
 
-        # t2: update_graph + git diff traversing time
-        t2 = time.monotonic()
-        # t2a: get_contents time
-        t2a = 0
-        # t2a: update_graph time
-        t2b = 0
-        if diff_index:
-            for diff in diff_index:
+        # filter monolithic commit
+        seekingMode = self._filter_monolithic_commit(commit, seekingMode, diffIndex, selectedFiles.__contains__)
+
+        prepared = _PreparedCommit(commit, parentCommit, seekingMode)
+        prepared.diffIndex = diffIndex
+        if prepared.diffIndex:
+            # (diff, old_fname, new_fname) of the files that pass the file-level filter
+            file_diffs = []
+            for diff in prepared.diffIndex:
                 old_fname, new_fname = _get_fnames(diff)
                 # apply file-level filter
                 # if a file comes into/goes from our view, we will set corresponding old_fname/new_fname to None,
                 # as if the file is introduced/removed in this commit.
                 # However, the diff will not change, regardless of whether the file has been filtered out or not.
-                if old_fname and not self._graphServer.filter_file(old_fname):
+                if old_fname and old_fname not in selectedFiles:
                     old_fname = None
-                if new_fname and not self._graphServer.filter_file(new_fname):
+                if new_fname and new_fname not in selectedFiles:
                     new_fname = None
                 if not old_fname and not new_fname:
                     # no modification
                     continue
+                file_diffs.append((diff, old_fname, new_fname))
 
-                old_src = new_src = None
+            # fetch the contents of all the files in this commit in one round-trip
+            t2a = time.monotonic()
+            contents = blobReader.get_contents(
+                [blob.hexsha for diff, old_fname, new_fname in file_diffs
+                 for blob, fname in ((diff.a_blob, old_fname), (diff.b_blob, new_fname))
+                 if fname and blob])
 
-                t2a0 = time.monotonic()
+            for diff, old_fname, new_fname in file_diffs:
+                old_src = new_src = None
                 if old_fname:
-                    old_src = get_contents(self._repo, parentCommit, old_fname)
+                    old_src = self._get_blob_contents(repo, contents, diff.a_blob, parentCommit, old_fname)
                     if self._file_is_too_large(old_fname, old_src):
                         continue
 
                 if new_fname:
-                    new_src = get_contents(self._repo, commit, new_fname)
+                    new_src = self._get_blob_contents(repo, contents, diff.b_blob, commit, new_fname)
                     if self._file_is_too_large(new_fname, new_src):
                         continue
-                t2a += time.monotonic() - t2a0
 
-                t2b0 = time.monotonic()
                 if old_src or new_src:
-                    result = self._graphServer.update_graph(
-                        old_fname, old_src, new_fname, new_src, diff.diff)
-                    if asyncio.iscoroutine(result):
-                        await result
-                t2b += time.monotonic() - t2b0
-        t2 = time.monotonic() - t2
+                    prepared.files.append((old_fname, old_src, new_fname, new_src, diff.diff))
+                    prepared.size += sum(sys.getsizeof(s) for s in (old_src, new_src, diff.diff) if s)
+            prepared.t2a = time.monotonic() - t2a
+        prepared.t0 = time.monotonic() - t0
+        return prepared
+
+    async def _applyCommit(self, prepared: "_PreparedCommit"):
+        """
+        Sends a prepared commit to the GraphServer.
+        """
+        # the prepared commit may come from a Repo owned by a worker thread
+        commit = prepared.commit
+        if commit.repo is not self._repo:
+            commit = self._repo.commit(commit.hexsha)
+        seekingMode = prepared.seekingMode
+
+        # t0: Total time usage
+        t0 = time.monotonic()
+        self._observer.onBeforeCommit(self, commit, seekingMode)
+
+        # t1: start_commit time
+        t1 = time.monotonic()
+        result = self._graphServer.start_commit(commit.hexsha, seekingMode,
+                                                commit.author.name, commit.author.email, commit.message)
+        if asyncio.iscoroutine(result):
+            await result
+        t1 = time.monotonic() - t1
+
+        # commit classification
+        if self._commit_classifier and commit.hexsha not in self._clf_results:
+            prob = self._commit_classifier.predict(commit, prepared.diffIndex, self._repo)
+            self._clf_results[commit.hexsha] = prob
+
+        # t2: update_graph + git diff traversing time
+        t2 = time.monotonic()
+        # t2a: get_contents time, spent in _prepareCommit
+        t2a = prepared.t2a
+        # t2b: update_graph time
+        if prepared.updates is not None:
+            self._graphServer.apply_updates(prepared.updates)
+        for old_fname, old_src, new_fname, new_src, patch in prepared.files:
+            result = self._graphServer.update_graph(old_fname, old_src, new_fname, new_src, patch)
+            if asyncio.iscoroutine(result):
+                await result
+        t2b = time.monotonic() - t2
+        t2 = t2b + prepared.t0
 
         # t3: end_commit time
         t3 = time.monotonic()
@@ -315,25 +576,42 @@ class Analyzer:
             await result
         t3 = time.monotonic() - t3
         self._observer.onAfterCommit(self, commit, seekingMode)
-        t0 = time.monotonic() - t0
+        t0 = time.monotonic() - t0 + prepared.t0
         _logger.info("t0 = %.2f, t1 = %.2f, t2 = %.2f, t2a = %.2f, t2b = %.2f, t3 = %.2f",
                      t0, t1, t2, t2a, t2b, t3)
         assert self._graphServer.get_workspace_commit_hexsha() == commit.hexsha, \
             "GraphServer.get_workspace_commit_hexsha should be return the hexsha seen in last start_commit."
 
-    def _filter_monolithic_commit(self, commit: Commit, seeking_mode: CommitSeekingMode) -> CommitSeekingMode:
+    def _get_blob_contents(self, repo: Repo, contents: Dict[str, str], blob,
+                           commit: Union[Commit, str], fname: str):
+        # Renamed files with identical content may have None blob in diff view.
+        if blob is not None and contents.get(blob.hexsha) is not None:
+            return contents[blob.hexsha]
+        return get_contents(repo, commit, fname)
+
+    def _filterFiles(self, fnames: Iterable[str]) -> Set[str]:
+        return set(fname for fname in fnames if self._graphServer.filter_file(fname))
+
+    def _filter_monolithic_commit(self, commit: Commit, seeking_mode: CommitSeekingMode,
+                                  diff_index: Optional[DiffIndex],
+                                  filter_file: Callable[[str], bool] = None) -> CommitSeekingMode:
         # filter monolithic commit
         # hot fix: enable filter_monolithic_commit on first commit
         if seeking_mode == CommitSeekingMode.NormalForward and len(commit.parents) <= 1:
+            # count the changed lines in the patches we already have, rather than with commit.stats,
+            # which runs another git diff --numstat
             changed_lines = 0
-            files = commit.stats.files
-            for fname in files:
-                if self._graphServer.filter_file(fname):
-                    changed_lines += files[fname]['lines']
-            print('_filter_monolithic_commit commit:', commit.hexsha, 'changed_lines:', changed_lines)
+            filter_file = filter_file or self._graphServer.filter_file
+            for diff in diff_index or ():
+                old_fname, new_fname = _get_fnames(diff)
+                fname = new_fname or old_fname
+                if fname and filter_file(fname):
+                    changed_lines += _get_changed_lines(diff)
+            _logger.debug("Commit %s changed %d lines.", commit.hexsha, changed_lines)
             if changed_lines > self._monolithic_commit_lines_threshold:
                 # enforce using CommitSeekingMode.MergeCommit to update graph without updating node history
-                print('_filter_monolithic_commit set CommitSeekingMode to MergeCommit')
+                _logger.info("Monolithic commit %s changed %d lines. Going forward as merge commit.",
+                             commit.hexsha, changed_lines)
                 return CommitSeekingMode.MergeCommit
         return seeking_mode
 
@@ -374,6 +652,213 @@ def _get_fnames(diff: Diff):
     return old_fname, new_fname
 
 
+def _get_changed_lines(diff: Diff) -> int:
+    # the added and removed lines in the patch, as counted by git diff --numstat
+    if not diff.diff:
+        return 0
+    return sum(1 for line in diff.diff.splitlines() if line[:1] in (b'+', b'-'))
+
+
+def _prepareShard(repositoryRoot: str, graphServer: GraphServer, options: Dict,
+                  steps: List[tuple], outPath: str) -> str:
+    """
+    Runs in a worker process of `Analyzer.analyze_sharded`. Reads the diff of each
+    (hexsha, parentCommit, seekingMode) step, and computes its graph updates with `graphServer`.
+    The (seekingMode, updates, commit classification) of the steps are pickled to outPath one by one,
+    so that they are not held in memory.
+    """
+    analyzer = Analyzer(repositoryRoot, graphServer, **options)
+    with open(outPath, "wb") as f:
+        for hexsha, parentCommit, seekingMode in steps:
+            prepared = analyzer._prepareCommit(hexsha, parentCommit, seekingMode,
+                                               analyzer._repo, analyzer._blob_reader)
+            updates = graphServer.compute_updates([file + (prepared.seekingMode,) for file in prepared.files])
+            prob = None
+            if analyzer._commit_classifier:
+                prob = analyzer._commit_classifier.predict(prepared.commit, prepared.diffIndex, analyzer._repo)
+            pickle.dump((prepared.seekingMode, updates, prob), f, protocol=pickle.HIGHEST_PROTOCOL)
+    return outPath
+
+
+async def _iterShardResults(futures):
+    """Yields the results pickled by `_prepareShard`, shard by shard, as each of them finishes."""
+    for future in futures:
+        outPath = await asyncio.wrap_future(future)
+        with open(outPath, "rb") as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    break
+        os.remove(outPath)
+
+
+class _AnalysisStep(NamedTuple):
+    """
+    A step planned by `Analyzer._iterAnalysisSteps`.
+    """
+    # the commit to check out; seekingMode is None if there is nothing to analyze for the step
+    commit: Optional[Commit]
+    parentCommit: Optional[str]
+    seekingMode: Optional[CommitSeekingMode]
+    # the commit being visited in the commit traversal
+    targetCommit: Commit
+    # the ordinal of targetCommit in current analysis session
+    ordinal: int
+    level: int
+    status: str
+
+
+class _PreparedCommit:
+    """
+    The result of `Analyzer._prepareCommit`, i.e. everything the GraphServer needs for a commit.
+    """
+
+    def __init__(self, commit: Commit, parentCommit: Optional[str], seekingMode: CommitSeekingMode):
+        self.commit = commit
+        self.parentCommit = parentCommit
+        self.seekingMode = seekingMode
+        self.diffIndex: Optional[DiffIndex] = None
+        # (old_fname, old_src, new_fname, new_src, patch) to be passed to GraphServer.update_graph
+        self.files = []
+        # approximate memory footprint of the file contents and patches, in bytes
+        self.size = 0
+        # graph updates computed ahead by `GraphServer.compute_updates`, which replace the files if not None
+        self.updates = None
+        self.t0 = 0
+        self.t2a = 0
+
+
+class _CommitPrefetcher:
+    """
+    Prepares the commits of the planned analysis steps on a thread pool, running ahead of
+    the GraphServer by at most `depth` steps, and yields them back in the planned order.
+    Prefetching pauses while the prepared-but-unconsumed commits occupy more than `memoryLimit` bytes.
+    The size of a commit is unknown until it is prepared, so each job reserves the mean size of
+    the commits prepared so far when submitted, and the reservation is settled when it completes;
+    the limit is thus approximate.
+    The GraphServer is only called on the event loop thread, including `filter_file`.
+    """
+
+    def __init__(self, analyzer: Analyzer, steps: Iterable[_AnalysisStep], depth: int,
+                 memoryLimit: int, workers: int = None):
+        assert depth > 0
+        self._analyzer = analyzer
+        self._steps = steps
+        self._depth = depth
+        self._memoryLimit = memoryLimit
+        self._workers = workers or min(depth, 4)
+        self._executor: ThreadPoolExecutor = None
+        self._queue: asyncio.Queue = None
+        self._memoryCond: asyncio.Condition = None
+        self._memoryUsage = 0
+        # the count and total size of the commits prepared so far
+        self._preparedCommits = 0
+        self._preparedBytes = 0
+        self._loop: asyncio.AbstractEventLoop = None
+        self._producer: asyncio.Task = None
+        # GitPython Repo is not thread-safe. Each worker thread owns its Repo and BlobReader.
+        self._local = threading.local()
+        self._blobReaders = []
+        self._blobReadersLock = threading.Lock()
+
+    async def __aenter__(self):
+        self._loop = asyncio.get_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="CommitPrefetcher")
+        self._queue = asyncio.Queue(maxsize=self._depth)
+        self._memoryCond = asyncio.Condition()
+        self._producer = asyncio.ensure_future(self._produce())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._producer.cancel()
+        try:
+            await self._producer
+        except asyncio.CancelledError:
+            pass
+        # drain the jobs still queued, so that no worker outlives the prefetcher
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if isinstance(item, tuple) and item[1]:
+                item[1].cancel()
+                try:
+                    await item[1]
+                except BaseException:
+                    pass
+        # a running job may still wait for filter_file on the event loop
+        await self._loop.run_in_executor(None, self._executor.shutdown)
+        with self._blobReadersLock:
+            for reader in self._blobReaders:
+                reader.close()
+            self._blobReaders.clear()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await self._queue.get()
+        if item is None:
+            raise StopAsyncIteration
+        if isinstance(item, Exception):
+            raise item
+        step, job = item
+        if job is None:
+            return step, None
+        prepared = await job
+        async with self._memoryCond:
+            self._memoryUsage -= prepared.size
+            self._memoryCond.notify_all()
+        return step, prepared
+
+    async def _produce(self):
+        try:
+            for step in self._steps:
+                job = None
+                if step.seekingMode is not None:
+                    async with self._memoryCond:
+                        await self._memoryCond.wait_for(lambda: self._memoryUsage < self._memoryLimit)
+                        reserved = self._preparedBytes // self._preparedCommits if self._preparedCommits else 0
+                        self._memoryUsage += reserved
+                    job = asyncio.ensure_future(self._prepare(step, reserved))
+                await self._queue.put((step, job))
+        except Exception as ex:
+            # surface planning errors to the consumer, after the steps planned so far
+            await self._queue.put(ex)
+            return
+        await self._queue.put(None)
+
+    async def _prepare(self, step: _AnalysisStep, reserved: int) -> _PreparedCommit:
+        prepared = None
+        try:
+            prepared = await self._loop.run_in_executor(self._executor, self._prepareOnWorker, step)
+        finally:
+            # replace the reservation with the actual size
+            async with self._memoryCond:
+                if prepared:
+                    self._preparedCommits += 1
+                    self._preparedBytes += prepared.size
+                    self._memoryUsage += prepared.size
+                self._memoryUsage -= reserved
+                self._memoryCond.notify_all()
+        return prepared
+
+    def _prepareOnWorker(self, step: _AnalysisStep) -> _PreparedCommit:
+        repo = getattr(self._local, "repo", None)
+        if repo is None:
+            repo = self._local.repo = Repo(self._analyzer._repositoryRoot)
+            self._local.blobReader = BlobReader(repo)
+            with self._blobReadersLock:
+                self._blobReaders.append(self._local.blobReader)
+        return self._analyzer._prepareCommit(step.commit.hexsha, step.parentCommit, step.seekingMode,
+                                             repo, self._local.blobReader, self._filterFilesOnLoop)
+
+    def _filterFilesOnLoop(self, fnames: Set[str]) -> Set[str]:
+        # called on a worker thread; the GraphServer is not thread-safe
+        async def filterFiles():
+            return self._analyzer._filterFiles(fnames)
+        return asyncio.run_coroutine_threadsafe(filterFiles(), self._loop).result()
+
+
 class AnalyzerObserver(ABC):
     """
     Used to observe the progress of `Analyzer` during its analysis of the target repository.
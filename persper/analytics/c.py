@@ -1,16 +1,22 @@
+import copy
 import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
 from persper.analytics.inverse_diff import inverse_diff
 from persper.analytics.srcml import src_to_tree
-from persper.analytics.call_graph.c import update_graph, get_func_ranges_c
+from persper.analytics.call_graph.c import PARSER_VERSION, parse_functions, update_graph_with_functions, \
+    get_func_ranges_from_functions
 from persper.analytics.detect_change import get_changed_functions
 from persper.analytics.patch_parser import PatchParser
 from persper.analytics.graph_server import CommitSeekingMode, GraphServer
 from persper.analytics.call_commit_graph import CallCommitGraph
+from persper.analytics.parse_cache import ParseCache, source_key
 
 
 def function_change_stats(old_ast, old_src, new_ast, new_src, patch, patch_parser, ranges_func):
     """
     Parse old/new source files and extract the change info for all functions
+    old_ast/new_ast can be anything accepted by ranges_func, e.g. srcML trees or parsed functions.
     """
     adds, dels = patch_parser(patch)
 
@@ -39,13 +45,57 @@ def function_change_stats(old_ast, old_src, new_ast, new_src, patch, patch_parse
     return forward_stats
 
 
+def parse_source(filename, src):
+    """
+    Parse a source file with srcML and extract its functions.
+    This is the unit of work of the parsing process pool, so it returns the compact,
+    picklable result of `parse_functions` together with the file name recorded by srcML
+    (see `src_to_tree`), or None if the file cannot be parsed.
+    """
+    root = src_to_tree(filename, src)
+    if root is None:
+        return None
+    return '/' + filename, parse_functions(root)
+
+
 class CGraphServer(GraphServer):
-    def __init__(self, filename_regex_strs):
-        self._ccgraph = CallCommitGraph()
+    def __init__(self, filename_regex_strs, parse_workers: int = 0,
+                 parse_cache: Optional[ParseCache] = None, graph: CallCommitGraph = None):
+        """
+        params
+            parse_workers   number of processes used to parse the files of a commit.
+                            Defaults to 0, which parses the files in current process.
+            parse_cache     if specified, the parsed functions of each source file are cached here,
+                            so that each unique file content is parsed only once.
+                            Use `CGraphServer.create_parse_cache` to create one.
+            graph           the call commit graph to update, e.g. a CompactCallCommitGraph for large repositories.
+        """
+        self._ccgraph = graph or CallCommitGraph()
         self._filename_regexes = [re.compile(regex_str) for regex_str in filename_regex_strs]
         self._pparser = PatchParser()
         self._seeking_mode = None
         self._workspace_commit_hexsha = None
+        self._parse_workers = parse_workers
+        self._parse_pool = None
+        self._parse_cache = parse_cache
+        # files passed to update_graph, waiting to be parsed in end_commit
+        self._pending_files = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_parse_pool'] = None
+        return state
+
+    @staticmethod
+    def create_parse_cache(path: str, max_bytes: int = 1024 * 1024 * 1024) -> ParseCache:
+        """
+        Create a parse cache stored at `path` that is valid for current version of the parser.
+        """
+        return ParseCache(path, 'srcml-c-{}'.format(PARSER_VERSION), max_bytes)
+
+    @property
+    def parse_cache(self) -> Optional[ParseCache]:
+        return self._parse_cache
 
     def start_commit(self, hexsha: str, seeking_mode: CommitSeekingMode,
                      author_name: str, author_email: str, commit_message: str):
@@ -63,41 +113,126 @@ class CGraphServer(GraphServer):
         return self._workspace_commit_hexsha
 
     def update_graph(self, old_filename, old_src, new_filename, new_src, patch):
-        ast_list = []
-        old_ast = None
-        new_ast = None
-
         # Do nothing if in rewind mode
         if self._seeking_mode == CommitSeekingMode.Rewind:
             return 0
 
-        # Parse source codes into ASTs
-        if old_src:
-            old_ast = src_to_tree(old_filename, old_src)
-            if old_ast is None:
-                return -1
+        # Source files are parsed together in end_commit, so that they can be parsed in parallel.
+        self._pending_files.append((old_filename, old_src, new_filename, new_src, patch, self._seeking_mode))
+        return 0
+
+    def end_commit(self, hexsha):
+        pending_files, self._pending_files = self._pending_files, []
+        self.apply_updates(self.compute_updates(pending_files))
 
-        if new_src:
-            new_ast = src_to_tree(new_filename, new_src)
-            if new_ast is None:
-                return -1
-            ast_list = [new_ast]
+    def compute_updates(self, files):
+        """
+        Parse the files of a commit and compute how each of them updates the graph.
+        This does not read or modify the graph, so it can run on a `copy_for_worker` in another process.
+
+        params
+            files   a list of (old_filename, old_src, new_filename, new_src, patch, seeking_mode)
+        returns
+            a list of (parsed_files, change_stats, new_fname_to_old_fname) to be passed to `apply_updates`
+        """
+        sources = []
+        for old_filename, old_src, new_filename, new_src, _, _ in files:
+            if old_src:
+                sources.append((old_filename, old_src))
+            if new_src:
+                sources.append((new_filename, new_src))
+        parsed = iter(self._parse_sources(sources))
+
+        updates = []
+        for old_filename, old_src, new_filename, new_src, patch, seeking_mode in files:
+            # consume the parse results of this file before any early exit
+            old_parsed = next(parsed) if old_src else None
+            new_parsed = next(parsed) if new_src else None
+            if (old_src and old_parsed is None) or (new_src and new_parsed is None):
+                continue
+            updates.append(self._compute_update(old_filename, old_src, old_parsed,
+                                                new_filename, new_src, new_parsed,
+                                                patch, seeking_mode))
+        return updates
+
+    def apply_updates(self, updates):
+        """Apply the updates returned by `compute_updates` to the graph, in order."""
+        for parsed_files, change_stats, new_fname_to_old_fname in updates:
+            update_graph_with_functions(self._ccgraph, parsed_files, change_stats, new_fname_to_old_fname)
+
+    def copy_for_worker(self) -> 'CGraphServer':
+        """
+        A copy of this server with an empty graph, which parses in its own process,
+        to run `compute_updates` in a worker process.
+        """
+        server = copy.copy(self)
+        server._ccgraph = CallCommitGraph()
+        server._parse_workers = 0
+        server._parse_pool = None
+        server._pending_files = []
+        return server
+
+    def after_analyze(self, exception):
+        self._pending_files = []
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown()
+            self._parse_pool = None
+
+    def _parse_sources(self, sources):
+        results = [None] * len(sources)
+        if self._parse_cache is None:
+            self._parse_sources_core(sources, results, range(len(sources)))
+            return results
+
+        keys = [source_key(filename, src) for filename, src in sources]
+        cached = self._parse_cache.get_many(keys)
+        # parse each unique source that is not in the cache only once
+        first_index = {}
+        for i, key in enumerate(keys):
+            if key not in cached:
+                first_index.setdefault(key, i)
+        self._parse_sources_core(sources, results, first_index.values())
+        self._parse_cache.put_many((key, results[i][1]) for key, i in first_index.items()
+                                   if results[i] is not None)
+        for i, (filename, _) in enumerate(sources):
+            key = keys[i]
+            if key in cached:
+                results[i] = '/' + filename, [tuple(f) for f in cached[key]]
+            elif results[i] is None and results[first_index[key]] is not None:
+                results[i] = '/' + filename, results[first_index[key]][1]
+        return results
+
+    def _parse_sources_core(self, sources, results, indices):
+        indices = list(indices)
+        if self._parse_workers <= 0 or len(indices) <= 1:
+            for i in indices:
+                results[i] = parse_source(*sources[i])
+            return
+        if self._parse_pool is None:
+            self._parse_pool = ProcessPoolExecutor(max_workers=self._parse_workers)
+        for i, result in zip(indices, self._parse_pool.map(parse_source, *zip(*(sources[i] for i in indices)))):
+            results[i] = result
+
+    def _compute_update(self, old_filename, old_src, old_parsed,
+                        new_filename, new_src, new_parsed, patch, seeking_mode):
+        old_functions = old_parsed[1] if old_parsed else None
+        new_functions = new_parsed[1] if new_parsed else None
+        parsed_files = [new_parsed] if new_parsed else []
 
         # Compute function change stats
         # Compatible with both the old and the new Analyzer
         change_stats = {}
-        if self._seeking_mode != CommitSeekingMode.MergeCommit:
-            change_stats = function_change_stats(old_ast, old_src, new_ast, new_src, patch,
+        if seeking_mode != CommitSeekingMode.MergeCommit:
+            change_stats = function_change_stats(old_functions, old_src, new_functions, new_src, patch,
                                                  self._parse_patch,
-                                                 get_func_ranges_c)
+                                                 get_func_ranges_from_functions)
 
         # Update call-commit graph
         new_fname_to_old_fname = {}
         if old_filename is not None and new_filename is not None and \
            old_filename != new_filename:
             new_fname_to_old_fname = {new_filename: old_filename}
-        update_graph(self._ccgraph, ast_list, change_stats, new_fname_to_old_fname)
-        return 0
+        return parsed_files, change_stats, new_fname_to_old_fname
 
     def get_graph(self):
         return self._ccgraph
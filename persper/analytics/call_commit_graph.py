@@ -6,10 +6,13 @@ CallCommitGraph stores all relevant analysis results
 import logging
 import community
 import networkx as nx
+import numpy as np
 from networkx.readwrite import json_graph
-from typing import Union, Set, List, Dict, Optional
+from typing import Callable, Union, Set, List, Dict, NamedTuple, Optional, Sequence, Tuple
 
-from persper.analytics.devrank import devrank
+from persper.analytics.csr import CsrGraph, digraph_to_csr
+from persper.analytics.devrank import DevRanks, DevRankStats, IncrementalDevRank, \
+    commit_devranks_from_edits, devrank_batch_from_csr, devrank_from_csr
 from persper.analytics.score import normalize
 from persper.analytics.complexity import eval_project_complexity
 
@@ -30,6 +33,91 @@ class CommitIdGenerators:
         return hexsha
 
 
+class EditTable(NamedTuple):
+    """
+    The node histories flattened into one row per (node, commit) edit:
+    row i is an edit of size sizes[i] to nodes[node_idx[i]] by the commit commits[commit_idx[i]].
+    """
+    nodes: List[str]
+    # commit hexshas
+    commits: List[str]
+    node_idx: np.ndarray
+    commit_idx: np.ndarray
+    sizes: np.ndarray
+
+    def node_sizes(self, black_set=None) -> np.ndarray:
+        """The total edit size of each node, ignoring the commits in black_set, and at least 1"""
+        sizes = self.sizes
+        if black_set is not None and len(self.commits):
+            black = np.array([sha in black_set for sha in self.commits], dtype=bool)
+            sizes = np.where(black[self.commit_idx], 0, sizes)
+        node_sizes = np.bincount(self.node_idx, weights=sizes, minlength=len(self.nodes)).astype(np.int64)
+        # set default size to 1 to avoid zero division error
+        node_sizes[node_sizes == 0] = 1
+        return node_sizes
+
+    def without_commits(self, black_set=None) -> 'EditTable':
+        """The rows whose commits are not in black_set"""
+        if black_set is None or not len(self.commits):
+            return self
+        keep = np.array([sha not in black_set for sha in self.commits], dtype=bool)[self.commit_idx]
+        return self._replace(node_idx=self.node_idx[keep], commit_idx=self.commit_idx[keep],
+                             sizes=self.sizes[keep])
+
+
+def developer_devranks_from_commits(commits: Dict, commit_devranks: Dict[str, float]) -> Dict[str, float]:
+    """Sum up the DevRanks of the commits by author email
+
+    Args:
+                commits - The commits dict of a call commit graph, see `CallCommitGraph.commits`.
+        commit_devranks - A dict from commit hexshas to DevRanks.
+    """
+    emails = {}
+    developers, ranks = [], []
+    for commit in commits.values():
+        sha = commit['hexsha']
+        if sha in commit_devranks:
+            developers.append(emails.setdefault(commit['authorEmail'], len(emails)))
+            ranks.append(commit_devranks[sha])
+    sums = np.bincount(np.array(developers, dtype=np.int64), weights=np.array(ranks, dtype=np.float64),
+                       minlength=len(emails))
+    return dict(zip(emails, sums.tolist()))
+
+
+def batch_devranks_from_edits(edits: EditTable, csr: CsrGraph, commits: Dict,
+                              scenarios: Sequence[Tuple[float, Optional[Set[str]]]]) -> List[DevRanks]:
+    """Solve DevRank for many (alpha, black_set) scenarios of a call graph at once
+
+    Args:
+            edits - The `EditTable` of the graph.
+              csr - The call graph, with the same node order as edits.
+          commits - The commits dict of the graph.
+        scenarios - A list of (alpha, black_set) pairs, black_set may be None.
+    """
+    assert csr.nodes == edits.nodes
+    if not scenarios:
+        return []
+    node_sizes = {}
+    keys = []
+    for _, black_set in scenarios:
+        key = None if black_set is None else frozenset(black_set)
+        if key not in node_sizes:
+            node_sizes[key] = edits.node_sizes(key)
+        keys.append(key)
+    sizes = np.column_stack([node_sizes[key] for key in keys])
+    ranks = devrank_batch_from_csr(csr, sizes, [alpha for alpha, _ in scenarios])
+
+    results = []
+    for j, key in enumerate(keys):
+        kept = edits.without_commits(key)
+        commit_vector, edited = commit_devranks_from_edits(ranks[:, j], sizes[:, j], kept.node_idx,
+                                                           kept.commit_idx, kept.sizes, len(kept.commits))
+        commit_devranks = {kept.commits[i]: commit_vector[i] for i in np.nonzero(edited)[0].tolist()}
+        results.append(DevRanks(dict(zip(edits.nodes, ranks[:, j].tolist())), commit_devranks,
+                                developer_devranks_from_commits(commits, commit_devranks)))
+    return results
+
+
 class CallCommitGraph:
     """
     The key data structure that stores all functions' call relationships
@@ -44,6 +132,33 @@ class CallCommitGraph:
             self._digraph = self._new_graph()
         self._commit_id_generator = commit_id_generator
         self._current_commit_id = None
+        self._mutation_listener = None
+        self._reset_incremental_devrank()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_mutation_listener'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if '_inc_devrank' not in state:
+            self._reset_incremental_devrank()
+        self.__dict__.setdefault('_mutation_listener', None)
+
+    def set_mutation_listener(self, listener: Optional[Callable[[str, tuple], None]]):
+        """
+        Set a callable to be called as listener(method_name, args) by each public method that
+        modifies the graph, before the modification. Calling getattr(graph, method_name)(*args)
+        in the same order on a copy of the graph reproduces the modifications.
+        The args are JSON serializable as long as node names and commit ids are.
+        The listener is not pickled.
+        """
+        self._mutation_listener = listener
+
+    def _notify(self, method_name: str, *args):
+        if self._mutation_listener is not None:
+            self._mutation_listener(method_name, args)
 
     @staticmethod
     def _to_networkx_format(graph_data: Dict) -> Dict:
@@ -55,8 +170,20 @@ class CallCommitGraph:
 
     def reset(self):
         """Reset all internal states"""
+        self._notify('reset')
         self._digraph = self._new_graph()
         self._digraph.degree()
+        self._reset_incremental_devrank()
+
+    def _reset_incremental_devrank(self):
+        # the state of incremental DevRank, which tracks the changes since the last call
+        # once function_devranks is called with incremental=True
+        self._inc_devrank: Optional[IncrementalDevRank] = None
+        self._inc_node_index: Dict[str, int] = {}
+        self._inc_new_nodes: List[str] = []
+        self._inc_new_edges = []
+        self._inc_dirty_nodes: Set[str] = set()
+        self._inc_black_set = None
 
     def _new_graph(self):
         """Create a new nx.DiGraph for underlying storage
@@ -85,6 +212,7 @@ class CallCommitGraph:
         return node in self._digraph
 
     def add_commit(self, hexsha, author_name, author_email, message):
+        self._notify('add_commit', hexsha, author_name, author_email, message)
         # TODO: remove `id` in a commit object
         self._current_commit_id = self._commit_id_generator(self._next_cindex(), hexsha, message)
         self._digraph.graph['commits'][hexsha] = {
@@ -104,13 +232,20 @@ class CallCommitGraph:
 
     # TODO: remove the default value of files
     def add_node(self, node: str, files: Union[Set[str], List[str]] = []):
+        self._notify('add_node', node, list(files))
         if node is None:
             _logger.error("Argument node is None in add_node.")
             return
+        if self._inc_devrank is not None:
+            if node in self._digraph:
+                self._inc_dirty_nodes.add(node)
+            else:
+                self._inc_new_nodes.append(node)
         self._digraph.add_node(node, size=None, history={}, files=set(files))
 
     # add_node must be called on source and target first
     def add_edge(self, source, target):
+        self._notify('add_edge', source, target)
         if source is None or target is None:
             _logger.error("Argument source or target is None in add_edge.")
             return
@@ -118,11 +253,14 @@ class CallCommitGraph:
             raise ValueError("Error: caller %s does not exist in call-commit graph." % source)
         if target not in self._digraph:
             raise ValueError("Error: callee %s does not exist in call-commit graph." % target)
+        if self._inc_devrank is not None and not self._digraph.has_edge(source, target):
+            self._inc_new_edges.append((source, target))
         self._digraph.add_edge(source, target,
                                addedBy=self._current_commit_id,
                                weight=None)
 
     def update_node_history(self, node, num_adds, num_dels):
+        self._notify('update_node_history', node, num_adds, num_dels)
         node_history = self._get_node_history(node)
         # A commit might update a node's history more than once when
         # a single FunctionNode corresponds to more than one actual functions
@@ -133,6 +271,7 @@ class CallCommitGraph:
             node_history[self._current_commit_id] = {'adds': num_adds, 'dels': num_dels}
 
     def update_node_history_accurate(self, node, fstat):
+        self._notify('update_node_history_accurate', node, dict(fstat))
         node_history = self._get_node_history(node)
         # A commit might update a node's history more than once when
         # a single FunctionNode corresponds to more than one actual functions
@@ -150,36 +289,74 @@ class CallCommitGraph:
         if node is None:
             _logger.error("Argument node is None in _get_node_history.")
             return {}
-        return self._digraph.nodes[node]['history']
+        history = self._digraph.nodes[node]['history']
+        if self._inc_devrank is not None:
+            self._inc_dirty_nodes.add(node)
+        return history
 
     def update_node_files(self, node: str, new_files: Union[Set[str], List[str]]):
+        self._notify('update_node_files', node, list(new_files))
         if node is None:
             _logger.error("Argument node is None in update_node_files")
             return
         self._digraph.nodes[node]['files'] = set(new_files)
 
     # TODO: provide other options for computing a node's size
-    def _set_all_nodes_size(self, black_set=None):
+    def _set_all_nodes_size(self, black_set=None, edits: EditTable = None):
         """ Compute node size after nodes have been added to the graph
         node size is currently defined as the total number lines of edits
 
         black_set - A set of commit hexshas to be blacklisted
+            edits - The `edit_table` to compute from, if already built
         """
-        for node in self.nodes():
-            node_history = self._get_node_history(node)
-            size = 0
-            for cid, chist in node_history.items():
-                sha = self.commits()[cid]['hexsha']
-                if black_set is not None and sha in black_set:
-                    continue
-                if 'added_units' in chist.keys() and 'removed_units' in chist.keys():
-                    size += (chist['added_units'] + chist['removed_units'])
-                else:
-                    size += (chist['adds'] + chist['dels'])
-            # set default size to 1 to avoid zero division error
-            if size == 0:
-                size = 1
+        if edits is None:
+            edits = self.edit_table()
+        sizes = edits.node_sizes(black_set)
+        for node, size in zip(edits.nodes, sizes.tolist()):
             self._set_node_size(node, size)
+        return sizes
+
+    def edit_table(self) -> EditTable:
+        """Flatten the history of all nodes into an `EditTable`, in one pass"""
+        nodes = []
+        node_idx, commit_idx, sizes = [], [], []
+        shas, sha_index, cid_index = [], {}, {}
+        commits = self.commits()
+        for node, data in self._digraph.nodes(data=True):
+            i = len(nodes)
+            nodes.append(node)
+            for cid, chist in data['history'].items():
+                j = cid_index.get(cid)
+                if j is None:
+                    sha = commits[cid]['hexsha']
+                    j = sha_index.get(sha)
+                    if j is None:
+                        j = sha_index[sha] = len(shas)
+                        shas.append(sha)
+                    cid_index[cid] = j
+                if 'added_units' in chist and 'removed_units' in chist:
+                    sizes.append(chist['added_units'] + chist['removed_units'])
+                else:
+                    sizes.append(chist['adds'] + chist['dels'])
+                node_idx.append(i)
+                commit_idx.append(j)
+        return EditTable(nodes, shas, np.array(node_idx, dtype=np.int64),
+                         np.array(commit_idx, dtype=np.int64), np.array(sizes, dtype=np.int64))
+
+    def _compute_node_size(self, node, black_set=None):
+        size = 0
+        for cid, chist in self._digraph.nodes[node]['history'].items():
+            sha = self.commits()[cid]['hexsha']
+            if black_set is not None and sha in black_set:
+                continue
+            if 'added_units' in chist.keys() and 'removed_units' in chist.keys():
+                size += (chist['added_units'] + chist['removed_units'])
+            else:
+                size += (chist['adds'] + chist['dels'])
+        # set default size to 1 to avoid zero division error
+        if size == 0:
+            size = 1
+        return size
 
     def _set_node_size(self, node, size):
         if node is None:
@@ -206,68 +383,131 @@ class CallCommitGraph:
         if None in self.nodes():
             self._digraph.remove_node(None)
 
-    def function_devranks(self, alpha, black_set=None):
+    def function_devranks(self, alpha, black_set=None, incremental=False):
         """
         Args:
                 alpha - A float between 0 and 1, commonly set to 0.85
             black_set - A set of commit hexshas to be blacklisted
+          incremental - Whether to keep the DevRank state, so that the next incremental call
+                        only applies the changes since this call, and starts from this result.
+                        See `devrank_stats` for the convergence information.
         """
         self._remove_invalid_nodes()
+        if incremental:
+            return self._incremental_function_devranks(alpha, black_set)
         self._set_all_nodes_size(black_set=black_set)
-        return devrank(self._digraph, 'size', alpha=alpha)
+        csr = self.to_csr()
+        return dict(zip(csr.nodes, devrank_from_csr(csr, alpha=alpha).tolist()))
 
-    def commit_devranks(self, alpha, black_set=None):
+    def devranks(self, alpha, black_set=None, incremental=False) -> DevRanks:
         """
+        Compute function, commit and developer DevRanks together, solving DevRank only once.
+
         Args:
                 alpha - A float between 0 and 1, commonly set to 0.85
             black_set - A set of commit hexshas to be blacklisted
+          incremental - See `function_devranks`
         """
-        commit_devranks = {}
-        func_devranks = self.function_devranks(alpha, black_set=black_set)
-
-        for func, data in self.nodes(data=True):
-            size = data['size']
-            history = data['history']
+        self._remove_invalid_nodes()
+        edits = self.edit_table()
+        if incremental:
+            func_devranks = self._incremental_function_devranks(alpha, black_set)
+            node_sizes = np.array([self._digraph.nodes[node]['size'] for node in edits.nodes], dtype=np.int64)
+            func_vector = np.array([func_devranks[node] for node in edits.nodes], dtype=np.float64)
+        else:
+            node_sizes = self._set_all_nodes_size(black_set=black_set, edits=edits)
+            csr = self.to_csr()
+            func_vector = devrank_from_csr(csr, alpha=alpha)
+            func_devranks = dict(zip(csr.nodes, func_vector.tolist()))
+
+        kept = edits.without_commits(black_set)
+        commit_vector, edited = commit_devranks_from_edits(func_vector, node_sizes, kept.node_idx, kept.commit_idx,
+                                                           kept.sizes, len(kept.commits))
+        commit_devranks = {kept.commits[j]: commit_vector[j] for j in np.nonzero(edited)[0].tolist()}
+        developer_devranks = developer_devranks_from_commits(self.commits(), commit_devranks)
+        return DevRanks(func_devranks, commit_devranks, developer_devranks)
+
+    def to_csr(self, with_sizes=True) -> CsrGraph:
+        """Export the call graph as integer index arrays in CSR format (rows are callers)
+
+        with_sizes - Whether to export node sizes, which are set by `function_devranks`
+        """
+        return digraph_to_csr(self._digraph, 'size' if with_sizes else None)
+
+    @property
+    def devrank_stats(self) -> Optional[DevRankStats]:
+        """The iteration count and residual of the last incremental DevRank, if any."""
+        return self._inc_devrank.stats if self._inc_devrank is not None else None
+
+    def _incremental_function_devranks(self, alpha, black_set=None):
+        if self._inc_devrank is None:
+            self._inc_devrank = IncrementalDevRank()
+            self._inc_new_nodes = list(self.nodes())
+            self._inc_new_edges = list(self.edges())
+            self._inc_black_set = None if black_set is None else set(black_set)
+            self._set_all_nodes_size(black_set=black_set)
+            dirty_nodes = None
+        elif (black_set is None) != (self._inc_black_set is None) or \
+                (black_set is not None and set(black_set) != self._inc_black_set):
+            self._inc_black_set = None if black_set is None else set(black_set)
+            self._set_all_nodes_size(black_set=black_set)
+            dirty_nodes = None
+        else:
+            dirty_nodes = self._inc_dirty_nodes.union(self._inc_new_nodes)
+
+        inc = self._inc_devrank
+        node_index = self._inc_node_index
+        for node in self._inc_new_nodes:
+            node_index[node] = len(node_index)
+        inc.add_nodes(len(self._inc_new_nodes))
+        inc.add_edges([node_index[u] for u, _ in self._inc_new_edges],
+                      [node_index[v] for _, v in self._inc_new_edges])
+        if dirty_nodes is None:
+            inc.set_sizes([self._digraph.nodes[node]['size'] for node in node_index])
+        else:
+            sizes = []
+            for node in dirty_nodes:
+                size = self._compute_node_size(node, black_set)
+                self._set_node_size(node, size)
+                sizes.append(size)
+            inc.update_sizes([node_index[node] for node in dirty_nodes], sizes)
+        self._inc_new_nodes = []
+        self._inc_new_edges = []
+        self._inc_dirty_nodes = set()
+
+        ranks = inc.solve(alpha)
+        return dict(zip(node_index, ranks.tolist()))
+
+    def batch_devranks(self, scenarios: Sequence[Tuple[float, Optional[Set[str]]]]) -> List[DevRanks]:
+        """
+        Compute `devranks` for each (alpha, black_set) scenario, sharing the call graph export
+        and solving all the scenarios as one multi-column power iteration.
+        Node sizes are not stored in the graph, since they differ by black_set.
 
-            if len(history) == 0:
-                continue
+        Args:
+            scenarios - A list of (alpha, black_set) pairs, black_set may be None.
+        """
+        self._remove_invalid_nodes()
+        return batch_devranks_from_edits(self.edit_table(), self.to_csr(with_sizes=False),
+                                         self.commits(), scenarios)
 
-            for cid, chist in history.items():
-                if 'added_units' in chist.keys() and 'removed_units' in chist.keys():
-                    csize = (chist['added_units'] + chist['removed_units'])
-                else:
-                    csize = (chist['adds'] + chist['dels'])
-                sha = self.commits()[cid]['hexsha']
-                if black_set is None or sha not in black_set:
-                    dr = (csize / size) * func_devranks[func]
-                    if sha in commit_devranks:
-                        commit_devranks[sha] += dr
-                    else:
-                        commit_devranks[sha] = dr
-
-        return commit_devranks
-
-    def developer_devranks(self, alpha, black_set=None):
+    def commit_devranks(self, alpha, black_set=None, incremental=False):
         """
         Args:
                 alpha - A float between 0 and 1, commonly set to 0.85
             black_set - A set of commit hexshas to be blacklisted
+          incremental - See `function_devranks`
         """
-        developer_devranks = {}
-        commit_devranks = self.commit_devranks(alpha, black_set=black_set)
-
-        for commit in self.commits().values():
-            sha = commit['hexsha']
-            email = commit['authorEmail']
+        return self.devranks(alpha, black_set=black_set, incremental=incremental).commit
 
-            if sha not in commit_devranks:
-                continue
-
-            if email in developer_devranks:
-                developer_devranks[email] += commit_devranks[sha]
-            else:
-                developer_devranks[email] = commit_devranks[sha]
-        return developer_devranks
+    def developer_devranks(self, alpha, black_set=None, incremental=False):
+        """
+        Args:
+                alpha - A float between 0 and 1, commonly set to 0.85
+            black_set - A set of commit hexshas to be blacklisted
+          incremental - See `function_devranks`
+        """
+        return self.devranks(alpha, black_set=black_set, incremental=incremental).developer
 
     def compute_modularity(self):
         """Compute modularity score based on function graph.
@@ -2,6 +2,9 @@ from persper.analytics.call_graph.utils import ns, line_attr
 from typing import Set
 from persper.analytics.error import UnexpectedASTError
 
+# Bump this whenever the output of parse_functions changes, to invalidate the parse caches.
+PARSER_VERSION = 1
+
 
 class UnexpectedNameNodeError(UnexpectedASTError):
     """Raise for unexpected function name node"""
@@ -163,16 +166,54 @@ def _handle_call(call_node):
     return callee_name
 
 
-def update_graph(ccgraph, ast_list, change_stats, new_fname_to_old_fname):
-    for ast in ast_list:
-        filename = ast.attrib['filename']
-        for function in ast.findall('./srcml:function', namespaces=ns):
+def parse_functions(root):
+    """Extract the functions defined in a srcML tree
+
+    Args:
+        root: the root node of a srcML tree
+
+    Returns:
+        list: a (name, start_line, end_line, callee_names) tuple for each function
+            that can be parsed, in document order. This compact form is cheap to
+            pickle and can be used in place of the tree by `update_graph_with_functions`
+            and `get_func_ranges_from_functions`.
+    """
+    functions = []
+    for func_node in root.findall('./srcml:function', namespaces=ns):
+        try:
+            func_name, start_line, end_line = _handle_function(func_node)
+        except UnexpectedFunctionNodeError as e:
+            print(type(e).__name__, e.args)
+            continue
+
+        callee_names = []
+        for call in func_node.xpath('.//srcml:call', namespaces=ns):
             try:
-                caller_name, _, _ = _handle_function(function)
-            except UnexpectedFunctionNodeError as e:
+                callee_name = _handle_call(call)
+            except NotFunctionCallError as e:
+                # do not print error since we expect this to happen a lot
+                continue
+            except UnexpectedCallNodeError as e:
                 print(type(e).__name__, e.args)
                 continue
+            callee_names.append(callee_name)
 
+        # adding the same edge twice is a no-op
+        functions.append((func_name, start_line, end_line, list(dict.fromkeys(callee_names))))
+    return functions
+
+
+def update_graph(ccgraph, ast_list, change_stats, new_fname_to_old_fname):
+    parsed_files = [(ast.attrib['filename'], parse_functions(ast)) for ast in ast_list]
+    update_graph_with_functions(ccgraph, parsed_files, change_stats, new_fname_to_old_fname)
+
+
+def update_graph_with_functions(ccgraph, parsed_files, change_stats, new_fname_to_old_fname):
+    """Same as `update_graph`, but takes (filename, functions) tuples
+    with functions returned by `parse_functions`
+    """
+    for filename, functions in parsed_files:
+        for caller_name, _, _, callee_names in functions:
             if caller_name not in ccgraph:
                 ccgraph.add_node(caller_name, [filename])
             else:
@@ -189,16 +230,7 @@ def update_graph(ccgraph, ast_list, change_stats, new_fname_to_old_fname):
                     files.add(filename)
                     ccgraph.update_node_files(caller_name, files)
 
-            for call in function.xpath('.//srcml:call', namespaces=ns):
-                try:
-                    callee_name = _handle_call(call)
-                except NotFunctionCallError as e:
-                    # do not print error since we expect this to happen a lot
-                    continue
-                except UnexpectedCallNodeError as e:
-                    print(type(e).__name__, e.args)
-                    continue
-
+            for callee_name in callee_names:
                 if callee_name not in ccgraph:
                     # Pass [] to files argument since we don't know
                     # which file this node belongs to
@@ -226,3 +258,12 @@ def get_func_ranges_c(root):
         func_ranges.append([start_line, end_line])
         func_names.append(func_name)
     return func_names, func_ranges
+
+
+def get_func_ranges_from_functions(functions):
+    """Same as `get_func_ranges_c`, but takes the result of `parse_functions`"""
+    func_names, func_ranges = [], []
+    for func_name, start_line, end_line, _ in functions:
+        func_ranges.append([start_line, end_line])
+        func_names.append(func_name)
+    return func_names, func_ranges
@@ -0,0 +1,295 @@
+"""
+checkpoint.py
+====================================
+Incremental checkpoints of an `analyzer2.Analyzer` run
+"""
+import json
+import logging
+import os
+import struct
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from persper.analytics.call_commit_graph import CallCommitGraph
+from persper.analytics.graph_snapshot import load_snapshot, save_snapshot
+
+_logger = logging.getLogger(__name__)
+
+CHECKPOINT_VERSION = 2
+
+_BITMAP_MAGIC = b'PCKPBMAP'
+_BITMAP_HEADER = struct.Struct('<8sI')
+_RECORD = struct.Struct('<I')
+
+# the graph methods that can be replayed from the mutation log
+_REPLAYABLE = {'reset', 'add_commit', 'add_node', 'add_edge', 'update_node_history',
+               'update_node_history_accurate', 'update_node_files'}
+
+
+class CheckpointError(ValueError):
+    pass
+
+
+def _check_graph(graph):
+    if not isinstance(graph, CallCommitGraph):
+        raise CheckpointError("Only a CallCommitGraph can be checkpointed, got {0}.".format(type(graph).__name__))
+
+
+def _base_name(generation: int) -> str:
+    return 'base.snapshot' if generation == 0 else 'base.{0}.snapshot'.format(generation)
+
+
+def _classifications_name(generation: int) -> str:
+    return 'classifications.{0}.json'.format(generation)
+
+
+def _fsync_file(path: str):
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+
+
+class AnalysisCheckpoint:
+    """
+    A checkpoint of the CallCommitGraph and the visited commits of an analysis, kept in a directory as
+
+        base.snapshot   the graph the log starts from, if it was not empty (see `graph_snapshot`),
+                        named base.<generation>.snapshot once the checkpoint has been compacted
+        classifications.<generation>.json
+                        the commit classification results of the records folded into the base, if any
+        mutations.log   an append-only log with a record per visited commit, holding the graph
+                        mutations made while analyzing it (see `CallCommitGraph.set_mutation_listener`)
+        visited.bitmap  the visited commits, as a bitmap over the commits to analyze in topological order,
+                        along with the generation of the base and the length of the log it is consistent with
+
+    Records are appended as commits are visited. Every `interval` commits, the log is synced and
+    the bitmap is atomically replaced. On restore, log records beyond the length in the bitmap
+    are discarded, so a crashed analysis resumes from its last `save`.
+
+    Every `compact_interval` saves, the log is folded into a new base snapshot of the graph, so that
+    restoring does not replay the whole analysis. The bitmap switches to the new generation with an
+    empty log before the log is truncated and the old base removed.
+
+    The commits to analyze are described by a spec, a dict of 'terminal', 'origin' (hexshas)
+    and 'firstParentOnly', and listed by a `list_commits(spec)` callable provided by the analyzer.
+
+    Only a CallCommitGraph can be checkpointed, as the base snapshot is restored with
+    `graph_snapshot.load_snapshot`; other graphs (e.g. CompactCallCommitGraph) raise CheckpointError.
+    """
+
+    def __init__(self, path: str, interval: int = 100, compact_interval: int = 10):
+        self._path = path
+        self._interval = interval
+        self._compact_interval = compact_interval
+        self._generation = 0
+        # saves since the last compaction
+        self._saves = 0
+        # the commit classification results of all the records, to keep when the log is compacted
+        self._clf_results: Dict[str, list] = {}
+        self._log = None
+        self._graph = None
+        self._pending_ops: List[list] = []
+        self._spec: Optional[Dict] = None
+        self._commits: List[str] = []
+        self._commit_index: Dict[str, int] = {}
+        self._bits = bytearray()
+        self._extra_visited: List[str] = []
+        self._unsaved = 0
+
+    @property
+    def path(self):
+        return self._path
+
+    def _file(self, name):
+        return os.path.join(self._path, name)
+
+    def exists(self) -> bool:
+        return os.path.isfile(self._file('visited.bitmap'))
+
+    def create(self, graph):
+        """Start a new checkpoint of the graph, discarding the existing one if any"""
+        _check_graph(graph)
+        os.makedirs(self._path, exist_ok=True)
+        if self.exists():
+            os.remove(self._file('visited.bitmap'))
+        for name in os.listdir(self._path):
+            if name.startswith(('base.', 'classifications.')):
+                os.remove(self._file(name))
+        self._generation = 0
+        self._saves = 0
+        self._clf_results = {}
+        if len(graph.nodes()) or len(graph.commits()):
+            save_snapshot(graph, self._file(_base_name(0)))
+        self._log = open(self._file('mutations.log'), 'wb')
+
+    def restore(self, graph, list_commits: Callable[[Dict], List[str]]) -> Tuple[Set[str], Dict[str, list]]:
+        """
+        Replay the checkpoint into the graph, which is reset first.
+        Returns the visited commits and the commit classification results.
+        """
+        _check_graph(graph)
+        header, bits = self._read_bitmap()
+        commits = list_commits(header['spec'])
+        if len(commits) != header['numCommits']:
+            raise CheckpointError("The commits to analyze have changed since the checkpoint was saved: "
+                                  "expected {0}, got {1}.".format(header['numCommits'], len(commits)))
+        visited = set(header['extraVisited'])
+        for i, sha in enumerate(commits):
+            if bits[i >> 3] & (1 << (i & 7)):
+                visited.add(sha)
+
+        generation = header.get('generation', 0)
+        if os.path.isfile(self._file(_base_name(generation))):
+            load_snapshot(self._file(_base_name(generation)), graph=graph)
+        else:
+            graph.reset()
+        clf_results = {}
+        if os.path.isfile(self._file(_classifications_name(generation))):
+            with open(self._file(_classifications_name(generation)), 'rt', encoding='utf-8') as f:
+                clf_results.update(json.load(f))
+        log_offset = header['logOffset']
+        records = 0
+        with open(self._file('mutations.log'), 'rb') as log:
+            while log.tell() < log_offset:
+                length, = _RECORD.unpack(log.read(_RECORD.size))
+                record = json.loads(log.read(length).decode('utf-8'))
+                for method_name, args in record['ops']:
+                    if method_name not in _REPLAYABLE:
+                        raise CheckpointError("Cannot replay {0}.".format(method_name))
+                    getattr(graph, method_name)(*args)
+                if record['clf'] is not None:
+                    clf_results[record['commit']] = record['clf']
+                records += 1
+        # drop the records written after the last save
+        self._log = open(self._file('mutations.log'), 'r+b')
+        self._log.truncate(log_offset)
+        self._log.seek(log_offset)
+        self._generation = generation
+        self._saves = 0
+        self._clf_results = dict(clf_results)
+        _logger.info("Restored %d commits from checkpoint %s.", records, self._path)
+        return visited, clf_results
+
+    def reopen(self):
+        """Reopen the log after `close`, to append the records of another analysis run"""
+        if self._log is None:
+            self._log = open(self._file('mutations.log'), 'ab')
+
+    def set_commits(self, spec: Dict, commits: List[str], visited: Iterable[str]):
+        """Set the commits to analyze, over which the visited commits are kept as a bitmap"""
+        if spec == self._spec and len(commits) == len(self._commits):
+            return
+        self._spec = dict(spec)
+        self._commits = commits
+        self._commit_index = {sha: i for i, sha in enumerate(commits)}
+        self._bits = bytearray((len(commits) + 7) // 8)
+        self._extra_visited = []
+        for sha in visited:
+            self._mark_visited(sha)
+
+    def _mark_visited(self, sha: str):
+        i = self._commit_index.get(sha)
+        if i is None:
+            self._extra_visited.append(sha)
+        else:
+            self._bits[i >> 3] |= 1 << (i & 7)
+
+    def attach(self, graph):
+        """Start recording the mutations of the graph"""
+        self._graph = graph
+        self._pending_ops = []
+        graph.set_mutation_listener(self._on_mutation)
+
+    def detach(self):
+        if self._graph is not None:
+            self._graph.set_mutation_listener(None)
+            self._graph = None
+        # mutations of an unfinished commit
+        self._pending_ops = []
+
+    def _on_mutation(self, method_name: str, args: tuple):
+        self._pending_ops.append([method_name, args])
+
+    def record_commit(self, hexsha: str, clf_result: Optional[list] = None):
+        """Append the mutations since the last record as the record of a visited commit"""
+        if clf_result is not None:
+            clf_result = [float(p) for p in clf_result]
+            self._clf_results[hexsha] = clf_result
+        data = json.dumps({'commit': hexsha, 'ops': self._pending_ops, 'clf': clf_result},
+                          separators=(',', ':')).encode('utf-8')
+        self._pending_ops = []
+        self._log.write(_RECORD.pack(len(data)))
+        self._log.write(data)
+        self._mark_visited(hexsha)
+        self._unsaved += 1
+        if self._unsaved >= self._interval:
+            self.save()
+
+    def save(self):
+        """Make the records so far durable, compacting the checkpoint every `compact_interval` saves"""
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._saves += 1
+        # the graph is consistent with the log only between commits
+        if self._compact_interval and self._saves >= self._compact_interval \
+                and self._graph is not None and not self._pending_ops:
+            self._compact()
+        else:
+            self._write_bitmap(self._generation, self._log.tell())
+        self._unsaved = 0
+
+    def _compact(self):
+        """Fold the log into a new base snapshot of the graph"""
+        generation = self._generation + 1
+        save_snapshot(self._graph, self._file(_base_name(generation)))
+        _fsync_file(self._file(_base_name(generation)))
+        if self._clf_results:
+            path = self._file(_classifications_name(generation))
+            with open(path + '.tmp', 'wt', encoding='utf-8') as f:
+                json.dump(self._clf_results, f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + '.tmp', path)
+        # the checkpoint switches to the new base here
+        self._write_bitmap(generation, 0)
+        self._log.seek(0)
+        self._log.truncate()
+        for name in (_base_name(self._generation), _classifications_name(self._generation)):
+            if os.path.exists(self._file(name)):
+                os.remove(self._file(name))
+        _logger.info("Compacted checkpoint %s into generation %d.", self._path, generation)
+        self._generation = generation
+        self._saves = 0
+
+    def _write_bitmap(self, generation: int, log_offset: int):
+        header = json.dumps({
+            'version': CHECKPOINT_VERSION,
+            'spec': self._spec,
+            'numCommits': len(self._commits),
+            'generation': generation,
+            'logOffset': log_offset,
+            'extraVisited': self._extra_visited,
+        }).encode('utf-8')
+        tmp_path = self._file('visited.bitmap.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(_BITMAP_HEADER.pack(_BITMAP_MAGIC, len(header)))
+            f.write(header)
+            f.write(self._bits)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._file('visited.bitmap'))
+
+    def _read_bitmap(self) -> Tuple[Dict, bytes]:
+        with open(self._file('visited.bitmap'), 'rb') as f:
+            magic, length = _BITMAP_HEADER.unpack(f.read(_BITMAP_HEADER.size))
+            if magic != _BITMAP_MAGIC:
+                raise CheckpointError("{0} is not a checkpoint.".format(self._path))
+            header = json.loads(f.read(length).decode('utf-8'))
+            if header['version'] > CHECKPOINT_VERSION:
+                raise CheckpointError("Checkpoint version {0} is not supported.".format(header['version']))
+            return header, f.read()
+
+    def close(self):
+        """Stop recording and close the log; the records since the last `save` are not synced"""
+        self.detach()
+        if self._log is not None:
+            self._log.close()
+            self._log = None
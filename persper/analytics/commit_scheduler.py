@@ -0,0 +1,217 @@
+"""
+commit_scheduler.py
+====================================
+The order in which `analyzer2.Analyzer` visits commits
+"""
+import bisect
+import logging
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from git import Commit, Repo
+
+from persper.analytics.git_tools import EMPTY_TREE_SHA
+from persper.analytics.history_index import HistoryIndex
+
+_logger = logging.getLogger(__name__)
+
+
+class ScheduleStats(NamedTuple):
+    """The rewinds of a schedule, and of git's topological order of the same commits"""
+    rewinds: int
+    rewind_files: int
+    git_rewinds: int
+    git_rewind_files: int
+
+    @property
+    def saved_rewinds(self) -> int:
+        return self.git_rewinds - self.rewinds
+
+    @property
+    def saved_files(self) -> int:
+        return self.git_rewind_files - self.rewind_files
+
+
+class CommitScheduler(ABC):
+    """
+    Defines the interface of any commit scheduler
+    """
+
+    @abstractmethod
+    def schedule(self, commits: List[Commit], workspace_commit: Optional[str],
+                 first_parent_only: bool) -> List[Commit]:
+        """
+        Args:
+            commits: A list of gitpython's Commit objects to analyze, in git's topological order
+                (parents first). Parents that are not in the list are already analyzed.
+            workspace_commit: The hexsha of the commit the workspace is at, or None if it is empty.
+            first_parent_only: Whether the analyzer only follows the first parents of merge commits.
+
+        Returns:
+            The same commits in a topological order.
+        """
+        pass
+
+
+class GitOrderScheduler(CommitScheduler):
+    """
+    Visits the commits in git's topological order, i.e. the default order of the analyzer
+    """
+
+    def schedule(self, commits, workspace_commit, first_parent_only):
+        return list(commits)
+
+
+class MinRewindScheduler(CommitScheduler):
+    """
+    Reduces the rewinds between consecutive commits, and the files they change in the workspace.
+
+    The order is built greedily: the next commit is one whose parents have all been
+    scheduled and that continues from the current workspace commit (so the chain of a branch
+    is finished before switching to another one). If there is none, it is the one with the
+    least changed files to rewind, among the first `max_candidates` ready commits in git's order.
+
+    With a `history_index`, the parents are read from the index, and the files changed between
+    two indexed commits are estimated from its numstat: the files changed along their first-parent
+    chains, down to the first commit the chains share. This is an upper bound of the count of
+    `git diff-tree`, which is only run for the commits outside the index.
+
+    The stats of the last schedule, compared with git's order, are kept in `stats`.
+    """
+
+    def __init__(self, max_candidates: int = 16, history_index: Optional[HistoryIndex] = None):
+        self._max_candidates = max_candidates
+        self._history_index = history_index
+        self._diff_sizes: Dict[Tuple[str, str], int] = {}
+        self._repo: Optional[Repo] = None
+        self.stats: Optional[ScheduleStats] = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_repo'] = None
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault('_history_index', None)
+        self.__dict__.update(state)
+
+    def schedule(self, commits, workspace_commit, first_parent_only):
+        if len(commits) <= 1:
+            return list(commits)
+        self._repo = commits[0].repo
+        index = {c.hexsha: i for i, c in enumerate(commits)}
+        pending_parents = [0] * len(commits)
+        children = defaultdict(list)
+        for i, commit in enumerate(commits):
+            for parent in self._parents(commit):
+                if parent in index:
+                    pending_parents[i] += 1
+                    children[parent].append(i)
+        # the indices of the commits whose parents have all been scheduled, in git's order
+        ready = [i for i, count in enumerate(pending_parents) if count == 0]
+
+        order = []
+        last = workspace_commit
+        while ready:
+            pos = next((pos for pos, i in enumerate(ready)
+                        if self._continues(commits[i], last, first_parent_only)), None)
+            if pos is None:
+                candidates = range(min(len(ready), self._max_candidates))
+                pos = min(candidates, key=lambda pos: self._rewind_size(commits[ready[pos]], last, first_parent_only))
+            commit = commits[ready.pop(pos)]
+            order.append(commit)
+            last = commit.hexsha
+            for child in children[commit.hexsha]:
+                pending_parents[child] -= 1
+                if pending_parents[child] == 0:
+                    bisect.insort(ready, child)
+
+        self.stats = ScheduleStats(*self.rewinds(order, workspace_commit, first_parent_only),
+                                   *self.rewinds(commits, workspace_commit, first_parent_only))
+        _logger.info("Scheduled %d commits with %d rewinds (%d files), saving %d rewinds (%d files).",
+                     len(order), self.stats.rewinds, self.stats.rewind_files,
+                     self.stats.saved_rewinds, self.stats.saved_files)
+        return order
+
+    def rewinds(self, commits: List[Commit], workspace_commit: Optional[str],
+                first_parent_only: bool) -> Tuple[int, int]:
+        """
+        Returns:
+            The number of rewinds the analyzer makes when visiting the commits in the given order,
+            and the total number of files they change in the workspace.
+        """
+        self._repo = self._repo or (commits[0].repo if commits else None)
+        rewinds = files = 0
+        last = workspace_commit
+        for commit in commits:
+            if not self._continues(commit, last, first_parent_only) and not self._is_merge(commit, first_parent_only):
+                rewinds += 1
+                files += self._rewind_size(commit, last, first_parent_only)
+            last = commit.hexsha
+        return rewinds, files
+
+    def _parents(self, commit: Commit) -> List[str]:
+        if self._history_index is not None and self._history_index.covers(commit.hexsha):
+            return self._history_index.parents(commit.hexsha)
+        return [p.hexsha for p in commit.parents]
+
+    def _is_merge(self, commit: Commit, first_parent_only: bool) -> bool:
+        return len(self._parents(commit)) > 1 and not first_parent_only
+
+    def _continues(self, commit: Commit, last: Optional[str], first_parent_only: bool) -> bool:
+        parents = self._parents(commit)
+        if not parents:
+            return last is None
+        if self._is_merge(commit, first_parent_only):
+            # merge commits are diffed against the workspace commit instead of rewinding
+            return last in parents
+        return parents[0] == last
+
+    def _rewind_size(self, commit: Commit, last: Optional[str], first_parent_only: bool) -> int:
+        """The number of files changed in the workspace before analyzing `commit`, other than its own diff"""
+        if self._continues(commit, last, first_parent_only):
+            return 0
+        parents = self._parents(commit)
+        return self._diff_size(last or EMPTY_TREE_SHA, parents[0] if parents else EMPTY_TREE_SHA)
+
+    def _diff_size(self, a: str, b: str) -> int:
+        key = (a, b) if a < b else (b, a)
+        size = self._diff_sizes.get(key)
+        if size is None:
+            size = self._indexed_diff_size(a, b)
+            if size is None:
+                names = self._repo.git.diff_tree('-r', '--name-only', '--no-renames', a, b)
+                size = len(names.splitlines()) if names else 0
+            self._diff_sizes[key] = size
+        return size
+
+    def _indexed_diff_size(self, a: str, b: str) -> Optional[int]:
+        """The files changed along the first-parent chains of a and b, or None if they are not indexed"""
+        index = self._history_index
+        if index is None or any(sha != EMPTY_TREE_SHA and sha not in index for sha in (a, b)):
+            return None
+        # walk both chains in turn until one reaches a commit of the other
+        walkers = [iter(()) if sha == EMPTY_TREE_SHA else index.iter_first_parents(sha) for sha in (a, b)]
+        chains: List[Dict[str, int]] = [{}, {}]
+        while walkers[0] or walkers[1]:
+            for k in (0, 1):
+                sha = next(walkers[k], None) if walkers[k] else None
+                if sha is None:
+                    walkers[k] = None
+                    continue
+                other = chains[1 - k]
+                if sha in other:
+                    # the commits below sha are shared
+                    chains[1 - k] = {c: i for c, i in other.items() if i < other[sha]}
+                    walkers = [None, None]
+                    break
+                chains[k][sha] = len(chains[k])
+        paths = set()
+        for chain in chains:
+            for sha in chain:
+                for f in index.files(sha):
+                    paths.add(f.path)
+                    if f.old_path is not None:
+                        paths.add(f.old_path)
+        return len(paths)
@@ -0,0 +1,666 @@
+"""
+compact_call_commit_graph.py
+====================================
+An array-backed implementation of the CallCommitGraph API for large repositories
+"""
+import logging
+from array import array
+from collections.abc import Mapping, Set as AbstractSet
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+import community
+import networkx as nx
+import numpy as np
+
+from persper.analytics.call_commit_graph import CommitIdGenerators, EditTable, batch_devranks_from_edits, \
+    developer_devranks_from_commits
+from persper.analytics.csr import CsrGraph
+from persper.analytics.devrank import DevRanks, DevRankStats, IncrementalDevRank, \
+    commit_devranks_from_edits, devrank_from_csr
+
+_logger = logging.getLogger(__name__)
+
+_NO_COMMIT = -1
+# the black set of the incremental DevRank sizes when they have to be recomputed
+_STALE_SIZES = object()
+
+
+class CompactCallCommitGraph:
+    """
+    A drop-in replacement of `CallCommitGraph` with a much smaller memory footprint.
+
+    Function names, file names and commit ids are interned to integer ids.
+    Edges are stored as COO arrays (source, target, addedBy, weight), and the
+    node histories as one columnar table with a row per (node, commit) edit, so memory
+    scales with the number of edits instead of the number of Python dicts.
+
+    The `nodes`/`edges` views materialize the networkx-style attribute dicts on access;
+    modifying the returned dicts does not change the graph.
+    """
+
+    def __init__(self, graph_data: Optional[Dict] = None, commit_id_generator=CommitIdGenerators.fromHexsha):
+        self._commit_id_generator = commit_id_generator
+        self._current_commit_id = None
+        self._mutation_listener = None
+        self._init_storage()
+        if graph_data:
+            self._load_node_link_data(graph_data)
+
+    def _init_storage(self):
+        self._commits = {}
+        # interned commit ids (as produced by commit_id_generator)
+        self._commit_index: Dict[object, int] = {}
+        self._commit_ids: List[object] = []
+        self._commit_hexshas: List[Optional[str]] = []
+        self._current_commit_index = _NO_COMMIT
+        # interned nodes
+        self._node_index: Dict[str, int] = {}
+        self._node_names: List[str] = []
+        self._node_files: List[tuple] = []
+        # 0 stands for None, since a computed size is at least 1
+        self._node_size = array('q')
+        # interned file names
+        self._file_index: Dict[str, int] = {}
+        self._file_names: List[str] = []
+        # edges in COO format; _edge_pos maps (source << 32 | target) to the position in the arrays
+        self._edge_src = array('i')
+        self._edge_dst = array('i')
+        self._edge_added_by = array('i')
+        # 0 stands for None
+        self._edge_weight = array('q')
+        self._edge_pos: Dict[int, int] = {}
+        # node history table; _hist_node is -1 for the rows of a node that has been re-added
+        self._hist_node = array('i')
+        self._hist_commit = array('i')
+        self._hist_adds = array('q')
+        self._hist_dels = array('q')
+        self._hist_added_units = array('q')
+        self._hist_removed_units = array('q')
+        self._hist_has_units = array('b')
+        # the live history rows (those of -1 nodes excluded), by commit then node, and by node
+        self._hist_rows_by_commit: Dict[int, Dict[int, int]] = {}
+        self._hist_rows_by_node: Dict[int, List[int]] = {}
+        # incremental DevRank state, the number of edges it has seen, the nodes whose history
+        # has changed since, and the black set its sizes are computed with
+        self._inc_devrank: Optional[IncrementalDevRank] = None
+        self._inc_edges_seen = 0
+        self._inc_dirty_nodes: Set[int] = set()
+        self._inc_black_set = _STALE_SIZES
+        self._invalidate()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_edge_csr'] = None
+        state['_hist_by_node'] = None
+        state['_mutation_listener'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('_mutation_listener', None)
+        self.__dict__.setdefault('_inc_dirty_nodes', set())
+        self.__dict__.setdefault('_inc_black_set', _STALE_SIZES)
+        if '_hist_rows_by_commit' not in state:
+            # pickled before the row indexes were kept
+            self.__dict__.pop('_hist_rows', None)
+            self.__dict__.pop('_hist_rows_commit', None)
+            self._index_history_rows()
+
+    def _index_history_rows(self):
+        self._hist_rows_by_commit = {}
+        self._hist_rows_by_node = {}
+        for row, (idx, cidx) in enumerate(zip(self._hist_node, self._hist_commit)):
+            if idx >= 0:
+                self._hist_rows_by_commit.setdefault(cidx, {})[idx] = row
+                self._hist_rows_by_node.setdefault(idx, []).append(row)
+
+    def set_mutation_listener(self, listener: Optional[Callable[[str, tuple], None]]):
+        """See `CallCommitGraph.set_mutation_listener`."""
+        self._mutation_listener = listener
+
+    def _notify(self, method_name: str, *args):
+        if self._mutation_listener is not None:
+            self._mutation_listener(method_name, args)
+
+    def _invalidate(self, edges=True, history=True):
+        if edges:
+            self._edge_csr = None
+        if history:
+            self._hist_by_node = None
+
+    def _load_node_link_data(self, graph_data: Dict):
+        for hexsha, commit in graph_data.get('graph', {}).get('commits', {}).items():
+            self._commits[hexsha] = commit
+            self._intern_commit(commit['id'], hexsha)
+        for node in graph_data['nodes']:
+            name = node['id']
+            self.add_node(name, node.get('files', ()))
+            idx = self._node_index[name]
+            self._node_size[idx] = node.get('size') or 0
+            for cid, chist in node.get('history', {}).items():
+                cidx = self._intern_commit(cid)
+                self._append_history(idx, cidx, chist, 'added_units' in chist)
+        for link in graph_data.get('links', ()):
+            src = self._node_index[link['source']]
+            dst = self._node_index[link['target']]
+            added_by = link.get('addedBy')
+            self._add_edge_core(src, dst, _NO_COMMIT if added_by is None else self._intern_commit(added_by))
+            self._edge_weight[-1] = link.get('weight') or 0
+
+    def reset(self):
+        """Reset all internal states"""
+        self._notify('reset')
+        self._init_storage()
+        if self._current_commit_id is not None:
+            self._current_commit_index = self._intern_commit(self._current_commit_id)
+
+    def nodes(self, data=False):
+        """Provide read-only access for nodes"""
+        return _NodeDataView(self) if data else _NodeView(self)
+
+    def edges(self, data=False):
+        """Provide read-only access for edges"""
+        return _EdgeView(self, data)
+
+    def commits(self):
+        """Provide read-only access for commits"""
+        return self._commits
+
+    def files(self, node: str) -> Set[str]:
+        """Provide read-only access to `files` attribute of a node"""
+        return set(self._file_names[i] for i in self._node_files[self._node_index[node]])
+
+    def __contains__(self, node):
+        """Implement membership check"""
+        return node in self._node_index
+
+    def add_commit(self, hexsha, author_name, author_email, message):
+        self._notify('add_commit', hexsha, author_name, author_email, message)
+        self._current_commit_id = self._commit_id_generator(self._next_cindex(), hexsha, message)
+        self._current_commit_index = self._intern_commit(self._current_commit_id, hexsha)
+        self._commits[hexsha] = {
+            'id': self._current_commit_id,
+            'hexsha': hexsha,
+            'authorName': author_name,
+            'authorEmail': author_email,
+            'message': message
+        }
+
+    def _cur_cindex(self):
+        return len(self.commits()) - 1
+
+    def _next_cindex(self):
+        return self._cur_cindex() + 1
+
+    def _intern_commit(self, commit_id, hexsha=None) -> int:
+        idx = self._commit_index.get(commit_id)
+        if idx is None:
+            idx = self._commit_index[commit_id] = len(self._commit_ids)
+            self._commit_ids.append(commit_id)
+            self._commit_hexshas.append(hexsha)
+        elif hexsha is not None:
+            self._commit_hexshas[idx] = hexsha
+        return idx
+
+    def _intern_files(self, files: Iterable[str]) -> tuple:
+        ids = []
+        for f in files:
+            fid = self._file_index.get(f)
+            if fid is None:
+                fid = self._file_index[f] = len(self._file_names)
+                self._file_names.append(f)
+            ids.append(fid)
+        return tuple(sorted(set(ids)))
+
+    def add_node(self, node: str, files: Union[Set[str], List[str]] = []):
+        self._notify('add_node', node, list(files))
+        if node is None:
+            _logger.error("Argument node is None in add_node.")
+            return
+        idx = self._node_index.get(node)
+        if idx is None:
+            idx = self._node_index[node] = len(self._node_names)
+            self._node_names.append(node)
+            self._node_files.append(())
+            self._node_size.append(0)
+            # the indexes by node have one entry per node
+            self._invalidate()
+        else:
+            # re-adding a node resets its attributes, as networkx does
+            self._node_size[idx] = 0
+            self._drop_history(idx)
+            self._inc_dirty_nodes.add(idx)
+        self._node_files[idx] = self._intern_files(files)
+
+    # add_node must be called on source and target first
+    def add_edge(self, source, target):
+        self._notify('add_edge', source, target)
+        if source is None or target is None:
+            _logger.error("Argument source or target is None in add_edge.")
+            return
+        if source not in self._node_index:
+            raise ValueError("Error: caller %s does not exist in call-commit graph." % source)
+        if target not in self._node_index:
+            raise ValueError("Error: callee %s does not exist in call-commit graph." % target)
+        self._add_edge_core(self._node_index[source], self._node_index[target],
+                            self._current_commit_index if self._current_commit_id is not None else _NO_COMMIT)
+
+    def _add_edge_core(self, src: int, dst: int, added_by: int):
+        key = src << 32 | dst
+        pos = self._edge_pos.get(key)
+        if pos is None:
+            self._edge_pos[key] = len(self._edge_src)
+            self._edge_src.append(src)
+            self._edge_dst.append(dst)
+            self._edge_added_by.append(added_by)
+            self._edge_weight.append(0)
+            self._invalidate(history=False)
+        else:
+            self._edge_added_by[pos] = added_by
+            self._edge_weight[pos] = 0
+
+    def update_node_history(self, node, num_adds, num_dels):
+        self._notify('update_node_history', node, num_adds, num_dels)
+        self._update_history(node, {'adds': num_adds, 'dels': num_dels}, False)
+
+    def update_node_history_accurate(self, node, fstat):
+        self._notify('update_node_history_accurate', node, dict(fstat))
+        self._update_history(node, fstat, True)
+
+    def _update_history(self, node, fstat, has_units):
+        if node is None:
+            _logger.error("Argument node is None in _get_node_history.")
+            return
+        idx = self._node_index[node]
+        cidx = self._current_commit_index
+        if cidx == _NO_COMMIT:
+            cidx = self._current_commit_index = self._intern_commit(self._current_commit_id)
+        self._inc_dirty_nodes.add(idx)
+        # a commit might be visited more than once, e.g. when rewinding
+        commit_rows = self._hist_rows_by_commit.get(cidx)
+        row = commit_rows.get(idx) if commit_rows else None
+        # A commit might update a node's history more than once when
+        # a single FunctionNode corresponds to more than one actual functions
+        if row is None:
+            self._append_history(idx, cidx, fstat, has_units)
+        else:
+            self._hist_adds[row] += fstat['adds']
+            self._hist_dels[row] += fstat['dels']
+            if has_units:
+                self._hist_added_units[row] += fstat['added_units']
+                self._hist_removed_units[row] += fstat['removed_units']
+
+    def _append_history(self, idx: int, cidx: int, fstat, has_units: bool) -> int:
+        row = len(self._hist_node)
+        self._hist_node.append(idx)
+        self._hist_commit.append(cidx)
+        self._hist_adds.append(fstat['adds'])
+        self._hist_dels.append(fstat['dels'])
+        self._hist_added_units.append(fstat['added_units'] if has_units else 0)
+        self._hist_removed_units.append(fstat['removed_units'] if has_units else 0)
+        self._hist_has_units.append(1 if has_units else 0)
+        self._hist_rows_by_commit.setdefault(cidx, {})[idx] = row
+        self._hist_rows_by_node.setdefault(idx, []).append(row)
+        self._invalidate(edges=False)
+        return row
+
+    def _drop_history(self, idx: int):
+        rows = self._hist_rows_by_node.pop(idx, ())
+        for row in rows:
+            self._hist_node[row] = -1
+            del self._hist_rows_by_commit[self._hist_commit[row]][idx]
+        if rows:
+            self._invalidate(edges=False)
+
+    def update_node_files(self, node: str, new_files: Union[Set[str], List[str]]):
+        self._notify('update_node_files', node, list(new_files))
+        if node is None:
+            _logger.error("Argument node is None in update_node_files")
+            return
+        self._node_files[self._node_index[node]] = self._intern_files(new_files)
+
+    def _history_table(self):
+        """
+        Returns the live history rows as numpy arrays:
+        (node, commit, adds, dels, added_units, removed_units, has_units)
+        """
+        node = np.array(self._hist_node, dtype=np.int64)
+        live = node >= 0
+        columns = [node, np.array(self._hist_commit, dtype=np.int64)]
+        for col in (self._hist_adds, self._hist_dels, self._hist_added_units, self._hist_removed_units):
+            columns.append(np.array(col, dtype=np.int64))
+        columns.append(np.array(self._hist_has_units, dtype=bool))
+        if live.all():
+            return columns
+        return [col[live] for col in columns]
+
+    def _history_by_node(self):
+        """
+        Returns (rows, indptr), where rows[indptr[i]:indptr[i + 1]] are the history rows
+        of node i, in the order they have been added.
+        """
+        if self._hist_by_node is None:
+            node = np.array(self._hist_node, dtype=np.int64)
+            rows = np.nonzero(node >= 0)[0]
+            rows = rows[np.argsort(node[rows], kind='stable')]
+            counts = np.bincount(node[rows], minlength=len(self._node_names))
+            indptr = np.zeros(len(self._node_names) + 1, dtype=np.int64)
+            np.cumsum(counts, out=indptr[1:])
+            self._hist_by_node = rows, indptr
+        return self._hist_by_node
+
+    def _node_history(self, idx: int) -> Dict[str, Dict[str, int]]:
+        rows, indptr = self._history_by_node()
+        history = {}
+        for row in rows[indptr[idx]:indptr[idx + 1]].tolist():
+            chist = {'adds': self._hist_adds[row], 'dels': self._hist_dels[row]}
+            if self._hist_has_units[row]:
+                chist['added_units'] = self._hist_added_units[row]
+                chist['removed_units'] = self._hist_removed_units[row]
+            history[self._commit_ids[self._hist_commit[row]]] = chist
+        return history
+
+    def _node_attrs(self, idx: int) -> Dict:
+        return {
+            'size': self._node_size[idx] or None,
+            'history': self._node_history(idx),
+            'files': set(self._file_names[i] for i in self._node_files[idx]),
+        }
+
+    def _edges_csr(self):
+        """
+        Returns (order, indptr), where order[indptr[i]:indptr[i + 1]] are the positions
+        of the out edges of node i in the COO arrays, in the order they have been added.
+        """
+        if self._edge_csr is None:
+            src = np.array(self._edge_src, dtype=np.int64)
+            order = np.argsort(src, kind='stable')
+            counts = np.bincount(src, minlength=len(self._node_names))
+            indptr = np.zeros(len(self._node_names) + 1, dtype=np.int64)
+            np.cumsum(counts, out=indptr[1:])
+            self._edge_csr = order, indptr
+        return self._edge_csr
+
+    def _edge_attrs(self, pos: int) -> Dict:
+        added_by = self._edge_added_by[pos]
+        return {
+            'addedBy': None if added_by == _NO_COMMIT else self._commit_ids[added_by],
+            'weight': self._edge_weight[pos] or None,
+        }
+
+    def _edit_sizes(self, hist_commit, adds, dels, added_units, removed_units, has_units, black_set=None):
+        sizes = np.where(has_units, added_units + removed_units, adds + dels)
+        if black_set is not None:
+            black = np.array([sha in black_set for sha in self._commit_hexshas], dtype=bool)
+            if len(black):
+                sizes = np.where(black[hist_commit], 0, sizes)
+        return sizes
+
+    # TODO: provide other options for computing a node's size
+    def _set_all_nodes_size(self, black_set=None):
+        """ Compute node size after nodes have been added to the graph
+        node size is currently defined as the total number lines of edits
+
+        black_set - A set of commit hexshas to be blacklisted
+        """
+        node, commit, *edits = self._history_table()
+        sizes = np.bincount(node, weights=self._edit_sizes(commit, *edits, black_set=black_set),
+                            minlength=len(self._node_names)).astype(np.int64)
+        # set default size to 1 to avoid zero division error
+        sizes[sizes == 0] = 1
+        self._node_size = array('q', sizes.tobytes())
+        # the sizes of the incremental DevRank may be computed with another black set
+        self._inc_black_set = _STALE_SIZES
+        return sizes
+
+    def _compute_nodes_size(self, indices: Iterable[int], black_set=None) -> List[int]:
+        """Compute the size of some of the nodes from their history rows, as `_set_all_nodes_size` does"""
+        sizes = []
+        for idx in indices:
+            size = 0
+            for row in self._hist_rows_by_node.get(idx, ()):
+                if black_set is not None and self._commit_hexshas[self._hist_commit[row]] in black_set:
+                    continue
+                if self._hist_has_units[row]:
+                    size += self._hist_added_units[row] + self._hist_removed_units[row]
+                else:
+                    size += self._hist_adds[row] + self._hist_dels[row]
+            sizes.append(size or 1)
+        return sizes
+
+    def _set_all_edges_weight(self):
+        sizes = self._set_all_nodes_size()
+        self._edge_weight = array('q', sizes[np.array(self._edge_dst, dtype=np.int64)].tobytes())
+
+    def eval_project_complexity(self, r_n: float, r_e: float):
+        """
+        Evaluates project complexity.
+        params
+            r_n: The conversion factor from node count to logic units.
+            r_e: The conversion factor from edge count to logic units.
+        """
+        node, commit, adds, dels, added_units, removed_units, has_units = self._history_table()
+        logical_units = 0
+        if len(node):
+            # the unit is decided by the first history entry, as complexity.eval_project_complexity does
+            rows, _ = self._history_by_node()
+            if self._hist_has_units[rows[0]]:
+                logical_units = int(added_units.sum() + removed_units.sum())
+            else:
+                _logger.warning("Will use LOC instead of logic units to measure complexity.")
+                logical_units = int(adds.sum() + dels.sum())
+        return logical_units + r_n * len(self._node_names) + r_e * len(self._edge_src)
+
+    def _remove_invalid_nodes(self):
+        # add_node never adds None
+        pass
+
+    def _function_devrank_vector(self, alpha, black_set=None, incremental=False):
+        if not incremental:
+            self._set_all_nodes_size(black_set=black_set)
+            return devrank_from_csr(self.to_csr(), alpha=alpha)
+        # nodes and edges are only appended, so the deltas are the tails of the arrays
+        if self._inc_devrank is None:
+            self._inc_devrank = IncrementalDevRank()
+            self._inc_edges_seen = 0
+            self._inc_black_set = _STALE_SIZES
+        inc = self._inc_devrank
+        new_nodes = range(inc.num_nodes, len(self._node_names))
+        inc.add_nodes(len(new_nodes))
+        inc.add_edges(self._edge_src[self._inc_edges_seen:], self._edge_dst[self._inc_edges_seen:])
+        self._inc_edges_seen = len(self._edge_src)
+        black_set = None if black_set is None else frozenset(black_set)
+        if black_set != self._inc_black_set:
+            inc.set_sizes(self._set_all_nodes_size(black_set=black_set))
+            self._inc_black_set = black_set
+        else:
+            # only the sizes of the nodes edited since the last call
+            dirty_nodes = sorted(self._inc_dirty_nodes.union(new_nodes))
+            sizes = self._compute_nodes_size(dirty_nodes, black_set)
+            for idx, size in zip(dirty_nodes, sizes):
+                self._node_size[idx] = size
+            inc.update_sizes(dirty_nodes, sizes)
+        self._inc_dirty_nodes = set()
+        return inc.solve(alpha)
+
+    def to_csr(self, with_sizes=True) -> CsrGraph:
+        """Export the call graph as integer index arrays in CSR format (rows are callers)
+
+        with_sizes - Whether to export node sizes, which are set by `function_devranks`
+        """
+        order, indptr = self._edges_csr()
+        indices = np.array(self._edge_dst, dtype=np.int64)[order]
+        sizes = np.array(self._node_size, dtype=np.float64) if with_sizes else None
+        return CsrGraph(list(self._node_names), indptr.copy(), indices, sizes)
+
+    def function_devranks(self, alpha, black_set=None, incremental=False):
+        """
+        Args:
+                alpha - A float between 0 and 1, commonly set to 0.85
+            black_set - A set of commit hexshas to be blacklisted
+          incremental - Whether to keep the DevRank state, so that the next incremental call
+                        only applies the changes since this call, and starts from this result.
+                        See `devrank_stats` for the convergence information.
+        """
+        dr = self._function_devrank_vector(alpha, black_set=black_set, incremental=incremental)
+        return dict(zip(self._node_names, dr.tolist()))
+
+    @property
+    def devrank_stats(self) -> Optional[DevRankStats]:
+        """The iteration count and residual of the last incremental DevRank, if any."""
+        return self._inc_devrank.stats if self._inc_devrank is not None else None
+
+    def edit_table(self) -> EditTable:
+        """The node histories as an `EditTable`; commits sharing a hexsha are merged."""
+        node, commit, *edits = self._history_table()
+        sha_index = {}
+        commit_sha = np.array([sha_index.setdefault(sha, len(sha_index)) for sha in self._commit_hexshas],
+                              dtype=np.int64)
+        return EditTable(list(self._node_names), list(sha_index), node, commit_sha[commit],
+                         self._edit_sizes(commit, *edits))
+
+    def devranks(self, alpha, black_set=None, incremental=False) -> DevRanks:
+        """
+        Compute function, commit and developer DevRanks together, solving DevRank only once.
+
+        Args:
+                alpha - A float between 0 and 1, commonly set to 0.85
+            black_set - A set of commit hexshas to be blacklisted
+          incremental - See `function_devranks`
+        """
+        func_vector = self._function_devrank_vector(alpha, black_set=black_set, incremental=incremental)
+        kept = self.edit_table().without_commits(black_set)
+        commit_vector, edited = commit_devranks_from_edits(
+            func_vector, np.array(self._node_size, dtype=np.int64), kept.node_idx, kept.commit_idx,
+            kept.sizes, len(kept.commits))
+        commit_devranks = {kept.commits[j]: commit_vector[j] for j in np.nonzero(edited)[0].tolist()}
+        func_devranks = dict(zip(self._node_names, func_vector.tolist()))
+        developer_devranks = developer_devranks_from_commits(self.commits(), commit_devranks)
+        return DevRanks(func_devranks, commit_devranks, developer_devranks)
+
+    def batch_devranks(self, scenarios: Sequence[Tuple[float, Optional[Set[str]]]]) -> List[DevRanks]:
+        """
+        Compute `devranks` for each (alpha, black_set) scenario, solving all the scenarios
+        as one multi-column power iteration. See `CallCommitGraph.batch_devranks`.
+        """
+        return batch_devranks_from_edits(self.edit_table(), self.to_csr(with_sizes=False),
+                                         self.commits(), scenarios)
+
+    def commit_devranks(self, alpha, black_set=None, incremental=False):
+        """
+        Args:
+                alpha - A float between 0 and 1, commonly set to 0.85
+            black_set - A set of commit hexshas to be blacklisted
+          incremental - See `function_devranks`
+        """
+        return self.devranks(alpha, black_set=black_set, incremental=incremental).commit
+
+    def developer_devranks(self, alpha, black_set=None, incremental=False):
+        """
+        Args:
+                alpha - A float between 0 and 1, commonly set to 0.85
+            black_set - A set of commit hexshas to be blacklisted
+          incremental - See `function_devranks`
+        """
+        return self.devranks(alpha, black_set=black_set, incremental=incremental).developer
+
+    def compute_modularity(self):
+        """Compute modularity score based on function graph.
+
+        Returns
+        -------
+            modularity : float
+                The modularity score of this graph.
+        """
+        # Check the number of edges
+        if len(self._edge_src) == 0:
+            return 0.
+
+        # Construct non directed graph
+        graph = nx.Graph()
+        graph.add_nodes_from(self._node_names)
+        names = self._node_names
+        graph.add_edges_from((names[u], names[v]) for u, v in zip(self._edge_src, self._edge_dst))
+        # Compute the partition of the graph nodes
+        partition = community.best_partition(graph)
+        # Compute modularity
+        modularity = community.modularity(partition, graph)
+        # Normalize [0, 1] to [0, 100]
+        modularity = modularity * 100
+
+        return modularity
+
+
+class _NodeView(Mapping):
+    """A read-only, networkx-like view of the nodes of a CompactCallCommitGraph."""
+
+    def __init__(self, graph: CompactCallCommitGraph):
+        self._graph = graph
+
+    def __getitem__(self, node):
+        return self._graph._node_attrs(self._graph._node_index[node])
+
+    def __iter__(self):
+        return iter(self._graph._node_names)
+
+    def __len__(self):
+        return len(self._graph._node_names)
+
+    def __contains__(self, node):
+        return node in self._graph._node_index
+
+    def __call__(self, data=False):
+        return self._graph.nodes(data=data)
+
+    def data(self):
+        return _NodeDataView(self._graph)
+
+
+class _NodeDataView(AbstractSet):
+    """A read-only view of (node, attributes) pairs, which can also be indexed by node."""
+
+    def __init__(self, graph: CompactCallCommitGraph):
+        self._graph = graph
+
+    def __getitem__(self, node):
+        return self._graph._node_attrs(self._graph._node_index[node])
+
+    def __iter__(self):
+        graph = self._graph
+        for idx, name in enumerate(graph._node_names):
+            yield name, graph._node_attrs(idx)
+
+    def __len__(self):
+        return len(self._graph._node_names)
+
+    def __contains__(self, node):
+        return node in self._graph._node_index
+
+
+class _EdgeView(AbstractSet):
+    """A read-only view of (source, target) or (source, target, attributes) tuples."""
+
+    def __init__(self, graph: CompactCallCommitGraph, data: bool):
+        self._graph = graph
+        self._data = data
+
+    def __iter__(self):
+        graph = self._graph
+        names = graph._node_names
+        order, _ = graph._edges_csr()
+        for pos in order.tolist():
+            u, v = names[graph._edge_src[pos]], names[graph._edge_dst[pos]]
+            if self._data:
+                yield u, v, graph._edge_attrs(pos)
+            else:
+                yield u, v
+
+    def __len__(self):
+        return len(self._graph._edge_src)
+
+    def __contains__(self, edge):
+        graph = self._graph
+        u, v = edge[0], edge[1]
+        if u not in graph._node_index or v not in graph._node_index:
+            return False
+        return (graph._node_index[u] << 32 | graph._node_index[v]) in graph._edge_pos
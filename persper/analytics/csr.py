@@ -0,0 +1,48 @@
+"""
+csr.py
+====================================
+Export of call graphs to integer index arrays
+"""
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+from networkx import DiGraph
+
+
+class CsrGraph(NamedTuple):
+    """
+    A directed graph in CSR format: the out edges of node i go to
+    nodes[indices[indptr[i]:indptr[i + 1]]].
+    """
+    nodes: List
+    indptr: np.ndarray
+    indices: np.ndarray
+    # node sizes, or None if not requested
+    sizes: Optional[np.ndarray]
+
+    @property
+    def sources(self) -> np.ndarray:
+        """The source node index of each edge, i.e. the COO row indices"""
+        return np.repeat(np.arange(len(self.nodes), dtype=np.int64), np.diff(self.indptr))
+
+
+def digraph_to_csr(G: DiGraph, weight_label: Optional[str] = None) -> CsrGraph:
+    """Export a nx.DiGraph in one pass over its adjacency
+
+    Args:
+                   G - A nx.DiGraph object.
+        weight_label - A string. If specified, each node in graph should have this attribute,
+                       which is exported as node sizes.
+    """
+    nodes = list(G)
+    index = {u: i for i, u in enumerate(nodes)}
+    succ = G.succ
+    degrees = np.fromiter((len(succ[u]) for u in nodes), dtype=np.int64, count=len(nodes))
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    np.cumsum(degrees, out=indptr[1:])
+    indices = np.fromiter((index[v] for u in nodes for v in succ[u]), dtype=np.int64, count=int(indptr[-1]))
+    sizes = None
+    if weight_label is not None:
+        node_data = G.nodes
+        sizes = np.fromiter((node_data[u][weight_label] for u in nodes), dtype=np.float64, count=len(nodes))
+    return CsrGraph(nodes, indptr, indices, sizes)
@@ -1,6 +1,10 @@
+from typing import Dict, NamedTuple
+
 import numpy as np
 from numpy import linalg as LA
-from scipy.sparse import coo_matrix
+from scipy.sparse import coo_matrix, csc_matrix, csr_matrix
+
+from persper.analytics.csr import CsrGraph, digraph_to_csr
 
 
 def devrank(G, weight_label, alpha=0.85, epsilon=1e-5, max_iters=300):
@@ -17,47 +21,227 @@ def devrank(G, weight_label, alpha=0.85, epsilon=1e-5, max_iters=300):
     Returns:
         A dict with node names being keys and DevRanks being values.
     """
-    ni = {}
-    for i, u in enumerate(G):
-        ni[u] = i
+    csr = digraph_to_csr(G, weight_label)
+    v = devrank_from_csr(csr, alpha=alpha, epsilon=epsilon, max_iters=max_iters)
+    return dict(zip(csr.nodes, v.tolist()))
+
 
-    def sizeof(u):
-        return G.node[u][weight_label]
+def devrank_from_csr(csr: CsrGraph, alpha=0.85, epsilon=1e-5, max_iters=300):
+    """DevRank on a graph exported by `digraph_to_csr` or `CallCommitGraph.to_csr`
 
-    num_nodes = len(G.nodes())
-    row, col, data = [], [], []
-    for u in G:
-        size_sum = 0
-        for v in G[u]:
-            size_sum += sizeof(v)
-        for v in G[u]:
-            row.append(ni[v])
-            col.append(ni[u])
-            data.append(sizeof(v) / size_sum)
+    Returns:
+        A numpy array with the DevRank of each node in csr.nodes.
+    """
+    num_nodes = len(csr.nodes)
+    sizes = np.asarray(csr.sizes, dtype=np.float64)
+    # The transition matrix shares the sparsity structure of the graph, transposed:
+    # column u holds the callees of u, which share u's DevRank in proportion to their sizes.
+    callee_sizes = sizes[csr.indices]
+    size_sum = np.bincount(csr.sources, weights=callee_sizes, minlength=num_nodes)
+    data = callee_sizes / np.repeat(size_sum, np.diff(csr.indptr))
+    P = csc_matrix((data, csr.indices, csr.indptr), shape=(num_nodes, num_nodes)).tocsr()
+    v, _, _ = _power_iterate(P.dot, sizes / sizes.sum(), np.ones(num_nodes) / num_nodes,
+                             alpha, epsilon, max_iters)
+    return v
 
-    P = coo_matrix((data, (row, col)), shape=(num_nodes, num_nodes)).tocsr()
 
-    universe_size = 0
-    for u in G:
-        universe_size += sizeof(u)
+def devrank_batch_from_csr(csr: CsrGraph, sizes, alphas, epsilon=1e-5, max_iters=300):
+    """DevRank of several scenarios of the same call graph, solved together
 
-    p = np.empty(num_nodes)
-    for u in G:
-        p[ni[u]] = sizeof(u) / universe_size
+    Each scenario has its own damping factor and node sizes. The call relationship is shared
+    as an unweighted matrix A (see `IncrementalDevRank`), and all the scenarios are iterated
+    at once as the columns of an n x k rank matrix. Each column stops at its own convergence.
 
-    v = np.ones(num_nodes) / num_nodes
+    Args:
+                 csr - A `CsrGraph`, its sizes are ignored.
+               sizes - An n x k array, column j holds the node sizes of scenario j.
+              alphas - k floats between 0 and 1, the damping factor of each scenario.
+             epsilon - A float.
+           max_iters - An integer, specify max number of iterations to run.
+
+    Returns:
+        An n x k numpy array, column j holds the DevRanks of scenario j.
+    """
+    n = len(csr.nodes)
+    sizes = np.asarray(sizes, dtype=np.float64)
+    if sizes.ndim == 1:
+        sizes = sizes[:, np.newaxis]
+    alphas = np.asarray(alphas, dtype=np.float64)
+    k = len(alphas)
+    assert sizes.shape == (n, k)
+    if n == 0:
+        return np.zeros((0, k))
+    A = csc_matrix((np.ones(len(csr.indices)), csr.indices, csr.indptr), shape=(n, n))
+    col_sums = A.T.dot(sizes)
+    # dangling nodes leak their rank, which is redistributed in proportion to node sizes
+    inv_col_sums = np.zeros((n, k))
+    np.divide(1., col_sums, out=inv_col_sums, where=col_sums > 0)
+    p = sizes / sizes.sum(axis=0)
 
+    V = np.full((n, k), 1. / n)
+    active = np.arange(k)
+    for _ in range(max_iters):
+        if not len(active):
+            break
+        v = V[:, active]
+        new_v = alphas[active] * (sizes[:, active] * A.dot(v * inv_col_sums[:, active]))
+        gamma = np.abs(v).sum(axis=0) - np.abs(new_v).sum(axis=0)
+        new_v += gamma * p[:, active]
+        delta = np.abs(new_v - v).sum(axis=0)
+        # as `_power_iterate`, a converged column keeps its previous iterate
+        going = delta >= epsilon
+        V[:, active[going]] = new_v[:, going]
+        active = active[going]
+    return V
+
+
+class DevRanks(NamedTuple):
+    """Function, commit and developer DevRanks computed from a single DevRank solve"""
+    function: Dict[str, float]
+    commit: Dict[str, float]
+    developer: Dict[str, float]
+
+
+def commit_devranks_from_edits(func_devranks, node_sizes, edit_nodes, edit_commits, edit_sizes, num_commits):
+    """Distribute the DevRank of each node to the commits that edited it, in proportion to the edit sizes
+
+    Args:
+        func_devranks - A float array, the DevRank of each node.
+           node_sizes - A numeric array, the size of each node.
+           edit_nodes - An integer array, the node index of each edit.
+         edit_commits - An integer array, the commit index of each edit.
+           edit_sizes - A numeric array, the size of each edit.
+          num_commits - An integer, the number of commits.
+
+    Returns:
+        A float array with the DevRank of each commit, and a bool array telling
+        whether each commit has any edit.
+    """
+    edit_nodes = np.asarray(edit_nodes, dtype=np.int64)
+    edit_commits = np.asarray(edit_commits, dtype=np.int64)
+    func_devranks = np.asarray(func_devranks, dtype=np.float64)
+    node_sizes = np.asarray(node_sizes, dtype=np.float64)
+    weights = np.asarray(edit_sizes, dtype=np.float64) / node_sizes[edit_nodes] * func_devranks[edit_nodes]
+    ranks = np.bincount(edit_commits, weights=weights, minlength=num_commits)
+    edited = np.bincount(edit_commits, minlength=num_commits) > 0
+    return ranks, edited
+
+
+def _power_iterate(matvec, p, v, alpha, epsilon, max_iters):
+    """
+    Iterate v = alpha * P v + gamma * p, where gamma redistributes the rank
+    lost by dangling nodes and damping.
+    Returns the rank vector, the number of iterations and the last residual.
+    """
+    delta = 0.
+    i = 0
     for i in range(max_iters):
-        new_v = alpha * P.dot(v)
+        new_v = alpha * matvec(v)
         gamma = LA.norm(v, 1) - LA.norm(new_v, 1)
         new_v += gamma * p
         delta = LA.norm(new_v - v, 1)
         if delta < epsilon:
             break
         v = new_v
+    return v, i + 1, float(delta)
+
+
+class DevRankStats(NamedTuple):
+    """Convergence information of a DevRank solve"""
+    iterations: int
+    residual: float
+    warm_start: bool
+
+
+class IncrementalDevRank:
+    """DevRank that can be re-solved cheaply after small changes of the graph
+
+    The call relationship is kept as an unweighted matrix A (A[target, source] = 1),
+    so that the transition matrix of `devrank_from_csr` is applied as
+        P v = sizes * (A (v / (A^T sizes)))
+    and changing node sizes does not require rebuilding any matrix. New edges are kept
+    in COO form, and merged into the CSR matrix once they make up `merge_ratio` of it.
+    Each solve starts from the DevRank vector of the previous solve.
+    """
+
+    def __init__(self, epsilon=1e-5, max_iters=300, merge_ratio=0.1):
+        self.epsilon = epsilon
+        self.max_iters = max_iters
+        self.merge_ratio = merge_ratio
+        self._num_nodes = 0
+        self._sizes = np.ones(0)
+        self._base = csr_matrix((0, 0))
+        self._delta_sources = []
+        self._delta_targets = []
+        self._ranks = None
+        self.stats: DevRankStats = None
+
+    @property
+    def num_nodes(self):
+        return self._num_nodes
+
+    def add_nodes(self, count: int):
+        """Append `count` nodes with size 1."""
+        self._num_nodes += count
+        self._sizes = np.concatenate((self._sizes, np.ones(count)))
+
+    def add_edges(self, sources, targets):
+        """Add edges between existing nodes. Adding an existing edge is not supported."""
+        self._delta_sources.extend(sources)
+        self._delta_targets.extend(targets)
+
+    def set_sizes(self, sizes):
+        """Replace the size of all the nodes."""
+        sizes = np.asarray(sizes, dtype=np.float64)
+        assert len(sizes) == self._num_nodes
+        self._sizes = sizes
+
+    def update_sizes(self, indices, sizes):
+        """Update the size of some of the nodes."""
+        self._sizes[np.asarray(indices, dtype=np.int64)] = sizes
+
+    def solve(self, alpha=0.85) -> np.ndarray:
+        """Compute DevRank, starting from the result of last solve"""
+        n = self._num_nodes
+        sizes = self._sizes
+        if len(self._delta_sources) > self.merge_ratio * self._base.nnz:
+            self._merge_delta()
+        base = self._base
+        nb = base.shape[0]
+        delta_sources = np.array(self._delta_sources, dtype=np.int64)
+        delta_targets = np.array(self._delta_targets, dtype=np.int64)
+
+        def matvec(x):
+            y = np.bincount(delta_targets, weights=x[delta_sources], minlength=n).astype(np.float64)
+            y[:nb] += base.dot(x[:nb])
+            return y
+
+        col_sums = np.bincount(delta_sources, weights=sizes[delta_targets], minlength=n).astype(np.float64)
+        col_sums[:nb] += base.T.dot(sizes[:nb])
+        # dangling nodes leak their rank, which is redistributed in proportion to node sizes
+        inv_col_sums = np.zeros(n)
+        np.divide(1, col_sums, out=inv_col_sums, where=col_sums > 0)
+        p = sizes / sizes.sum()
+
+        warm_start = self._ranks is not None and len(self._ranks) > 0
+        if warm_start:
+            # new nodes start from the uniform share
+            v = np.concatenate((self._ranks, np.ones(n - len(self._ranks)) / n))
+            v /= v.sum()
+        else:
+            v = np.ones(n) / n
 
-    dr = {}
-    for u in G:
-        dr[u] = v[ni[u]]
+        v, iterations, residual = _power_iterate(lambda x: sizes * matvec(x * inv_col_sums), p, v,
+                                                 alpha, self.epsilon, self.max_iters)
+        self._ranks = v
+        self.stats = DevRankStats(iterations, residual, warm_start)
+        return v
 
-    return dr
+    def _merge_delta(self):
+        n = self._num_nodes
+        base = self._base.tocoo()
+        rows = np.concatenate((base.row, np.array(self._delta_targets, dtype=np.int64)))
+        cols = np.concatenate((base.col, np.array(self._delta_sources, dtype=np.int64)))
+        self._base = coo_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n)).tocsr()
+        self._delta_sources = []
+        self._delta_targets = []
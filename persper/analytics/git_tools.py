@@ -1,10 +1,15 @@
 from git.exc import InvalidGitRepositoryError, NoSuchPathError
 from git import Repo, Commit
-from typing import Union
+from typing import Dict, Iterable, Optional, Union
+import logging
+import subprocess
 import sys
+import threading
 import git
 import codecs
 
+_logger = logging.getLogger(__name__)
+
 EMPTY_TREE_SHA = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
 
 
@@ -44,6 +49,11 @@ def get_contents(repo, commit, path):
     if type(commit) == Commit:
         commit = commit.hexsha
     byte_str = repo.git.show('{}:{}'.format(commit, path), stdout_as_string=False)
+    return decode_contents(byte_str)
+
+
+def decode_contents(byte_str: bytes) -> str:
+    """Decode raw file contents, honoring the BOM if there is one"""
     # default utf-8
     encoding = 'utf-8'
     # the following code is from: https://github.com/chardet/chardet/blob/master/chardet/universaldetector.py#L137
@@ -64,3 +74,115 @@ def get_contents(repo, commit, path):
         # FE FF  UTF-16, big endian BOM
         encoding = 'utf-16-be'
     return byte_str.decode(encoding=encoding, errors='replace')
+
+
+class BlobReader:
+    """
+    Reads blob contents through a single long-lived `git cat-file --batch` process.
+
+    All the blobs requested in one `read_blobs` call are fetched in one round-trip,
+    so the cost of fetching the files of a commit no longer grows with one
+    `git show` subprocess per file.
+
+    remarks
+        An instance is bound to the thread that uses it, like GitPython's own
+        persistent commands. It cannot be pickled; create a new one instead.
+    """
+
+    def __init__(self, repo: Repo):
+        self._repo = repo
+        self._proc: subprocess.Popen = None
+
+    def _ensure_process(self):
+        if self._proc is None or self._proc.poll() is not None:
+            self._proc = subprocess.Popen(['git', 'cat-file', '--batch'],
+                                          cwd=self._repo.git_dir,
+                                          stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE)
+        return self._proc
+
+    def read_blobs(self, hexshas: Iterable[str]) -> Dict[str, Optional[bytes]]:
+        """
+        Reads the raw contents of the specified blobs in one round-trip.
+        returns
+            A dict from blob hexsha to its raw content, or `None` if the object is missing
+            (e.g. the hexsha of a submodule entrypoint).
+        """
+        # dedup while keeping the order, because the responses come back in request order
+        hexshas = list(dict.fromkeys(hexshas))
+        if not hexshas:
+            return {}
+        proc = self._ensure_process()
+
+        def write_requests():
+            try:
+                proc.stdin.write(''.join(sha + '\n' for sha in hexshas).encode('ascii'))
+                proc.stdin.flush()
+            except (BrokenPipeError, ValueError) as e:
+                _logger.error("BlobReader failed to write requests: %s", e)
+
+        # Write requests from another thread so that a large batch cannot deadlock
+        # with git blocking on its full stdout pipe.
+        writer = threading.Thread(target=write_requests, daemon=True)
+        writer.start()
+        contents = {}
+        try:
+            for sha in hexshas:
+                header = proc.stdout.readline()
+                if not header:
+                    raise RuntimeError("git cat-file exited unexpectedly.")
+                fields = header.split()
+                if len(fields) == 2 and fields[1] == b'missing':
+                    contents[sha] = None
+                    continue
+                size = int(fields[2])
+                data = proc.stdout.read(size)
+                # skip the trailing LF after the content
+                proc.stdout.read(1)
+                contents[sha] = data
+        except Exception:
+            # the stream is out of sync, start over in the next call
+            self.close()
+            raise
+        finally:
+            writer.join()
+        return contents
+
+    def read_blob(self, hexsha: str) -> Optional[bytes]:
+        """Reads the raw content of a single blob"""
+        return self.read_blobs([hexsha])[hexsha]
+
+    def get_contents(self, hexshas: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Same as `read_blobs`, but decodes the contents the same way as `get_contents`"""
+        contents = {}
+        for sha, data in self.read_blobs(hexshas).items():
+            if data is not None:
+                # GitPython strips the trailing LF of `git show` output; keep the results identical
+                if data.endswith(b'\n'):
+                    data = data[:-1]
+                data = decode_contents(data)
+            contents[sha] = data
+        return contents
+
+    def close(self):
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        proc.stdout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        self.close()
@@ -0,0 +1,298 @@
+"""
+graph_snapshot.py
+====================================
+A versioned, chunked file format for call commit graphs, which is written and read incrementally.
+
+A snapshot file is laid out as::
+
+    header   := MAGIC version:uint32
+    chunk    := kind:1 byte  length:uint32  payload:length bytes
+    trailer  := index_offset:uint64 MAGIC
+
+followed by the chunks and the trailer. All integers are little endian. The payload of
+a chunk is a UTF-8 encoded JSON array of records, by kind:
+
+    M   meta, a single JSON object (always the first chunk)
+    C   commits, [hexsha, id, authorName, authorEmail, message]
+    N   nodes, [name, size, files]
+    E   edges, [source ordinal, target ordinal, addedBy, weight]
+    H   history, [node ordinal, commit id, adds, dels, added_units, removed_units]
+        (the units are null when not recorded); the history of a node never spans two chunks
+    I   index, a JSON object with the offsets of the history chunks (always the last chunk)
+
+Nodes are referred to by their ordinals, i.e. their positions among the N records.
+Only one chunk is decoded at a time, so neither writing nor reading holds a second copy
+of the graph in memory. With `lazy_history`, the histories stay in the memory mapped file
+until they are first accessed.
+"""
+import bisect
+import gc
+import json
+import logging
+import mmap
+import os
+import struct
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from persper.analytics.call_commit_graph import CallCommitGraph, CommitIdGenerators
+
+_logger = logging.getLogger(__name__)
+
+MAGIC = b'PCCGSNAP'
+SNAPSHOT_VERSION = 1
+
+_HEADER = struct.Struct('<8sI')
+_CHUNK = struct.Struct('<cI')
+_TRAILER = struct.Struct('<Q8s')
+
+
+class SnapshotFormatError(ValueError):
+    pass
+
+
+class _ChunkWriter:
+    def __init__(self, fp, chunk_records: int):
+        self._fp = fp
+        self._chunk_records = chunk_records
+        self._kind = None
+        self._records = []
+
+    def write(self, kind: bytes, record):
+        if kind != self._kind:
+            self.flush()
+            self._kind = kind
+        self._records.append(record)
+        if len(self._records) >= self._chunk_records:
+            self.flush()
+
+    def flush(self):
+        """Write out the pending records as a chunk"""
+        if self._records:
+            self.write_chunk(self._kind, self._records)
+            self._records = []
+
+    def write_chunk(self, kind: bytes, payload) -> int:
+        offset = self._fp.tell()
+        data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        self._fp.write(_CHUNK.pack(kind, len(data)))
+        self._fp.write(data)
+        return offset
+
+
+def save_snapshot(graph, path: str, chunk_records: int = 4096):
+    """Write a snapshot of a graph
+
+    Args:
+                graph - A CallCommitGraph, or any graph with the same read API
+                        (e.g. CompactCallCommitGraph).
+                 path - The snapshot file to write. It is replaced atomically.
+        chunk_records - An integer, the number of records per chunk.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fp:
+        fp.write(_HEADER.pack(MAGIC, SNAPSHOT_VERSION))
+        writer = _ChunkWriter(fp, chunk_records)
+        commits = graph.commits()
+        writer.write_chunk(b'M', {
+            'current_commit_id': getattr(graph, '_current_commit_id', None),
+            'num_commits': len(commits),
+            'num_nodes': len(graph.nodes()),
+        })
+        for sha, commit in commits.items():
+            writer.write(b'C', [sha, commit.get('id', sha), commit['authorName'],
+                                commit['authorEmail'], commit['message']])
+
+        ordinals = {}
+        for node, data in graph.nodes(data=True):
+            ordinals[node] = len(ordinals)
+            writer.write(b'N', [node, data['size'], sorted(data['files'])])
+        for source, target, data in graph.edges(data=True):
+            writer.write(b'E', [ordinals[source], ordinals[target], data['addedBy'], data['weight']])
+        writer.flush()
+
+        # (offset, first node ordinal) of each history chunk
+        history_chunks = []
+        records = []
+        for ordinal, (node, data) in enumerate(graph.nodes(data=True)):
+            if not records:
+                first = ordinal
+            for cid, chist in data['history'].items():
+                records.append([ordinal, cid, chist['adds'], chist['dels'],
+                                chist.get('added_units'), chist.get('removed_units')])
+            if len(records) >= chunk_records:
+                history_chunks.append([writer.write_chunk(b'H', records), first])
+                records = []
+        if records:
+            history_chunks.append([writer.write_chunk(b'H', records), first])
+
+        index_offset = writer.write_chunk(b'I', {'history': history_chunks})
+        fp.write(_TRAILER.pack(index_offset, MAGIC))
+    os.replace(tmp_path, path)
+
+
+class SnapshotReader:
+    """Random and sequential access to the chunks of a snapshot file, through a memory map"""
+
+    def __init__(self, path: str):
+        self._path = path
+        if os.path.getsize(path) < _HEADER.size + _TRAILER.size:
+            raise SnapshotFormatError('{} is not a call commit graph snapshot.'.format(path))
+        with open(path, 'rb') as fp:
+            self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = _HEADER.unpack_from(self._map, 0)
+        index_offset, trailer_magic = _TRAILER.unpack_from(self._map, len(self._map) - _TRAILER.size)
+        if magic != MAGIC or trailer_magic != MAGIC:
+            raise SnapshotFormatError('{} is not a call commit graph snapshot.'.format(path))
+        if version > SNAPSHOT_VERSION:
+            raise SnapshotFormatError('Snapshot version {} of {} is not supported.'.format(version, path))
+        self.version = version
+        self._end = index_offset
+        kind, index = self.read_chunk(index_offset)
+        if kind != b'I':
+            raise SnapshotFormatError('{} has no index chunk.'.format(path))
+        self._history_offsets = [offset for offset, _ in index['history']]
+        self._history_firsts = [first for _, first in index['history']]
+        # the last decoded history chunk, as {ordinal: history}
+        self._cached_offset = None
+        self._cached_histories = None
+
+    def read_chunk(self, offset: int) -> Tuple[bytes, object]:
+        kind, length = _CHUNK.unpack_from(self._map, offset)
+        start = offset + _CHUNK.size
+        return kind, json.loads(self._map[start:start + length].decode('utf-8'))
+
+    def chunks(self) -> Iterator[Tuple[bytes, object]]:
+        """Iterate over the (kind, payload) of all the chunks but the index"""
+        offset = _HEADER.size
+        while offset < self._end:
+            _, length = _CHUNK.unpack_from(self._map, offset)
+            yield self.read_chunk(offset)
+            offset += _CHUNK.size + length
+
+    def history(self, ordinal: int) -> Dict:
+        """Decode the history of a node"""
+        i = bisect.bisect_right(self._history_firsts, ordinal) - 1
+        if i < 0:
+            return {}
+        offset = self._history_offsets[i]
+        if offset != self._cached_offset:
+            _, records = self.read_chunk(offset)
+            histories = {}
+            for record in records:
+                histories.setdefault(record[0], []).append(record)
+            self._cached_offset, self._cached_histories = offset, histories
+        return _decode_history(self._cached_histories.get(ordinal, ()))
+
+    def close(self):
+        self._map.close()
+
+
+def _decode_history(records) -> Dict:
+    history = {}
+    for _, cid, adds, dels, added_units, removed_units in records:
+        chist = {'adds': adds, 'dels': dels}
+        if added_units is not None:
+            chist['added_units'] = added_units
+            chist['removed_units'] = removed_units
+        history[cid] = chist
+    return history
+
+
+class _LazyHistory(MutableMapping):
+    """The history of a node, which is decoded from the snapshot on first access"""
+
+    __slots__ = ('_reader', '_ordinal', '_data')
+
+    def __init__(self, reader: SnapshotReader, ordinal: int):
+        self._reader = reader
+        self._ordinal = ordinal
+        self._data = None
+
+    def _load(self) -> Dict:
+        if self._data is None:
+            self._data = self._reader.history(self._ordinal)
+            self._reader = None
+        return self._data
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __setitem__(self, key, value):
+        self._load()[key] = value
+
+    def __delitem__(self, key):
+        del self._load()[key]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __repr__(self):
+        return repr(self._load())
+
+    def __reduce__(self):
+        # pickled as a plain dict, without the memory map
+        return dict, (self._load(),)
+
+
+def load_snapshot(path: str, lazy_history: bool = False,
+                  commit_id_generator=CommitIdGenerators.fromHexsha,
+                  graph: Optional[CallCommitGraph] = None) -> CallCommitGraph:
+    """Load a snapshot written by `save_snapshot` into a CallCommitGraph
+
+    Args:
+                       path - The snapshot file.
+               lazy_history - Whether to decode node histories on first access instead of now.
+                              The snapshot file must be kept until all of them have been accessed.
+        commit_id_generator - The commit id generator of the new graph, see `CommitIdGenerators`.
+                      graph - An existing CallCommitGraph to reset and load into, instead of a new one.
+                              Its commit id generator is kept. Other graphs raise TypeError.
+    """
+    if graph is not None and not isinstance(graph, CallCommitGraph):
+        raise TypeError('Cannot load a snapshot into a {}.'.format(type(graph).__name__))
+    reader = SnapshotReader(path)
+    # every decoded object stays reachable, so garbage collection while loading only costs time
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        if graph is None:
+            graph = CallCommitGraph(commit_id_generator=commit_id_generator)
+        else:
+            graph.reset()
+        digraph = graph._digraph
+        commits = graph.commits()
+        names: List[str] = []
+        for kind, payload in reader.chunks():
+            if kind == b'M':
+                graph._current_commit_id = payload['current_commit_id']
+            elif kind == b'C':
+                for sha, cid, author_name, author_email, message in payload:
+                    commits[sha] = {'id': cid, 'hexsha': sha, 'authorName': author_name,
+                                    'authorEmail': author_email, 'message': message}
+            elif kind == b'N':
+                for name, size, files in payload:
+                    history = _LazyHistory(reader, len(names)) if lazy_history else {}
+                    digraph.add_node(name, size=size, history=history, files=set(files))
+                    names.append(name)
+            elif kind == b'E':
+                digraph.add_edges_from((names[source], names[target], {'addedBy': added_by, 'weight': weight})
+                                       for source, target, added_by, weight in payload)
+            elif kind == b'H':
+                if lazy_history:
+                    break
+                histories = {}
+                for record in payload:
+                    histories.setdefault(record[0], []).append(record)
+                for ordinal, records in histories.items():
+                    digraph.nodes[names[ordinal]]['history'] = _decode_history(records)
+            else:
+                _logger.warning("Skipped unknown chunk kind %r in %s.", kind, path)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    if not lazy_history:
+        reader.close()
+    return graph
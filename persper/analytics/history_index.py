@@ -0,0 +1,325 @@
+"""
+history_index.py
+====================================
+A columnar index of the commit history of a repository, built with a single `git log` pass.
+
+The index holds, for each commit, its hexsha, parents, author, authored and committed
+timestamps, summary, and the per-file numstat with renames detected (against the first
+parent for merge commits). Queries do not touch the git object database, unlike
+the lazily read attributes of GitPython's `Commit`.
+
+An index is saved as a numpy `.npz` file of the columns below, where `n` is the number of
+commits and variable-length lists are stored as a flat array with an offsets array (`*_ptr`)
+of `n + 1` entries, and strings as packed UTF-8 bytes with offsets (`*_data`, `*_offsets`)::
+
+    hexsha           S40[n]
+    parent_ptr       int64[n + 1]
+    parent_idx       int32[]      -1 for a parent outside the index
+    author           int32[n]     into author_names / author_emails
+    authored_at      int64[n]     unix timestamps
+    committed_at     int64[n]
+    summary          strings[n]
+    file_ptr         int64[n + 1]
+    file_path        int32[]      into paths
+    file_old_path    int32[]      into paths, -1 if the file is not renamed
+    file_adds        int32[]      -1 for binary files
+    file_dels        int32[]
+"""
+import itertools
+import logging
+import subprocess
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from git import Commit, Repo
+from gitdb.util import hex_to_bin
+
+_logger = logging.getLogger(__name__)
+
+HISTORY_INDEX_VERSION = 1
+
+# %x01 marks the start of a commit, the fields are separated by NUL as the numstat records with -z
+_LOG_FORMAT = '%x01%H%x00%P%x00%an%x00%ae%x00%at%x00%ct%x00%s'
+_HEADER_FIELDS = 7
+
+
+class FileStat(NamedTuple):
+    path: str
+    adds: int
+    dels: int
+    old_path: Optional[str]
+
+
+class HistoryIndex:
+    """
+    The commit history of a repository. Build it with `HistoryIndex.build`,
+    and save and load it with `save` and `HistoryIndex.load`.
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        self._columns = columns
+        self._hexshas = [sha.decode('ascii') for sha in columns['hexsha']]
+        self._index = {sha: i for i, sha in enumerate(self._hexshas)}
+        self._author_names = _unpack_strings(columns, 'author_names')
+        self._author_emails = _unpack_strings(columns, 'author_emails')
+        self._summaries = _unpack_strings(columns, 'summary')
+        self._paths = _unpack_strings(columns, 'paths')
+
+    @classmethod
+    def build(cls, repo_path: str, revs: Iterable[str] = ('--all',), path: Optional[str] = None) -> 'HistoryIndex':
+        """Build the index of the commits reachable from `revs` in one `git log` pass
+
+        Args:
+            repo_path - The path of the repository.
+                 revs - The revisions to index, as passed to `git log`.
+                 path - If given, the index is also saved to this file.
+        """
+        builder = _IndexBuilder()
+        cmd = ['git', '-C', repo_path, 'log', '-z', '--topo-order', '--reverse', '--numstat', '-M',
+               '--diff-merges=first-parent', '--format=' + _LOG_FORMAT] + list(revs) + ['--']
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        try:
+            builder.feed(_iter_tokens(proc.stdout))
+        finally:
+            proc.stdout.close()
+            if proc.wait() != 0:
+                raise subprocess.CalledProcessError(proc.returncode, cmd)
+        index = cls(builder.columns())
+        _logger.info("Indexed %d commits of %s.", len(index), repo_path)
+        if path:
+            index.save(path)
+        return index
+
+    @classmethod
+    def load(cls, path: str) -> 'HistoryIndex':
+        with np.load(path) as data:
+            columns = {name: data[name] for name in data.files}
+        if int(columns['version']) > HISTORY_INDEX_VERSION:
+            raise ValueError('History index version {} of {} is not supported.'.format(int(columns['version']), path))
+        return cls(columns)
+
+    def save(self, path: str):
+        """Save the index, e.g. to 'history.npz'"""
+        with open(path, 'wb') as f:
+            np.savez(f, **self._columns)
+
+    def __len__(self):
+        return len(self._hexshas)
+
+    def __contains__(self, hexsha: str):
+        return hexsha in self._index
+
+    def __getstate__(self):
+        return self._columns
+
+    def __setstate__(self, state):
+        self.__init__(state)
+
+    def hexshas(self) -> List[str]:
+        """All the indexed commits, parents first"""
+        return list(self._hexshas)
+
+    def covers(self, hexsha: str) -> bool:
+        """Whether the commit and all its parents are in the index"""
+        i = self._index.get(hexsha)
+        if i is None:
+            return False
+        ptr = self._columns['parent_ptr']
+        return bool((self._columns['parent_idx'][ptr[i]:ptr[i + 1]] >= 0).all())
+
+    def parents(self, hexsha: str) -> List[str]:
+        """The parents of the commit
+
+        Raises KeyError if a parent is outside the index (e.g. beyond a shallow clone, or not in the indexed
+        revisions), see `covers`.
+        """
+        i = self._index[hexsha]
+        ptr = self._columns['parent_ptr']
+        parent_idx = self._columns['parent_idx'][ptr[i]:ptr[i + 1]]
+        if (parent_idx < 0).any():
+            raise KeyError('A parent of {} is not in the history index.'.format(hexsha))
+        return [self._hexshas[p] for p in parent_idx]
+
+    def is_merge(self, hexsha: str) -> bool:
+        i = self._index[hexsha]
+        ptr = self._columns['parent_ptr']
+        return ptr[i + 1] - ptr[i] > 1
+
+    def author(self, hexsha: str) -> Tuple[str, str]:
+        """The (name, email) of the author"""
+        author = self._columns['author'][self._index[hexsha]]
+        return self._author_names[author], self._author_emails[author]
+
+    def authored_date(self, hexsha: str) -> int:
+        return int(self._columns['authored_at'][self._index[hexsha]])
+
+    def committed_date(self, hexsha: str) -> int:
+        return int(self._columns['committed_at'][self._index[hexsha]])
+
+    def summary(self, hexsha: str) -> str:
+        return self._summaries[self._index[hexsha]]
+
+    def files(self, hexsha: str) -> List[FileStat]:
+        """The numstat of the files changed in the commit"""
+        i = self._index[hexsha]
+        ptr = self._columns['file_ptr']
+        start, end = ptr[i], ptr[i + 1]
+        return [FileStat(self._paths[path], int(adds), int(dels), self._paths[old_path] if old_path >= 0 else None)
+                for path, old_path, adds, dels in zip(self._columns['file_path'][start:end],
+                                                      self._columns['file_old_path'][start:end],
+                                                      self._columns['file_adds'][start:end],
+                                                      self._columns['file_dels'][start:end])]
+
+    def stats(self, hexsha: str) -> Dict[str, Dict[str, int]]:
+        """The numstat of the commit, in the form of GitPython's `commit.stats.files`"""
+        return {f.path: {'insertions': max(f.adds, 0), 'deletions': max(f.dels, 0),
+                         'lines': max(f.adds, 0) + max(f.dels, 0)}
+                for f in self.files(hexsha)}
+
+    def first_parent_chain(self, hexsha: str, max_count: Optional[int] = None) -> List[str]:
+        """The commits along the first parents of `hexsha`, newest first, as `git rev-list --first-parent`"""
+        return list(itertools.islice(self.iter_first_parents(hexsha), max_count))
+
+    def iter_first_parents(self, hexsha: str) -> Iterator[str]:
+        """Iterate `first_parent_chain` lazily"""
+        i = self._index[hexsha]
+        ptr, parent_idx = self._columns['parent_ptr'], self._columns['parent_idx']
+        while i >= 0:
+            yield self._hexshas[i]
+            i = parent_idx[ptr[i]] if ptr[i + 1] > ptr[i] else -1
+
+
+def lazy_commit(repo: Repo, hexsha: str) -> Commit:
+    """A Commit whose object is not read until one of its attributes other than hexsha is accessed"""
+    return Commit(repo, hex_to_bin(hexsha))
+
+
+def rev_list(repo: Repo, rev: str, first_parent: bool = False, **kwargs) -> List[str]:
+    """The hexshas listed by `git rev-list`, in one call without reading the commit objects"""
+    if first_parent:
+        kwargs['first_parent'] = True
+    output = repo.git.rev_list(rev, **kwargs)
+    return output.split() if output else []
+
+
+class _IndexBuilder:
+
+    def __init__(self):
+        self._hexshas: List[bytes] = []
+        self._parents: List[List[bytes]] = []
+        self._authors: Dict[Tuple[str, str], int] = {}
+        self._author = []
+        self._authored_at = []
+        self._committed_at = []
+        self._summaries = []
+        self._paths: Dict[str, int] = {}
+        self._file_ptr = [0]
+        self._files = []
+
+    def _path_id(self, path: bytes) -> int:
+        return self._paths.setdefault(path.decode('utf-8', 'replace'), len(self._paths))
+
+    def feed(self, tokens: Iterator[bytes]):
+        # the header fields of the commit being read, and the counts and paths of a rename record
+        fields = None
+        rename = None
+        for token in tokens:
+            if fields is not None:
+                fields.append(token)
+                if len(fields) == _HEADER_FIELDS:
+                    self._start_commit(fields)
+                    fields = None
+                continue
+            if rename is not None:
+                rename.append(token)
+                if len(rename) == 4:
+                    adds, dels, old_path, new_path = rename
+                    self._files.append((self._path_id(new_path), self._path_id(old_path), adds, dels))
+                    rename = None
+                continue
+            token = token.lstrip(b'\n')
+            if token.startswith(b'\x01'):
+                self._end_commit()
+                fields = [token[1:]]
+            elif token:
+                adds, dels, path = token.split(b'\t', 2)
+                adds, dels = _parse_count(adds), _parse_count(dels)
+                if path:
+                    self._files.append((self._path_id(path), -1, adds, dels))
+                else:
+                    rename = [adds, dels]
+        self._end_commit()
+
+    def _start_commit(self, header: List[bytes]):
+        hexsha, parents, name, email, authored_at, committed_at, summary = header
+        self._hexshas.append(hexsha)
+        self._parents.append(parents.split())
+        author = (name.decode('utf-8', 'replace'), email.decode('utf-8', 'replace'))
+        self._author.append(self._authors.setdefault(author, len(self._authors)))
+        self._authored_at.append(int(authored_at))
+        self._committed_at.append(int(committed_at))
+        self._summaries.append(summary.decode('utf-8', 'replace'))
+
+    def _end_commit(self):
+        if len(self._file_ptr) <= len(self._hexshas):
+            self._file_ptr.append(len(self._files))
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        index = {sha: i for i, sha in enumerate(self._hexshas)}
+        parent_ptr = np.zeros(len(self._hexshas) + 1, dtype=np.int64)
+        np.cumsum([len(parents) for parents in self._parents], out=parent_ptr[1:])
+        parent_idx = np.array([index.get(p, -1) for parents in self._parents for p in parents], dtype=np.int32)
+        files = np.array(self._files, dtype=np.int64).reshape(-1, 4)
+        columns = {
+            'version': np.array(HISTORY_INDEX_VERSION),
+            'hexsha': np.array(self._hexshas, dtype='S40'),
+            'parent_ptr': parent_ptr,
+            'parent_idx': parent_idx,
+            'author': np.array(self._author, dtype=np.int32),
+            'authored_at': np.array(self._authored_at, dtype=np.int64),
+            'committed_at': np.array(self._committed_at, dtype=np.int64),
+            'file_ptr': np.array(self._file_ptr, dtype=np.int64),
+            'file_path': files[:, 0].astype(np.int32),
+            'file_old_path': files[:, 1].astype(np.int32),
+            'file_adds': files[:, 2].astype(np.int32),
+            'file_dels': files[:, 3].astype(np.int32),
+        }
+        authors = list(self._authors)
+        _pack_strings(columns, 'author_names', [name for name, _ in authors])
+        _pack_strings(columns, 'author_emails', [email for _, email in authors])
+        _pack_strings(columns, 'summary', self._summaries)
+        _pack_strings(columns, 'paths', list(self._paths))
+        return columns
+
+
+def _parse_count(count: bytes) -> int:
+    # binary files have '-' counts
+    return -1 if count == b'-' else int(count)
+
+
+def _iter_tokens(stream, buffer_size: int = 1 << 16) -> Iterator[bytes]:
+    """Split a stream into NUL-terminated tokens"""
+    rest = b''
+    while True:
+        data = stream.read(buffer_size)
+        if not data:
+            break
+        tokens = (rest + data).split(b'\0')
+        rest = tokens.pop()
+        yield from tokens
+    if rest:
+        yield rest
+
+
+def _pack_strings(columns: Dict[str, np.ndarray], name: str, strings: List[str]):
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(s) for s in encoded], out=offsets[1:])
+    columns[name + '_data'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    columns[name + '_offsets'] = offsets
+
+
+def _unpack_strings(columns: Dict[str, np.ndarray], name: str) -> List[str]:
+    data = columns[name + '_data'].tobytes()
+    offsets = columns[name + '_offsets']
+    return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
@@ -1,16 +1,42 @@
 import time
 from persper.analytics.git_tools import initialize_repo
+from persper.analytics.history_index import lazy_commit, rev_list
 from collections import deque
 
 
 class RepoIterator():
 
-    def __init__(self, repo_path):
+    def __init__(self, repo_path, history_index=None):
+        """
+        Args:
+            repo_path: A string, the path of the repository.
+            history_index: An optional HistoryIndex of the repository,
+                which provides the parents and dates of the commits
+                instead of reading each commit object.
+        """
         self.repo_path = repo_path
         self.repo = initialize_repo(repo_path)
+        self.history_index = history_index
         self.visited = set()
         self.last_processed_commit = None
 
+    def _iter_commits(self, rev=None):
+        if self.history_index is None:
+            return list(self.repo.iter_commits(rev, first_parent=True))
+        return [lazy_commit(self.repo, sha)
+                for sha in rev_list(self.repo, rev or 'HEAD', first_parent=True)]
+
+    def _parents(self, commit):
+        if self.history_index is not None and self.history_index.covers(commit.hexsha):
+            return [lazy_commit(self.repo, sha)
+                    for sha in self.history_index.parents(commit.hexsha)]
+        return commit.parents
+
+    def _authored_date(self, commit):
+        if self.history_index is not None and commit.hexsha in self.history_index:
+            return self.history_index.authored_date(commit.hexsha)
+        return commit.authored_date
+
     def iter(self, rev=None,
              from_beginning=False,
              num_commits=None,
@@ -70,7 +96,7 @@ class RepoIterator():
 
         # Method 2
         if from_beginning:
-            commits = list(self.repo.iter_commits(first_parent=True))
+            commits = self._iter_commits()
             if num_commits is not None:
                 commits = commits[-num_commits:]
 
@@ -82,21 +108,19 @@ class RepoIterator():
             # Method 4
             if end_commit_sha:
                 rev = self.last_processed_commit.hexsha + '..' + end_commit_sha
-                commits = list(self.repo.iter_commits(
-                    rev, first_parent=True))
+                commits = self._iter_commits(rev)
             # Method 3
             elif num_commits:
                 # some project's main branch might not be master, thus use HEAD
                 rev = self.last_processed_commit.hexsha + '..HEAD'
-                commits = list(self.repo.iter_commits(
-                    rev, first_parent=True))[-num_commits:]
+                commits = self._iter_commits(rev)[-num_commits:]
             else:
                 print("Both end_commit_sha and num_commits are None.")
                 return [], []
 
         else:
             # Method 1
-            commits = list(self.repo.iter_commits(rev, first_parent=True))
+            commits = self._iter_commits(rev)
 
         # set self.last_processed_commit
         if len(commits) > 0:
@@ -112,8 +136,9 @@ class RepoIterator():
             # find all merge commits
             start_points = deque()
             for commit in reversed(commits):
-                if len(commit.parents) > 1:
-                    for pc in commit.parents[1:]:
+                parents = self._parents(commit)
+                if len(parents) > 1:
+                    for pc in parents[1:]:
                         start_points.append(pc)
 
             self.branch_lengths = []
@@ -130,7 +155,7 @@ class RepoIterator():
                         break
 
                     # stop if we have reached time boundary
-                    authored_date = time.gmtime(cur_commit.authored_date)
+                    authored_date = time.gmtime(self._authored_date(cur_commit))
                     if min_branch_date and min_branch_date > authored_date:
                         break
 
@@ -144,16 +169,17 @@ class RepoIterator():
                     branch_length += 1
 
                     # stop if we have reached the very first commit
-                    if len(cur_commit.parents) == 0:
+                    parents = self._parents(cur_commit)
+                    if len(parents) == 0:
                         break
 
                     # add to queue if cur_commit is a merge commit
-                    if len(cur_commit.parents) > 1:
-                        for pc in cur_commit.parents[1:]:
+                    if len(parents) > 1:
+                        for pc in parents[1:]:
                             start_points.append(pc)
 
                     # get next commit
-                    cur_commit = cur_commit.parents[0]
+                    cur_commit = parents[0]
 
                 if branch_length > 0:
                     self.branch_lengths.append(branch_length)
@@ -167,6 +193,7 @@ class RepoIterator():
     def __getstate__(self):
         state = {}
         state['repo_path'] = self.repo_path
+        state['history_index'] = self.history_index
         state['visited'] = self.visited
         # Avoid directly pickle Commit object
         if self.last_processed_commit is None:
@@ -177,6 +204,7 @@ class RepoIterator():
 
     def __setstate__(self, state):
         self.repo_path = state['repo_path']
+        self.history_index = state.get('history_index')
         self.visited = state['visited']
         self.repo = initialize_repo(state['repo_path'])
         if state['last_processed_sha'] is None:
@@ -3,10 +3,9 @@ import logging
 import os
 import subprocess
 from abc import abstractclassmethod, abstractproperty
-from datetime import datetime, timedelta
 from os import path
 from pathlib import Path, PurePath
-from typing import Dict, List, Tuple, Union
+from typing import Dict, List, Optional, Tuple, Union
 
 from persper.analytics.call_commit_graph import CallCommitGraph
 from persper.analytics.graph_server import GraphServer, CommitSeekingMode
@@ -37,7 +36,8 @@ class LspClientGraphServer(GraphServer):
     def __init__(self, workspaceRoot: str,
                  languageServerCommand: Union[str, List[str]] = None,
                  dumpLogs: bool = False,
-                 graph: CallCommitGraph = None):
+                 graph: CallCommitGraph = None,
+                 workers: int = 1):
         """
         workspaceRoot:  root of the temporary workspace path. LSP workspace and intermediate repository files
         will be placed in this folder.
@@ -45,7 +45,12 @@ class LspClientGraphServer(GraphServer):
         languageServerCommand: the command line (in string, or a sequence of parameters) for starting the
         language server process. If use `null` or default value,
         the value of current class's `defaultLanguageServerCommand` static field will be used.
+
+        workers: the number of language server processes sharing the workspace. Document symbol and
+        goto definition requests of different files are routed to different processes in parallel.
         """
+        if workers < 1:
+            raise ValueError("workers should be at least 1.")
         self._ccgraph = graph or CallCommitGraph()
         self._callGraph = CallCommitGraphSynchronizer(self._ccgraph)
         self._workspaceRoot: Path = Path(workspaceRoot).resolve()
@@ -63,13 +68,20 @@ class LspClientGraphServer(GraphServer):
         self._lspClient: LspClient = None
         self._callGraphBuilder: CallGraphBuilder = None
         self._callGraphManager: CallGraphManager = None
-        self._lastFileWrittenTime: datetime = None
+        self._workerCount = workers
+        # [(process, client, builder), ...] of the language servers other than the main one
+        self._workers: List[Tuple[subprocess.Popen, LspClient, CallGraphBuilder]] = []
         self._dumpLogs = dumpLogs
         # [(oldPath, newPath, addedLines, removedLines), ...]
         # added/removedLines := [[startLine, modifiedLines], ...]
         self._stashedPatches: List[Tuple[PurePath, PurePath, List[Tuple[int, int]], List[Tuple[int, int]]]] = []
         self._symbolPaths = dict()
         self._commitSeekingMode: CommitSeekingMode = None
+        # {path: newContent} of the files to be written when rewinding, or None for the deleted ones.
+        # The workspace jumps to the rewound commit in end_commit, with only the changed files written.
+        self._rewindChanges: Dict[Path, Optional[str]] = {}
+        # {nodeName: [addedLines, removedLines]} of current commit, written to the graph in end_commit
+        self._pendingNodeHistory: Dict[str, List[int]] = {}
 
     def __getstate__(self):
         state = self.__dict__.copy()
@@ -77,10 +89,13 @@ class LspClientGraphServer(GraphServer):
         state.pop("_lspClient", None)
         state.pop("_callGraphBuilder", None)
         state.pop("_callGraphManager", None)
+        state.pop("_workers", None)
         return state
 
     def __setstate__(self, state):
+        state.setdefault("_workerCount", 1)
         self.__dict__.update(state)
+        self._workers = []
         if not self._workspaceRoot.exists():
             self._workspaceRoot.touch()
 
@@ -94,6 +109,7 @@ class LspClientGraphServer(GraphServer):
         if seeking_mode != CommitSeekingMode.Rewind:
             self._ccgraph.add_commit(hexsha, author_name, author_email, commit_message)
         self._symbolPaths.clear()
+        self._pendingNodeHistory.clear()
 
     async def update_graph(self, old_filename: str, old_src: str, new_filename: str, new_src: str, patch: bytes):
         oldPath = self._workspaceRoot.joinpath(old_filename).resolve() if old_filename else None
@@ -115,15 +131,19 @@ class LspClientGraphServer(GraphServer):
                 if removed:
                     # we can have removed lines only when we have old file
                     oldDoc: TokenizedDocument = await self._callGraphBuilder.getTokenizedDocument(oldPath)
-                    # start, end are inclusive, 1-based
                     for start, end in removed:
-                        for i in range(start - 1, end):
-                            # print("Removed L", i + 1, list((s.name, s.startPos, s.endPos) for s in oldDoc.scopesOnLine(i)))
-                            for scope in oldDoc.scopesOnLine(i):
-                                self._safeUpdateNodeHistory(scope, 0, 1)
+                        self._markHunkAsChanged(oldDoc, start, end, True)
                 self._stashedPatches.append((oldPath, newPath, added, None))
 
         # perform file operations
+        if self._commitSeekingMode == CommitSeekingMode.Rewind:
+            # Rewinding does not touch the graph, so the files are written in bulk in end_commit.
+            # A path may be both the source of a rename and the target of another one; the latter wins.
+            if oldPath and oldPath != newPath:
+                self._rewindChanges.setdefault(oldPath, None)
+            if newPath:
+                self._rewindChanges[newPath] = new_src or ""
+            return
         if oldPath and oldPath != newPath:
             # The file has been moved/deleted
             await self._callGraphBuilder.deleteFile(oldPath)
@@ -132,12 +152,33 @@ class LspClientGraphServer(GraphServer):
             # The file has been created/modified
             await self._callGraphBuilder.modifyFile(newPath, new_src)
             self._invalidatedFiles.add(newPath)
-        self._lastFileWrittenTime = datetime.now()
 
     def _safeUpdateNodeHistory(self, scope: CallGraphScope, addedLines: int, removedLines: int):
-        if scope.name not in self._ccgraph.nodes():
-            self._ccgraph.add_node(scope.name)
-        self._ccgraph.update_node_history(scope.name, addedLines, removedLines)
+        # accumulated until _flushNodeHistory, so that each node history is updated once per commit
+        counts = self._pendingNodeHistory.get(scope.name)
+        if counts is None:
+            self._pendingNodeHistory[scope.name] = [addedLines, removedLines]
+        else:
+            counts[0] += addedLines
+            counts[1] += removedLines
+
+    def _flushNodeHistory(self):
+        for nodeName, (addedLines, removedLines) in self._pendingNodeHistory.items():
+            if nodeName not in self._ccgraph.nodes():
+                self._ccgraph.add_node(nodeName)
+            self._ccgraph.update_node_history(nodeName, addedLines, removedLines)
+        self._pendingNodeHistory.clear()
+
+    def _markHunkAsChanged(self, doc: TokenizedDocument, start: int, end: int, markAsRemoved: bool):
+        # start, end are inclusive, 1-based
+        # Each scope counts in the lines of the hunk it spans.
+        start, end = start - 1, end - 1
+        for scope in doc.scopesInLines(start, end):
+            lines = min(end, scope.endPos.line) - max(start, scope.startPos.line) + 1
+            if markAsRemoved:
+                self._safeUpdateNodeHistory(scope, 0, lines)
+            else:
+                self._safeUpdateNodeHistory(scope, lines, 0)
 
     def _markWholeDocumentAsChanged(self, doc: TokenizedDocument, markAsRemoved: bool):
         # markAsRemoved: True: document has been deleted
@@ -181,6 +222,8 @@ class LspClientGraphServer(GraphServer):
         # update vetices & edges
         if self._commitSeekingMode != CommitSeekingMode.Rewind:
             await self.updateGraph()
+        elif self._rewindChanges:
+            await self._materializeRewindChanges()
 
         # calculate added lines
         if self._commitSeekingMode == CommitSeekingMode.NormalForward:
@@ -196,10 +239,10 @@ class LspClientGraphServer(GraphServer):
                 else:
                     assert added
                     for start, end in added:
-                        for i in range(start - 1, end):
-                            # print("Added L", i + 1, list((s.name, s.startPos, s.endPos) for s in newDoc.scopesOnLine(i)))
-                            for scope in newDoc.scopesOnLine(i):
-                                self._safeUpdateNodeHistory(scope, 1, 0)
+                        self._markHunkAsChanged(newDoc, start, end, False)
+
+        # update node history
+        self._flushNodeHistory()
 
         # update node files
         for nodeName, nodeFiles in self._symbolPaths.items():
@@ -207,10 +250,16 @@ class LspClientGraphServer(GraphServer):
 
         self._stashedPatches.clear()
 
-        # ensure the files in the next commit has a different timestamp from this commit.
-
-        if datetime.now() - self._lastFileWrittenTime < timedelta(seconds=1):
-            await asyncio.sleep(1)
+    async def _materializeRewindChanges(self):
+        """
+        Materialize the rewound commit in the workspace, writing only the files changed
+        between the trees, with a single batch of file events sent to the language server.
+        The graph of these files is re-generated in the next `updateGraph` call.
+        """
+        written = await self._callGraphBuilder.modifyFiles(self._rewindChanges.items())
+        _logger.debug("Rewind: %d files changed, %d written.", len(self._rewindChanges), written)
+        self._invalidatedFiles.update(self._rewindChanges.keys())
+        self._rewindChanges.clear()
 
     def get_graph(self):
         return self._ccgraph
@@ -241,19 +290,47 @@ class LspClientGraphServer(GraphServer):
         * self._lspClient
         * self._callGraphBuilder
         * self._callGraphManager
+
+        The derived class supporting more than one worker also calls `startWorkers`,
+        and passes the builders of `self._workers` to the `CallGraphManager`.
         """
+        self._lspServerProc = self._startLanguageServerProcess()
+
+    def _startLanguageServerProcess(self) -> subprocess.Popen:
         if os.name == "nt":
-            self._lspServerProc = subprocess.Popen(
+            return subprocess.Popen(
                 self._languageServerCommand,
                 stdin=subprocess.PIPE,
                 stdout=subprocess.PIPE,
                 creationflags=subprocess.CREATE_NEW_CONSOLE)
-        else:
-            self._lspServerProc = subprocess.Popen(
-                self._languageServerCommand,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                shell=True)
+        return subprocess.Popen(
+            self._languageServerCommand,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            shell=True)
+
+    async def startWorker(self, proc: subprocess.Popen, index: int) -> Tuple[LspClient, CallGraphBuilder]:
+        """
+        When overridden in derived class, initializes the LSP client and the call graph builder
+        of the language server process `proc`. `index` is 0 for the main language server,
+        and the 1-based index of the worker otherwise.
+        """
+        raise NotImplementedError("{0} does not support workers.".format(type(self).__name__))
+
+    async def startWorkers(self):
+        """
+        Starts the language server processes other than the main one, filling `self._workers`.
+        """
+        for index in range(1, self._workerCount):
+            proc = self._startLanguageServerProcess()
+            try:
+                client, builder = await self.startWorker(proc, index)
+            except BaseException:
+                proc.kill()
+                raise
+            self._workers.append((proc, client, builder))
+        if self._workers:
+            _logger.info("Started %d language server workers.", len(self._workers) + 1)
 
     async def stopLspClient(self):
         """
@@ -263,19 +340,25 @@ class LspClientGraphServer(GraphServer):
         """
         if not self._lspServerProc:
             return
-        _logger.info("Shutting down language server...")
-        await asyncio.wait_for(self._lspClient.server.shutdown(), 10)
-        self._lspClient.server.exit()
-        try:
-            exitCode = self._lspServerProc.wait(10)
-            _logger.info("Language server %d exited with code: %s.", self._lspServerProc.pid, exitCode)
-        except subprocess.TimeoutExpired:
-            self._lspServerProc.kill()
-            _logger.warning("Killed language server %d.", self._lspServerProc.pid)
+        for proc, client, _ in self._workers:
+            await self._stopLanguageServer(proc, client)
+        self._workers.clear()
+        await self._stopLanguageServer(self._lspServerProc, self._lspClient)
         self._lspServerProc = None
         self._callGraphBuilder = None
         self._callGraphManager = None
 
+    async def _stopLanguageServer(self, proc: subprocess.Popen, client: LspClient):
+        _logger.info("Shutting down language server...")
+        await asyncio.wait_for(client.server.shutdown(), 10)
+        client.server.exit()
+        try:
+            exitCode = proc.wait(10)
+            _logger.info("Language server %d exited with code: %s.", proc.pid, exitCode)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            _logger.warning("Killed language server %d.", proc.pid)
+
     def invalidateFile(self, path: Union[str, Path]):
         """
         Mark the call graph for the specified file as invalidated, so it should be re-generated in
@@ -294,13 +377,16 @@ class LspClientGraphServer(GraphServer):
         affectedFiles = self._callGraphManager.removeByFiles(self._invalidatedFiles)
         _logger.debug("Invalidated %d files, affected %d files.", len(self._invalidatedFiles), len(affectedFiles))
         await self._callGraphBuilder.waitForFileSystem()
+        # the files are written by the main builder
+        for _, _, builder in self._workers:
+            builder.notifyFilesChanged(self._invalidatedFiles)
         # update vertices
         # Use scope full name as identifier.
-        for path in self._orderAffectedFiles(affectedFiles):
-            path: Path
-            if not path.exists():
-                continue
-            for scope in await self._callGraphBuilder.enumScopesInFile(str(path)):
+        paths = [path for path in self._orderAffectedFiles(affectedFiles) if path.exists()]
+        scopesInFiles = await self._callGraphManager.mapFiles(
+            paths, lambda builder, fileName: builder.enumScopesInFile(fileName))
+        for scopes in scopesInFiles:
+            for scope in scopes:
                 scope: CallGraphScope
                 if scope.name not in self._ccgraph.nodes().data():
                     self._ccgraph.add_node(scope.name)
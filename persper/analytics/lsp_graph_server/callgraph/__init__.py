@@ -4,7 +4,7 @@ Basic data structures for call graph.
 import logging
 from io import IOBase
 from pathlib import Path, PurePath
-from typing import Dict, Iterable, List, NamedTuple, Tuple, Type, Union
+from typing import Dict, Iterable, List, NamedTuple, Set, Tuple, Type, Union
 
 from persper.analytics.lsp_graph_server.languageclient.lspcontract import \
     DocumentSymbol, Location, Position, SymbolInformation, SymbolKind, \
@@ -61,9 +61,16 @@ class CallGraphBranch(NamedTuple):
 
 
 class CallGraph():
+    """
+    A set of call graph branches, indexed by the files of their source and definition scopes,
+    so that invalidating files costs only the branches in them.
+    """
 
     def __init__(self):
-        self._items = set()
+        self._items: Set[CallGraphBranch] = set()
+        # {file: {branch, ...}}
+        self._bySourceFile: Dict[PurePath, Set[CallGraphBranch]] = {}
+        self._byDefinitionFile: Dict[PurePath, Set[CallGraphBranch]] = {}
 
     @property
     def items(self):
@@ -74,17 +81,34 @@ class CallGraph():
             raise ValueError("branch.sourceScope should not be None.")
         if not branch.definitionScope:
             raise ValueError("branch.definitionScope should not be None.")
-        self._items.append(branch)
+        self._items.add(branch)
+        self._bySourceFile.setdefault(branch.sourceScope.file, set()).add(branch)
+        self._byDefinitionFile.setdefault(branch.definitionScope.file, set()).add(branch)
 
     def clear(self):
         self._items.clear()
+        self._bySourceFile.clear()
+        self._byDefinitionFile.clear()
+
+    def sourceFilesReferencing(self, fileNames: Iterable[PurePath]) -> Set[PurePath]:
+        """
+        Gets the source files of the branches whose definition scopes are in the specified files.
+        """
+        return set(b.sourceScope.file for f in fileNames for b in self._byDefinitionFile.get(f, ()))
 
     def removeBySourceFiles(self, fileNames: Iterable[PurePath]):
-        if not isinstance(fileNames, set):
-            fileNames = set(fileNames)
-        newItems = [i for i in self._items if i.sourceScope.file not in fileNames]
-        _logger.info("Removed %d branches by %d files.", len(self._items) - len(newItems), len(fileNames))
-        self._items = newItems
+        removed = 0
+        fileCount = 0
+        for f in fileNames:
+            fileCount += 1
+            for b in self._bySourceFile.pop(f, ()):
+                self._items.discard(b)
+                definitionFileItems = self._byDefinitionFile[b.definitionScope.file]
+                definitionFileItems.discard(b)
+                if not definitionFileItems:
+                    del self._byDefinitionFile[b.definitionScope.file]
+                removed += 1
+        _logger.info("Removed %d branches by %d files.", removed, fileCount)
 
     def dump(self, file: IOBase):
         for i in self._items:
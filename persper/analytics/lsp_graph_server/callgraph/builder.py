@@ -7,7 +7,8 @@ from abc import ABC, abstractclassmethod
 from glob import iglob
 from os import path
 from pathlib import Path, PurePath
-from typing import Dict, Iterable, List, Type, Union
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Type, Union
+import hashlib
 import time
 
 from antlr4 import FileStream, Lexer, Token
@@ -20,9 +21,12 @@ from persper.analytics.lsp_graph_server.languageclient.lspcontract import \
     DocumentSymbol, Location, Position, SymbolInformation, SymbolKind, \
     TextDocument, TextDocumentContentChangeEvent, FileEvent, FileChangeType
 from . import CallGraphBranch, CallGraphNode, CallGraphScope
+from .intervals import IntervalIndex
 
 _logger = logging.getLogger(__name__)
 
+_NS_PER_SECOND = 1000000000
+
 _KNOWN_EXTENSION_LANGUAGES = {
     ".h": "cpp",
     ".cpp": "cpp",
@@ -80,6 +84,11 @@ class TokenizedDocument:
         # put the scopes in document order of start positions, then by the reversed document order of their end positions
         # so that we can find the smallest scope by one traverse along the scope list.
         self._scopes.sort(key=lambda sc: (sc.startPos.toTuple(), (-sc.endPos.line, -sc.endPos.character)))
+        # scopes by their (inclusive) line ranges, and by their [startPos, endPos) position ranges
+        self._scopeLines = IntervalIndex([(sc.startPos.line, sc.endPos.line) for sc in self._scopes])
+        self._scopePositions = IntervalIndex([(_positionKey(sc.startPos.line, sc.startPos.character),
+                                               _positionKey(sc.endPos.line, sc.endPos.character) - 1)
+                                              for sc in self._scopes])
         NOT_EXISTS = object()
         for t in tokens:
             t: Token
@@ -140,35 +149,28 @@ class TokenizedDocument:
         """
         Gets all the instances of CallGraphScope from the specified 0-base line number.
         """
-        scopes = []
-        for scope in self._scopes:
-            # This is inefficient (yet correct)
-            if scope.startPos.line > line:
-                break
-            if scope.endPos.line >= line:
-                scopes.append(scope)
-        return scopes
+        return [self._scopes[i] for i in self._scopeLines.overlapping(line)]
+
+    def scopesInLines(self, startLine: int, endLine: int) -> List[CallGraphScope]:
+        """
+        Gets all the instances of CallGraphScope overlapping the specified 0-base, inclusive line range,
+        e.g. a diff hunk.
+        """
+        return [self._scopes[i] for i in self._scopeLines.overlapping(startLine, endLine)]
 
     def scopeAt(self, line: int, character: int) -> CallGraphScope:
         """
         Gets the CallGraphScope from the specified 0-base line and character position
         in the document.
         """
-        L = 0
-        R = len(self._scopes) - 1
-        MatchingM = None
-        pos = Position(line, character)
-        lastScope = None
         # Find the smallest container scope, assume the scopes do not intersect with each other
-        # (either contains or not contains one another)
-        for scope in self._scopes:
-            # This is inefficient (yet correct)
-            if scope.startPos > pos:
-                break
-            if pos < scope.endPos:
-                assert lastScope is None or lastScope.startPos <= scope.startPos <= lastScope.endPos
-                lastScope = scope
-        return lastScope
+        # (either contains or not contains one another), i.e. the last container in document order.
+        containers = self._scopePositions.overlapping(_positionKey(line, character))
+        return self._scopes[containers[-1]] if containers else None
+
+
+def _positionKey(line: int, character: int) -> int:
+    return (line << 32) | character
 
 
 class CallGraphBuilder(ABC):
@@ -185,11 +187,35 @@ class CallGraphBuilder(ABC):
         self._workspaceFilePatterns: List[str] = None
         self._workspaceFilePatternsRegex: list[re.Pattern] = None
         self._deletePendingPaths = []
+        # {path: mtime in ns} the last modification time set on each written file
+        self._fileMtimes: Dict[Path, int] = {}
+        self._maxConcurrentRequests = 32
+        # {(sourcePath, contentHash): {(line, character): [Location, ...]}}
+        # the goto definition results of the unchanged files
+        self._definitionCache: Dict[Tuple[Path, str], Dict[Tuple[int, int], List[Location]]] = {}
+        # {path: {(sourcePath, contentHash), ...}} the cached results of the file at path
+        self._definitionCacheKeys: Dict[Path, Set[Tuple[Path, str]]] = {}
+        # {path: {((sourcePath, contentHash), (line, character)), ...}} the cached results having a definition
+        # in the file at path, to drop when the file changes
+        self._definitionCacheDependents: Dict[Path, Set[Tuple[Tuple[Path, str], Tuple[int, int]]]] = {}
 
     @property
     def lspClient(self):
         return self._lspClient
 
+    @property
+    def maxConcurrentRequests(self) -> int:
+        """
+        The maximum number of goto definition requests in flight when building the call graph of a file.
+        """
+        return self._maxConcurrentRequests
+
+    @maxConcurrentRequests.setter
+    def maxConcurrentRequests(self, value: int):
+        if value < 1:
+            raise ValueError("maxConcurrentRequests should be at least 1.")
+        self._maxConcurrentRequests = value
+
     # @lspClient.setter
     # def lspClient(self, value: LspClient):
     #     if not isinstance(value, LspClient):
@@ -215,7 +241,8 @@ class CallGraphBuilder(ABC):
 
     def removeDocumentCache(self, path: Union[str, PurePath]):
         """
-        Remove the lexer cache of a specified document by path.
+        Remove the lexer cache of a specified document by path, along with
+        the cached goto definition results resolved into the document.
 
         path: either be a `str` or a fully resolved `Path` instance.
         In the former case, the given path string will be resolved automatically.
@@ -226,6 +253,12 @@ class CallGraphBuilder(ABC):
             del self._tokenizedDocCache[path]
         except KeyError:
             pass
+        for key in self._definitionCacheKeys.pop(path, ()):
+            self._definitionCache.pop(key, None)
+        for key, cursor in self._definitionCacheDependents.pop(path, ()):
+            defs = self._definitionCache.get(key)
+            if defs:
+                defs.pop(cursor, None)
 
     async def getTokenizedDocument(self, path: Union[str, PurePath]):
         class MyLexerErrorListener(ErrorListener):
@@ -372,58 +405,90 @@ class CallGraphBuilder(ABC):
         textDoc = TextDocument.loadFile(srcPath, self.inferLanguageId(srcPath))
         swGotoDefintion = 0
         ctGotoDefintion = 0
-        if not await self.openDocument(textDoc):
+        ctCachedDefinition = 0
+        semaphore = asyncio.Semaphore(self._maxConcurrentRequests)
+        cacheKey = (srcPath, hashlib.sha1(textDoc.text.encode("utf-8", "replace")).hexdigest())
+        cachedDefs = self._definitionCache.get(cacheKey)
+        if cachedDefs is None:
+            cachedDefs = self._definitionCache[cacheKey] = {}
+            self._definitionCacheKeys.setdefault(srcPath, set()).add(cacheKey)
+
+        def cursorOf(node: CallGraphNode):
+            # Put the cursor to the middle.
+            return node.pos.line, node.pos.character + node.length//2
+
+        async def stopWatchedGotoDefintion(node: CallGraphNode):
+            nonlocal swGotoDefintion, ctGotoDefintion, ctCachedDefinition
+            cursor = cursorOf(node)
+            result = cachedDefs.get(cursor)
+            if result is not None:
+                ctCachedDefinition += 1
+                return result
+            async with semaphore:
+                t1 = time.monotonic()
+                result = await self._lspClient.server.textDocumentGotoDefinition(textDoc.uri, cursor)
+                swGotoDefintion += time.monotonic() - t1
+                ctGotoDefintion += 1
+            # Empty results are not cached, as the definition may appear in any file.
+            if result:
+                cachedDefs[cursor] = result
+                for d in result:
+                    self._definitionCacheDependents.setdefault(self.pathFromUri(d.uri), set()).add((cacheKey, cursor))
+            return result
+
+        # Do not waste time on namespaces
+        nodes = [node for node in thisDoc.tokens if node.kind != SymbolKind.Namespace]
+        # No need to open the document if all the definitions are cached.
+        opened = any(cursorOf(node) not in cachedDefs for node in nodes)
+        if opened and not await self.openDocument(textDoc):
             return
         try:
-            for node in thisDoc.tokens:
-                # Do not waste time on this
-                if node.kind == SymbolKind.Namespace:
-                    continue
-                # Put the cursor to the middle.
-                line, col = node.pos.line, node.pos.character + node.length//2
-                _logger.debug(node)
-
-                async def stopWatchedGotoDefintion():
-                    nonlocal swGotoDefintion, ctGotoDefintion
-                    t1 = time.monotonic()
-                    result = await self._lspClient.server.textDocumentGotoDefinition(textDoc.uri, (line, col))
-                    swGotoDefintion += time.monotonic() - t1
-                    ctGotoDefintion += 1
-                    return result
-                task = stopWatchedGotoDefintion()
-                nodeScope = thisDoc.scopeAt(line, col)
-                defs = await task
-                defNodes = []
-                for d in defs:
-                    d: Location
-                    defPath = self.pathFromUri(d.uri)
-                    if not self.filterFile(defPath):
-                        continue
-                    defsDoc = None
-                    defsDoc = await self.getTokenizedDocument(defPath)
-                    defNode = defsDoc.tokenAt(d.range.start.line, d.range.start.character)
-                    defScope = defsDoc.scopeAt(d.range.start.line, d.range.start.character)
-                    if not defNode:
-                        # Failed to retrieve a node from the given position.
-                        _logger.warning("Failed to retrieve node from %s:%s.", defPath, d.range)
-                        defNode = CallGraphNode(None, None, defPath, d.range.start, None)
-                    if defNode == node:
-                        # This node itself is a definition. Do not waste time on this.
-                        defNodes = None
-                        break
-                    if defNode.kind == SymbolKind.Namespace:
-                        # Find some namespace. Do not waste time on this.
-                        defNodes = None
-                        break
-                    defNodes.append((defNode, defScope))
-                if defNodes:
-                    for dn, ds in defNodes:
-                        counter += 1
-                        yield CallGraphBranch(nodeScope, ds, node, dn)
+            # Send the requests of a batch concurrently, and process their results in document order.
+            batchSize = self._maxConcurrentRequests * 4
+            for batchStart in range(0, len(nodes), batchSize):
+                batch = nodes[batchStart:batchStart + batchSize]
+                tasks = [asyncio.ensure_future(stopWatchedGotoDefintion(node)) for node in batch]
+                try:
+                    results = await asyncio.gather(*tasks)
+                except BaseException:
+                    for task in tasks:
+                        task.cancel()
+                    raise
+                for node, defs in zip(batch, results):
+                    _logger.debug(node)
+                    nodeScope = thisDoc.scopeAt(*cursorOf(node))
+                    defNodes = []
+                    for d in defs:
+                        d: Location
+                        defPath = self.pathFromUri(d.uri)
+                        if not self.filterFile(defPath):
+                            continue
+                        defsDoc = None
+                        defsDoc = await self.getTokenizedDocument(defPath)
+                        defNode = defsDoc.tokenAt(d.range.start.line, d.range.start.character)
+                        defScope = defsDoc.scopeAt(d.range.start.line, d.range.start.character)
+                        if not defNode:
+                            # Failed to retrieve a node from the given position.
+                            _logger.warning("Failed to retrieve node from %s:%s.", defPath, d.range)
+                            defNode = CallGraphNode(None, None, defPath, d.range.start, None)
+                        if defNode == node:
+                            # This node itself is a definition. Do not waste time on this.
+                            defNodes = None
+                            break
+                        if defNode.kind == SymbolKind.Namespace:
+                            # Find some namespace. Do not waste time on this.
+                            defNodes = None
+                            break
+                        defNodes.append((defNode, defScope))
+                    if defNodes:
+                        for dn, ds in defNodes:
+                            counter += 1
+                            yield CallGraphBranch(nodeScope, ds, node, dn)
         finally:
-            await self.closeDocument(textDoc.uri)
-        _logger.info("Performed %d gotoDefintion used %.2f s. Yielded %d branches.",
-                     ctGotoDefintion, swGotoDefintion, counter)
+            if opened:
+                await self.closeDocument(textDoc.uri)
+        _logger.info("Performed %d gotoDefintion used %.2f s, %d cached. Yielded %d branches.",
+                     ctGotoDefintion, swGotoDefintion, ctCachedDefinition, counter)
 
     async def enumScopesInFile(self, fileName: str) -> Iterable[CallGraphScope]:
         """
@@ -482,9 +547,71 @@ class CallGraphBuilder(ABC):
     async def modifyFileCore(self, filePath: Path, newContent: str):
         os.makedirs(str(filePath.parent), exist_ok=True)
         prevFileExists = filePath.exists()
-        with open(str(filePath), "wt", encoding="utf-8", errors="replace") as f:
-            f.write(newContent)
+        self._writeFile(filePath, newContent)
         uri = TextDocument.fileNameToUri(filePath)
         self._lspClient.server.workspaceDidChangeWatchedFiles(
             [FileEvent(uri, FileChangeType.Changed if prevFileExists else FileChangeType.Created)])
         _logger.debug("Modified %s.", filePath)
+
+    def notifyFilesChanged(self, fileNames: Iterable[Union[str, PurePath]]):
+        """
+        Notify the language server of the files changed in the workspace by another builder,
+        e.g. one sharing the workspace in a pool of language servers, dropping the caches of these files.
+        """
+        events = []
+        for fileName in fileNames:
+            filePath = Path(fileName).resolve()
+            self.removeDocumentCache(filePath)
+            uri = TextDocument.fileNameToUri(filePath)
+            events.append(FileEvent(uri, FileChangeType.Changed if filePath.exists() else FileChangeType.Deleted))
+        if events:
+            self._lspClient.server.workspaceDidChangeWatchedFiles(events)
+
+    def _writeFile(self, filePath: Path, content: str):
+        """
+        Write the file, making sure its mtime is at least a whole second later than any mtime it had before,
+        so that the language server sees the change even if the file is written twice within a second.
+        """
+        try:
+            prevMtime = filePath.stat().st_mtime_ns
+        except FileNotFoundError:
+            prevMtime = 0
+        # the file may have been deleted and created again
+        prevMtime = max(prevMtime, self._fileMtimes.get(filePath, 0))
+        with open(str(filePath), "wt", encoding="utf-8", errors="replace") as f:
+            f.write(content)
+        mtime = filePath.stat().st_mtime_ns
+        # Compare whole seconds, as the file system or the language server (e.g. some versions of ccls)
+        # may only keep seconds.
+        if mtime // _NS_PER_SECOND <= prevMtime // _NS_PER_SECOND:
+            mtime = (prevMtime // _NS_PER_SECOND + 1) * _NS_PER_SECOND
+            os.utime(str(filePath), ns=(mtime, mtime))
+        self._fileMtimes[filePath] = mtime
+
+    async def modifyFiles(self, changes: Iterable[Tuple[Union[str, PurePath], Optional[str]]]) -> int:
+        """
+        Write a batch of files at once, as if they are changed outside the editor,
+        notifying the language server with a single `workspace/didChangeWatchedFiles`.
+
+        changes: (fileName, newContent) pairs. The file is deleted if newContent is `None`.
+        Returns the number of files actually written or deleted.
+        """
+        events = []
+        for fileName, newContent in changes:
+            filePath = Path(fileName).resolve()
+            self.removeDocumentCache(filePath)
+            prevFileExists = filePath.exists()
+            uri = TextDocument.fileNameToUri(filePath)
+            if newContent is None:
+                if not prevFileExists:
+                    continue
+                filePath.unlink()
+                events.append(FileEvent(uri, FileChangeType.Deleted))
+            else:
+                os.makedirs(str(filePath.parent), exist_ok=True)
+                self._writeFile(filePath, newContent)
+                events.append(FileEvent(uri, FileChangeType.Changed if prevFileExists else FileChangeType.Created))
+        if events:
+            self._lspClient.server.workspaceDidChangeWatchedFiles(events)
+        _logger.debug("Modified %d files in batch.", len(events))
+        return len(events)
@@ -0,0 +1,72 @@
+"""
+Static interval index for looking up scopes by line or position.
+"""
+from bisect import bisect_right
+from typing import List, Sequence, Tuple
+
+
+class IntervalIndex():
+    """
+    A centered interval tree over closed integer intervals `[start, end]`, built once.
+    It finds the intervals overlapping a point or a range in O(log n + k).
+    Intervals are identified by their indices in the sequence given to the constructor.
+    """
+
+    def __init__(self, intervals: Sequence[Tuple[int, int]]):
+        self._intervals = list(intervals)
+        # empty intervals (end < start) never overlap anything
+        self._root = self._build([i for i, (start, end) in enumerate(self._intervals) if start <= end])
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def _build(self, ids: List[int]):
+        if not ids:
+            return None
+        endpoints = sorted(p for i in ids for p in self._intervals[i])
+        center = endpoints[len(endpoints) // 2]
+        left, right, here = [], [], []
+        for i in ids:
+            start, end = self._intervals[i]
+            if end < center:
+                left.append(i)
+            elif start > center:
+                right.append(i)
+            else:
+                here.append(i)
+        # the intervals containing center, by ascending start and by descending end
+        byStart = sorted(here, key=lambda i: self._intervals[i][0])
+        byEnd = sorted(here, key=lambda i: -self._intervals[i][1])
+        return (center,
+                [self._intervals[i][0] for i in byStart], byStart,
+                [-self._intervals[i][1] for i in byEnd], byEnd,
+                self._build(left), self._build(right))
+
+    def overlapping(self, lo: int, hi: int = None) -> List[int]:
+        """
+        Gets the indices of the intervals overlapping `[lo, hi]` (or containing `lo`, if `hi` is `None`),
+        in ascending order.
+        """
+        if hi is None:
+            hi = lo
+        result = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            center, starts, byStart, negEnds, byEnd, left, right = node
+            if hi < center:
+                # the intervals here end after hi, so they overlap iff they start before hi
+                result.extend(byStart[:bisect_right(starts, hi)])
+                stack.append(left)
+            elif lo > center:
+                # the intervals here start before lo, so they overlap iff they end after lo
+                result.extend(byEnd[:bisect_right(negEnds, -lo)])
+                stack.append(right)
+            else:
+                result.extend(byStart)
+                stack.append(left)
+                stack.append(right)
+        result.sort()
+        return result
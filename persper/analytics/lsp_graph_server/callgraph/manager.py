@@ -1,9 +1,11 @@
 """
 Contains CallGraphManager.
 """
+import asyncio
 import logging
+import zlib
 from pathlib import Path, PurePath
-from typing import Iterable, NamedTuple, Tuple, Union
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Tuple, Union
 from os import path
 
 from . import CallGraph
@@ -16,13 +18,25 @@ class CallGraphManager():
     """
     Used to construct / update call graph independently of specific implementations of
     CallGraphBuilder.
+
+    With `workers`, the builders of a pool of language servers sharing the workspace,
+    the files are routed to `builder` and the workers by their paths, and processed in parallel.
+    A file can be routed along with another one with `routeWith`.
     """
 
-    def __init__(self, builder: CallGraphBuilder, callGraph: CallGraph = None):
+    def __init__(self, builder: CallGraphBuilder, callGraph: CallGraph = None,
+                 workers: Iterable[CallGraphBuilder] = None):
         if not isinstance(builder, CallGraphBuilder):
             raise TypeError("builderType should be a subtype of CallGraphBuilder.")
         self._builder = builder
+        self._builders = [builder]
+        for w in workers or ():
+            if not isinstance(w, CallGraphBuilder):
+                raise TypeError("workers should be instances of CallGraphBuilder.")
+            self._builders.append(w)
         self._graph = callGraph or CallGraph()
+        # {fileName: builder} of the files routed by routeWith
+        self._routes: Dict[str, CallGraphBuilder] = {}
         # self._rebuildCounter = 0
 
     @property
@@ -32,6 +46,55 @@ class CallGraphManager():
         """
         return self._graph
 
+    @property
+    def builders(self) -> List[CallGraphBuilder]:
+        """
+        Gets the builder and the workers.
+        """
+        return self._builders
+
+    def builderFor(self, fileName: Union[str, PurePath]) -> CallGraphBuilder:
+        """
+        Gets the builder the specified file is routed to. A file is always routed to the same builder,
+        unless it is routed along with another file by `routeWith`.
+        """
+        if len(self._builders) == 1:
+            return self._builder
+        fileName = str(fileName)
+        builder = self._routes.get(fileName)
+        if builder is not None:
+            return builder
+        return self._builders[zlib.crc32(fileName.encode("utf-8")) % len(self._builders)]
+
+    def routeWith(self, fileName: Union[str, PurePath], otherFileName: Union[str, PurePath]):
+        """
+        Routes the specified file to the builder `otherFileName` is routed to from now on,
+        e.g. a header to the builder of a source file including it.
+        """
+        if len(self._builders) > 1:
+            self._routes[str(fileName)] = self.builderFor(otherFileName)
+
+    async def mapFiles(self, fileNames: Iterable[Union[str, PurePath]],
+                       func: Callable[[CallGraphBuilder, str], Awaitable[Any]]) -> List[Any]:
+        """
+        Invoke `func(builder, fileName)` on each file with the builder it is routed to.
+        The files routed to the same builder are processed in the given order, while the builders work in parallel.
+
+        Returns the results in the order of `fileNames`.
+        """
+        fileNames = [str(fn) for fn in fileNames]
+        results = [None] * len(fileNames)
+        shards = {}
+        for i, fn in enumerate(fileNames):
+            shards.setdefault(id(self.builderFor(fn)), []).append(i)
+
+        async def processShard(indices):
+            for i in indices:
+                fn = fileNames[i]
+                results[i] = await func(self.builderFor(fn), fn)
+        await asyncio.gather(*(processShard(indices) for indices in shards.values()))
+        return results
+
     async def buildGraph(self, fileNames: Union[str, Iterable[str]] = None, globPattern: Union[str, Iterable[str]] = None):
         """
         Build call graph branches from the specified files.
@@ -56,13 +119,19 @@ class CallGraphManager():
         if fileNames:
             if isinstance(fileNames, (str, PurePath)):
                 fileNames = [fileNames]
-            for fn in fileNames:
-                sfn = str(fn)
-                if not path.exists(sfn):
-                    continue
-                fileCounter += 1
-                async for b in self._builder.buildCallGraphInFile(sfn):
-                    pushBranch(b)
+            fileNames = [str(fn) for fn in fileNames if path.exists(str(fn))]
+            fileCounter = len(fileNames)
+            if len(self._builders) == 1:
+                for sfn in fileNames:
+                    async for b in self._builder.buildCallGraphInFile(sfn):
+                        pushBranch(b)
+            else:
+                async def buildInFile(builder: CallGraphBuilder, fileName: str):
+                    return [b async for b in builder.buildCallGraphInFile(fileName)]
+                # Merge the branches in the order of the files, as if they were built by a single builder.
+                for branches in await self.mapFiles(fileNames, buildInFile):
+                    for b in branches:
+                        pushBranch(b)
         if globPattern or not fileNames:
             async for b in self._builder.buildCallGraphInFiles(globPattern):
                 pushBranch(b)
@@ -76,7 +145,7 @@ class CallGraphManager():
         Clear the graph nodes whose source or definition node contains the specified files.
         """
         fileNames = set((Path(f).resolve() for f in fileNames))
-        affectedFiles = set((i.sourceScope.file for i in self._graph.items if i.definitionScope.file in fileNames))
+        affectedFiles = self._graph.sourceFilesReferencing(fileNames)
         affectedFiles.update(fileNames)
         self._graph.removeBySourceFiles(affectedFiles)
         return affectedFiles
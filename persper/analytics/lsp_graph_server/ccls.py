@@ -1,12 +1,14 @@
 """
 ccls client-side LSP support.
 """
+import asyncio
 import logging
 import os
+import re
 import time
 from asyncio import sleep
 from pathlib import Path, PurePath
-from typing import List, Union
+from typing import Awaitable, Callable, Iterable, List, Optional, Union
 
 from antlr4 import Token
 from antlr4.FileStream import FileStream
@@ -17,6 +19,7 @@ from persper.analytics.call_commit_graph import CallCommitGraph
 
 from . import LspClientGraphServer
 from .callgraph.builder import CallGraphBuilder
+from .cclscache import CclsIndexCache
 from .callgraph.manager import CallGraphManager
 from .fileparsers.CPP14Lexer import CPP14Lexer
 from .languageclient.lspclient import LspClient
@@ -25,6 +28,8 @@ from .languageclient.lspserver import LspServerStub
 
 _logger = logging.getLogger(__name__)
 
+_INCLUDE_PATTERN = re.compile(r'^[ \t]*#[ \t]*include[ \t]*"([^"]+)"', re.MULTILINE)
+
 
 class CclsInfo(LspContractObject):
     def __init__(self, pendingIndexRequests: int, postIndexWorkItems: int, projectEntries: int):
@@ -61,16 +66,70 @@ class CclsLspServerStub(LspServerStub):
         return CclsInfo.fromDict(result)
 
 
+class CclsIndexingTracker:
+    """
+    Waits for the indexing jobs of ccls to complete.
+
+    ccls publishes the skipped ranges and semantic highlight of an open document whenever
+    the document has been indexed. These notifications wake up the waiters through an
+    asyncio Event, so that the job count is queried again as soon as some job completes.
+    Without notifications, the job count is polled with exponential backoff.
+    """
+
+    def __init__(self, minDelay: float = 0.01, maxDelay: float = 1):
+        self._minDelay = minDelay
+        self._maxDelay = maxDelay
+        self._loop: asyncio.AbstractEventLoop = None
+        self._event: asyncio.Event = None
+
+    def notify(self):
+        """
+        Wakes up the waiters. This can be called from any thread, e.g. the listener thread of LspClient.
+        """
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    async def wait(self, pendingJobs: Callable[[], Awaitable[int]]):
+        """
+        Waits until `pendingJobs()` returns 0.
+        """
+        if not self._loop:
+            # notify may run concurrently on another thread once _loop is set
+            self._event = asyncio.Event()
+            self._loop = asyncio.get_event_loop()
+        delay = self._minDelay
+        lastJobs = None
+        while True:
+            # Clear before querying, so that a notification during the query is not missed.
+            self._event.clear()
+            curJobs = await pendingJobs()
+            if curJobs != lastJobs:
+                _logger.debug("Server jobs: %d.", curJobs)
+                lastJobs = curJobs
+            if curJobs == 0:
+                return
+            try:
+                await asyncio.wait_for(self._event.wait(), delay)
+                delay = self._minDelay
+            except asyncio.TimeoutError:
+                delay = min(delay * 2, self._maxDelay)
+
+
 class CclsLspClient(LspClient):
     def __init__(self, rx, tx, logFile: str = None):
         super().__init__(rx, tx, logFile)
         self._serverStub = CclsLspServerStub(self._endpoint)
+        self._indexingTracker = CclsIndexingTracker()
+
+    @property
+    def indexingTracker(self) -> CclsIndexingTracker:
+        return self._indexingTracker
 
     def m_ccls__publish_skipped_ranges(self, uri: str, skippedRanges: list):
-        pass
+        self._indexingTracker.notify()
 
     def m_ccls__publish_semantic_highlight(self, uri: str, symbols: list):
-        pass
+        self._indexingTracker.notify()
 
 
 class CclsCallGraphBuilder(CallGraphBuilder):
@@ -115,6 +174,7 @@ class CclsCallGraphBuilder(CallGraphBuilder):
         super().__init__(lspClient)
         self._lspClient: CclsLspClient
         self._openDocumentWaitDuration = 0
+        self.indexCache: CclsIndexCache = None
 
     def createLexer(self, fileStream: FileStream):
         return CPP14Lexer(fileStream)
@@ -128,22 +188,29 @@ class CclsCallGraphBuilder(CallGraphBuilder):
     def modifyFile(self, fileName: str, newContent: str):
         return super().modifyFile(fileName, newContent)
 
+    def _writeFile(self, filePath: Path, content: str):
+        super()._writeFile(filePath, content)
+        # before the language server is notified of the change
+        if self.indexCache:
+            self.indexCache.seed(filePath, content)
+
+    def notifyFilesChanged(self, fileNames: Iterable[Union[str, PurePath]]):
+        fileNames = list(fileNames)
+        if self.indexCache:
+            # the files written by another builder, into the cache directory of this language server
+            for fileName in fileNames:
+                filePath = Path(fileName).resolve()
+                if filePath.exists():
+                    with open(str(filePath), "rt", encoding="utf-8", errors="replace") as f:
+                        self.indexCache.seed(filePath, f.read())
+        super().notifyFilesChanged(fileNames)
+
+    async def _pendingJobs(self):
+        info: CclsInfo = await self._lspClient.server.cclsInfo()
+        return info.pendingIndexRequests + info.postIndexWorkItems
+
     async def _waitForJobs(self):
-        lastJobs = None
-        while True:
-            info: CclsInfo = await self._lspClient.server.cclsInfo()
-            curJobs = info.pendingIndexRequests + info.postIndexWorkItems
-            if curJobs != lastJobs:
-                _logger.debug("Server jobs: %d.", curJobs)
-                lastJobs = curJobs
-            if curJobs == 0:
-                break
-            if curJobs < 5:
-                await sleep(0.05)
-            elif curJobs < 50:
-                await sleep(0.1)
-            else:
-                await sleep(1)
+        await self._lspClient.indexingTracker.wait(self._pendingJobs)
 
     async def openDocument(self, textDoc: TextDocument):
         self._lspClient.server.textDocumentDidOpen(textDoc)
@@ -152,6 +219,8 @@ class CclsCallGraphBuilder(CallGraphBuilder):
             try:
                 await self._waitForJobs()
                 self._openDocumentWaitDuration += time.monotonic() - t1
+                if self.indexCache:
+                    self.indexCache.markIndexed(self.pathFromUri(textDoc.uri))
                 return True
             except JsonRpcException as ex:
                 if ex.code == -32002:
@@ -175,40 +244,73 @@ class CclsGraphServer(LspClientGraphServer):
     def __init__(self, workspaceRoot: str, cacheRoot: str = None,
                  languageServerCommand: Union[str, List[str]] = None,
                  dumpLogs: bool = False,
-                 graph: CallCommitGraph = None):
+                 graph: CallCommitGraph = None,
+                 workers: int = 1,
+                 indexStoreRoot: str = None):
+        """
+        cacheRoot: the cache directory of ccls, or `True` for ".ccls-cache" in the workspace.
+        The other workers use their own cache directories next to it, e.g. ".ccls-cache.1".
+
+        indexStoreRoot: if specified, the ccls indexes are stored in this directory by the file contents,
+        and reused by the following analyses whenever a file is written with the same content.
+        See `CclsIndexCache`.
+        """
         super().__init__(workspaceRoot, languageServerCommand=languageServerCommand,
-                         dumpLogs=dumpLogs, graph=graph)
-        if cacheRoot == True:
+                         dumpLogs=dumpLogs, graph=graph, workers=workers)
+        if cacheRoot == True or indexStoreRoot and not cacheRoot:
             cacheRoot = self._workspaceRoot.joinpath(".ccls-cache")
         self._cacheRoot = Path(cacheRoot).resolve() if cacheRoot else None
+        self._indexStoreRoot = indexStoreRoot
         self._c_requireScopeDefinitionMatch = True
 
     async def startLspClient(self):
         await super().startLspClient()
-        self._lspClient = CclsLspClient(self._lspServerProc.stdout, self._lspServerProc.stdin,
-                                        logFile="rpclog.log" if self._dumpLogs else None)
-        self._lspClient.start()
-        _logger.debug(await self._lspClient.server.initialize(
+        self._lspClient, self._callGraphBuilder = await self.startWorker(self._lspServerProc, 0)
+        await self.startWorkers()
+        self._callGraphManager = CallGraphManager(self._callGraphBuilder, self._callGraph,
+                                                  [builder for _, _, builder in self._workers])
+
+    def _workerCacheRoot(self, index: int) -> Optional[Path]:
+        if not self._cacheRoot or index == 0:
+            return self._cacheRoot
+        return self._cacheRoot.with_name("{0}.{1}".format(self._cacheRoot.name, index))
+
+    async def startWorker(self, proc, index):
+        # The workers share the workspace. Each of them indexes the whole workspace,
+        # as goto definition needs the other files, into its own cache directory.
+        logFile = None
+        if self._dumpLogs:
+            logFile = "rpclog{0}.log".format(index) if index else "rpclog.log"
+        lspClient = CclsLspClient(proc.stdout, proc.stdin, logFile=logFile)
+        lspClient.start()
+        cacheRoot = self._workerCacheRoot(index)
+        initializationOptions = {"cacheDirectory": str(cacheRoot),
+                                 "diagnostics": {"onParse": False, "onType": False},
+                                 "discoverSystemIncludes": True,
+                                 "enableCacheRead": cacheRoot != None,
+                                 "enableCacheWrite": cacheRoot != None,
+                                 "clang": {
+                                     "excludeArgs": [],
+                                     "extraArgs": [
+                                         "-nocudalib",
+                                         "-fno-delayed-template-parsing"      # fix for not parsing templates on windows-msvc
+                                     ],
+                                     "pathMappings": [],
+                                     "resourceDir": ""
+                                 },
+                                 "index": {"threads": 0}
+                                 }
+        if self._indexStoreRoot:
+            # so that CclsIndexCache can rewrite the indexes
+            initializationOptions["cacheFormat"] = "json"
+        _logger.debug(await lspClient.server.initialize(
             rootFolder=self._workspaceRoot,
-            initializationOptions={"cacheDirectory": str(self._cacheRoot),
-                                   "diagnostics": {"onParse": False, "onType": False},
-                                   "discoverSystemIncludes": True,
-                                   "enableCacheRead": self._cacheRoot != None,
-                                   "enableCacheWrite": self._cacheRoot != None,
-                                   "clang": {
-                                       "excludeArgs": [],
-                                       "extraArgs": [
-                                           "-nocudalib",
-                                           "-fno-delayed-template-parsing"      # fix for not parsing templates on windows-msvc
-                                       ],
-                                       "pathMappings": [],
-                                       "resourceDir": ""
-            },
-                "index": {"threads": 0}
-            }))
-        self._lspClient.server.initialized()
-        self._callGraphBuilder = CclsCallGraphBuilder(self._lspClient)
-        self._callGraphBuilder.workspaceFilePatterns = [
+            initializationOptions=initializationOptions))
+        lspClient.server.initialized()
+        builder = CclsCallGraphBuilder(lspClient)
+        if self._indexStoreRoot:
+            builder.indexCache = CclsIndexCache(self._indexStoreRoot, self._workspaceRoot, cacheRoot)
+        builder.workspaceFilePatterns = [
             str(self._workspaceRoot.joinpath("**/*.[Hh]")),
             str(self._workspaceRoot.joinpath("**/*.[Hh][Hh]")),
             str(self._workspaceRoot.joinpath("**/*.[Hh][Pp][Pp]")),
@@ -217,22 +319,61 @@ class CclsGraphServer(LspClientGraphServer):
             str(self._workspaceRoot.joinpath("**/*.[Cc][Pp][Pp]")),
             str(self._workspaceRoot.joinpath("**/*.[Cc][Xx][Xx]"))
         ]
-        self._callGraphManager = CallGraphManager(self._callGraphBuilder, self._callGraph)
+        return lspClient, builder
+
+    async def stopLspClient(self):
+        if self._indexStoreRoot and self._callGraphManager:
+            for builder in self._callGraphManager.builders:
+                builder.indexCache.harvest()
+                builder.indexCache.logStats()
+        await super().stopLspClient()
 
     def _orderAffectedFiles(self, paths: List[Path]):
         # put cpp files ahead of h files to ensure h files are parsed correctly (e.g. stdafx.h/pch.h)
+        sourceFiles = []
         otherFiles = []
         for p in paths:
             p: Path
             if p.name.endswith(".c") or p.name.endswith(".cc") or p.name.endswith(".cpp"):
-                yield p
+                sourceFiles.append(p)
             else:
                 otherFiles.append(p)
-        for p in otherFiles:
-            yield p
+        if len(self._callGraphManager.builders) > 1:
+            self._routeHeaders(sourceFiles, otherFiles)
+        return sourceFiles + otherFiles
+
+    def _routeHeaders(self, sourceFiles: List[Path], headers: List[Path]):
+        """
+        Routes each header to the worker of the first source file including it, so that the worker
+        opens the header after the source file, as a single language server does.
+        """
+        headerSet = set(headers)
+        headersByName = {}
+        for h in headers:
+            headersByName.setdefault(h.name, []).append(h)
+        routed = set()
+        for source in sourceFiles:
+            try:
+                with open(str(source), "rt", encoding="utf-8", errors="replace") as f:
+                    includes = _INCLUDE_PATTERN.findall(f.read())
+            except OSError:
+                continue
+            for include in includes:
+                header = source.parent.joinpath(include).resolve()
+                if header not in headerSet:
+                    # e.g. found in the include directories, if the name is unique
+                    candidates = headersByName.get(PurePath(include).name)
+                    header = candidates[0] if candidates and len(candidates) == 1 else None
+                if header and header not in routed:
+                    routed.add(header)
+                    self._callGraphManager.routeWith(header, source)
 
     async def end_commit(self, hexsha: str):
         try:
             await super().end_commit(hexsha)
+            if self._indexStoreRoot:
+                for builder in self._callGraphManager.builders:
+                    builder.indexCache.harvest()
         finally:
-            self._callGraphBuilder.logOpenDocumentWaitDuration()
+            for builder in self._callGraphManager.builders:
+                builder.logOpenDocumentWaitDuration()
@@ -0,0 +1,248 @@
+"""
+Persistent ccls index cache, reused across analysis runs.
+"""
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path, PurePath
+from typing import Dict, NamedTuple, Optional, Tuple, Union
+
+_logger = logging.getLogger(__name__)
+
+# Stands for the workspace root in the stored indexes, so that they can be reused in another workspace.
+_WORKSPACE_ROOT_PLACEHOLDER = "${workspaceRoot}/"
+_NS_PER_SECOND = 1000000000
+
+
+class CclsIndexCacheStats(NamedTuple):
+    # seeded indexes ccls has loaded
+    hits: int
+    # files written without a stored index, or whose seeded index ccls has not loaded
+    misses: int
+    # indexes put into the store
+    stored: int
+
+
+class CclsIndexCache:
+    """
+    A store of the ccls indexes of the workspace files, keyed by the path relative to the workspace
+    and the content of the file. It seeds the cache directory of ccls when a file is written with
+    some content indexed in a previous run, so ccls loads the index instead of parsing the file again.
+
+    ccls only loads an index whose recorded modification time is not earlier than the file's, so the
+    indexes are kept in ccls's json cache format (`"cacheFormat": "json"`), and the modification times
+    of the file and its dependencies are rewritten when seeding. A dependency in the workspace
+    must have the same content as when the index was stored.
+
+    A seeded index counts as a hit once ccls has indexed the file (see `markIndexed`) without writing
+    a new index over it. Otherwise ccls has parsed the file again, and its new index is stored instead.
+
+    The store holds a `<sha1>.json` file per index, with the workspace root replaced by a placeholder::
+
+        {"mtimeUnit": nanoseconds per unit of the modification times in the index,
+         "dependencies": {relativePath: sha1 of the content},
+         "index": ccls index json}
+    """
+
+    def __init__(self, storeRoot: Union[str, PurePath], workspaceRoot: Union[str, PurePath],
+                 cacheRoot: Union[str, PurePath]):
+        self._storeRoot = Path(storeRoot).resolve()
+        self._workspaceRoot = Path(workspaceRoot).resolve()
+        self._cacheRoot = Path(cacheRoot).resolve()
+        os.makedirs(str(self._storeRoot), exist_ok=True)
+        self._rootPrefix = self._workspaceRoot.as_posix().rstrip("/") + "/"
+        # {path: key} of the files written without a stored index, to be stored once ccls indexes them
+        self._pendingPaths: Dict[Path, str] = {}
+        # {path: (key, stamp of the seeded index)} of the seeded files, until ccls indexes them
+        self._seededPaths: Dict[Path, Tuple[str, Tuple[int, int]]] = {}
+        # {path: (mtime in ns, sha1)}
+        self._contentHashes: Dict[Path, Tuple[int, str]] = {}
+        self._hits = 0
+        self._misses = 0
+        self._stored = 0
+
+    @property
+    def stats(self) -> CclsIndexCacheStats:
+        return CclsIndexCacheStats(self._hits, self._misses, self._stored)
+
+    def logStats(self):
+        _logger.info("ccls index cache: %d hits, %d misses, %d stored.", self._hits, self._misses, self._stored)
+
+    def cachePathOf(self, path: Path) -> Path:
+        """
+        Gets the path of the file in the cache directory of ccls. The index is at the same path with ".json" appended.
+
+        As ccls's `GetCachePath`, a file in the workspace is kept in a directory named after the workspace root,
+        by its relative path, and any other file in the same directory prefixed with "@", by its absolute path.
+        """
+        def escape(p: str):
+            return p.replace("\\", "@").replace("/", "@").replace(":", "@")
+        posixPath = path.as_posix()
+        rootDir = escape(self._rootPrefix[:-1])
+        if posixPath.startswith(self._rootPrefix):
+            return self._cacheRoot.joinpath(rootDir, escape(posixPath[len(self._rootPrefix):]))
+        return self._cacheRoot.joinpath("@" + rootDir, escape(posixPath))
+
+    def _relativePath(self, path: Path) -> Optional[str]:
+        posixPath = path.as_posix()
+        if posixPath.startswith(self._rootPrefix):
+            return posixPath[len(self._rootPrefix):]
+        return None
+
+    def _storePath(self, key: str) -> Path:
+        return self._storeRoot.joinpath(key + ".json")
+
+    def _contentHash(self, path: Path) -> Optional[str]:
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+        cached = self._contentHashes.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(str(path), "rb") as f:
+            contentHash = hashlib.sha1(f.read()).hexdigest()
+        self._contentHashes[path] = (mtime, contentHash)
+        return contentHash
+
+    def seed(self, path: Path, content: str) -> bool:
+        """
+        Seeds the cache directory of ccls with the stored index of the file just written with `content`.
+        Returns whether the index is seeded.
+        """
+        relPath = self._relativePath(path)
+        if relPath is None:
+            return False
+        encoded = content.encode("utf-8", "replace")
+        contentHash = hashlib.sha1(encoded).hexdigest()
+        self._contentHashes[path] = (path.stat().st_mtime_ns, contentHash)
+        key = hashlib.sha1((relPath + "\0" + contentHash).encode("utf-8")).hexdigest()
+        self._pendingPaths.pop(path, None)
+        self._seededPaths.pop(path, None)
+        try:
+            if self._trySeed(path, key, encoded):
+                self._seededPaths[path] = (key, self._indexStamp(path))
+                return True
+        except (OSError, ValueError) as ex:
+            _logger.warning("Cannot seed the ccls index of %s: %s", path, ex)
+        self._misses += 1
+        self._pendingPaths[path] = key
+        return False
+
+    def _indexStamp(self, path: Path) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(str(self.cachePathOf(path)) + ".json")
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def markIndexed(self, path: Path):
+        """
+        Tells that ccls has indexed the file, e.g. it has no pending jobs after opening the file.
+        A seeded index counts as a hit if ccls has not written another index over it.
+        """
+        seeded = self._seededPaths.pop(path, None)
+        if seeded is None:
+            return
+        key, stamp = seeded
+        if self._indexStamp(path) == stamp:
+            self._hits += 1
+        else:
+            self._reindexed(path, key)
+
+    def _reindexed(self, path: Path, key: str):
+        _logger.debug("ccls has not loaded the seeded index of %s.", path)
+        self._misses += 1
+        # ccls's own index replaces the stored one
+        self._pendingPaths[path] = key
+
+    def _trySeed(self, path: Path, key: str, content: bytes) -> bool:
+        storePath = self._storePath(key)
+        if not storePath.exists():
+            return False
+        with open(str(storePath), "rt", encoding="utf-8") as f:
+            entry = json.load(f)
+        for depPath, depHash in entry["dependencies"].items():
+            if self._contentHash(self._workspaceRoot.joinpath(depPath)) != depHash:
+                _logger.debug("Dependency %s of %s has changed.", depPath, path)
+                return False
+        rootPrefix = json.dumps(self._rootPrefix)[1:-1]
+        index = json.loads(entry["index"].replace(_WORKSPACE_ROOT_PLACEHOLDER, rootPrefix))
+        unit = entry["mtimeUnit"]
+
+        def mtimeOf(p: str) -> Optional[int]:
+            try:
+                return os.stat(p).st_mtime_ns // unit
+            except FileNotFoundError:
+                return None
+        for field in ("mtime", "last_write_time"):
+            if field in index:
+                index[field] = mtimeOf(str(path))
+        dependencies = index.get("dependencies")
+        if isinstance(dependencies, dict):
+            for depPath, depMtime in dependencies.items():
+                dependencies[depPath] = mtimeOf(depPath) or depMtime
+        cachePath = self.cachePathOf(path)
+        os.makedirs(str(cachePath.parent), exist_ok=True)
+        with open(str(cachePath), "wb") as f:
+            f.write(content)
+        with open(str(cachePath) + ".json", "wt", encoding="utf-8") as f:
+            json.dump(index, f)
+        _logger.debug("Seeded ccls index of %s.", path)
+        return True
+
+    def harvest(self):
+        """
+        Stores the indexes ccls has written for the files without a stored index, or over a seeded one.
+        The files not indexed yet are kept for the next harvest.
+        """
+        for path, (key, stamp) in list(self._seededPaths.items()):
+            if self._indexStamp(path) != stamp:
+                del self._seededPaths[path]
+                self._reindexed(path, key)
+        for path, key in list(self._pendingPaths.items()):
+            try:
+                if self._tryStore(path, key):
+                    self._stored += 1
+                    del self._pendingPaths[path]
+            except FileNotFoundError:
+                del self._pendingPaths[path]
+            except (OSError, ValueError) as ex:
+                _logger.warning("Cannot store the ccls index of %s: %s", path, ex)
+                del self._pendingPaths[path]
+
+    def _tryStore(self, path: Path, key: str) -> bool:
+        indexPath = str(self.cachePathOf(path)) + ".json"
+        if not os.path.exists(indexPath):
+            return False
+        with open(indexPath, "rt", encoding="utf-8") as f:
+            text = f.read()
+        index = json.loads(text)
+        mtime = index.get("mtime", index.get("last_write_time"))
+        fileMtime = path.stat().st_mtime_ns
+        # ccls records the modification time in nanoseconds or seconds, depending on its version.
+        if mtime == fileMtime:
+            unit = 1
+        elif mtime == fileMtime // _NS_PER_SECOND:
+            unit = _NS_PER_SECOND
+        else:
+            # the index is outdated
+            return False
+        dependencies = {}
+        depPaths = index.get("dependencies") or ()
+        for depPath in depPaths:
+            depPath = Path(depPath)
+            relPath = self._relativePath(depPath)
+            if relPath is not None:
+                dependencies[relPath] = self._contentHash(depPath)
+        rootPrefix = json.dumps(self._rootPrefix)[1:-1]
+        entry = {"mtimeUnit": unit,
+                 "dependencies": dependencies,
+                 "index": text.replace(rootPrefix, _WORKSPACE_ROOT_PLACEHOLDER)}
+        storePath = self._storePath(key)
+        tmpPath = str(storePath) + ".tmp"
+        with open(tmpPath, "wt", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmpPath, str(storePath))
+        return True
@@ -112,6 +112,9 @@ class Position(LspContractObject):
     def __lt__(self, other: "Position"):
         return self.line < other.line or self.line == other.line and self.character < other.character
 
+    def __hash__(self):
+        return hash((self.line, self.character))
+
     def toTuple(self):
         return (self.line, self.character)
 
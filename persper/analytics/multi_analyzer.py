@@ -12,6 +12,7 @@ from persper.util.normalize_score import normalize_with_coef
 from persper.analytics.graph_server import C_FILENAME_REGEXES
 from persper.analytics.graph_server import CPP_FILENAME_REGEXES
 from persper.analytics.analyzer2 import Analyzer, AnalyzerObserver, emptyAnalyzerObserver
+from persper.analytics.history_index import rev_list
 
 
 _logger = logging.getLogger(__name__)
@@ -35,9 +36,10 @@ class MultiAnalyzer:
 
     LANGUAGE_THRESHOLD = 0.3
 
-    def __init__(self, repo_path):
+    def __init__(self, repo_path, history_index=None):
         self._repo_path = repo_path
         self._repo = Repo(repo_path)
+        self._history_index = history_index
         self._observer: AnalyzerObserver = emptyAnalyzerObserver
         self._linguist = {}
         self._analyzers = {}
@@ -125,13 +127,20 @@ class MultiAnalyzer:
     def basic_stats(self, alpha=0.5, show_merge=True):
         commit_share = self.project_commit_share(alpha)
         points = []
-        for commit in self._repo.iter_commits():
+        if self._history_index is not None:
+            # the commits made after the index was built are read from the repository
+            commits = [(hexsha, self._history_index.is_merge(hexsha) if hexsha in self._history_index
+                        else _is_merged_commit(self._repo.commit(hexsha)))
+                       for hexsha in rev_list(self._repo, 'HEAD')]
+        else:
+            commits = [(commit.hexsha, _is_merged_commit(commit)) for commit in self._repo.iter_commits()]
+        for hexsha, is_merge in commits:
 
-            if _is_merged_commit(commit) and not show_merge:
+            if is_merge and not show_merge:
                 continue
 
-            if commit.hexsha in commit_share:
-                points.append(commit_share[commit.hexsha])
+            if hexsha in commit_share:
+                points.append(commit_share[hexsha])
             else:
                 points.append(0.0)
 
@@ -139,8 +148,10 @@ class MultiAnalyzer:
 
     def _supported_analyzers(self, language=None):
         analyzers = {
-            'C': Analyzer(self._repo_path, CGraphServer(C_FILENAME_REGEXES), firstParentOnly=True),
-            'C++': Analyzer(self._repo_path, CPPGraphServer(CPP_FILENAME_REGEXES), firstParentOnly=True)
+            'C': Analyzer(self._repo_path, CGraphServer(C_FILENAME_REGEXES), firstParentOnly=True,
+                          history_index=self._history_index),
+            'C++': Analyzer(self._repo_path, CPPGraphServer(CPP_FILENAME_REGEXES), firstParentOnly=True,
+                            history_index=self._history_index)
         }
 
         if language:
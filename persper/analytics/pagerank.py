@@ -1,29 +1,21 @@
 from numpy import linalg as LA
 import numpy as np
-from scipy.sparse import coo_matrix
+from scipy.sparse import csc_matrix
+
+from persper.analytics.csr import digraph_to_csr
 
 
 def pagerank(G, alpha=0.85, epsilon=1e-5, max_iters=300):
     """Memory efficient PageRank using scipy.sparse
     This function implements Algo 1. in "A Survey on PageRank Computing"
     """
-    ni = {}
-    for i, u in enumerate(G):
-        ni[u] = i
-
-    num_nodes = len(G.nodes())
+    csr = digraph_to_csr(G)
+    num_nodes = len(csr.nodes)
 
-    row, col, data = [], [], []
-    for u in G:
-        num_out_edges = len(G[u])
-        if num_out_edges > 0:
-            w = 1 / num_out_edges
-            for v in G[u]:
-                row.append(ni[v])
-                col.append(ni[u])
-                data.append(w)
-
-    P = coo_matrix((data, (row, col)), shape=(num_nodes, num_nodes)).tocsr()
+    # column u of the transition matrix spreads u's rank evenly among its out edges
+    out_degrees = np.diff(csr.indptr)
+    data = np.repeat(1 / np.maximum(out_degrees, 1), out_degrees)
+    P = csc_matrix((data, csr.indices, csr.indptr), shape=(num_nodes, num_nodes)).tocsr()
     p = np.ones(num_nodes) / num_nodes
     v = np.ones(num_nodes) / num_nodes
 
@@ -36,8 +28,4 @@ def pagerank(G, alpha=0.85, epsilon=1e-5, max_iters=300):
             break
         v = new_v
 
-    pr = {}
-    for u in G:
-        pr[u] = v[ni[u]]
-
-    return pr
+    return dict(zip(csr.nodes, v.tolist()))
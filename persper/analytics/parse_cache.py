@@ -0,0 +1,157 @@
+"""
+parse_cache.py
+====================================
+An on-disk, size-bounded LRU cache of the functions extracted from source files
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_logger = logging.getLogger(__name__)
+
+
+def source_key(filename: str, src: str) -> str:
+    """
+    Get the cache key of a source file.
+    The parser chooses its language by file extension, so the key is made of
+    the extension and the SHA-1 of the UTF-8 encoded source (what the parser actually reads).
+    """
+    _, ext = os.path.splitext(filename)
+    sha = hashlib.sha1(src.encode('utf-8', 'replace')).hexdigest()
+    return sha + ext
+
+
+class ParseCache:
+    """
+    Maps source keys (see `source_key`) to JSON-serializable parse results, e.g. the result of
+    `call_graph.c.parse_functions`. Entries are stored in a SQLite database along with the
+    parser version; entries written by another parser version are never returned.
+    When the entries exceed `max_bytes`, the least recently used ones are evicted.
+    """
+
+    def __init__(self, path: str, parser_version: str, max_bytes: int = 1024 * 1024 * 1024):
+        self._path = path
+        self._parser_version = str(parser_version)
+        self._max_bytes = max_bytes
+        self._conn: sqlite3.Connection = None
+        self._clock = 0
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        return state
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def parser_version(self):
+        return self._parser_version
+
+    @property
+    def total_bytes(self):
+        self._connect()
+        return self._total_bytes
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, object]:
+        """
+        Look up the given keys, and mark the found entries as recently used.
+        Returns a dict containing only the found entries.
+        """
+        conn = self._connect()
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        # stay below SQLite's limit on the number of host parameters
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = conn.execute(
+                'SELECT key, value FROM parse_cache WHERE version = ? AND key IN ({})'.format(
+                    ','.join('?' * len(chunk))),
+                [self._parser_version] + chunk)
+            for key, value in rows:
+                found[key] = json.loads(value)
+        if found:
+            with conn:
+                conn.executemany('UPDATE parse_cache SET last_used = ? WHERE version = ? AND key = ?',
+                                 [(self._tick(), self._parser_version, key) for key in found])
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, key: str) -> Optional[object]:
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items: Iterable[Tuple[str, object]]):
+        conn = self._connect()
+        rows = []
+        for key, value in items:
+            value = json.dumps(value, separators=(',', ':'))
+            rows.append((self._parser_version, key, value, len(value), self._tick()))
+        if not rows:
+            return
+        with conn:
+            for row in rows:
+                old = conn.execute('SELECT size FROM parse_cache WHERE version = ? AND key = ?',
+                                   row[:2]).fetchone()
+                if old:
+                    self._total_bytes -= old[0]
+                conn.execute('INSERT OR REPLACE INTO parse_cache (version, key, value, size, last_used) '
+                             'VALUES (?, ?, ?, ?, ?)', row)
+                self._total_bytes += row[3]
+            self._evict(conn)
+
+    def put(self, key: str, value: object):
+        self.put_many([(key, value)])
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM parse_cache')
+        self._total_bytes = 0
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            dirname = os.path.dirname(os.path.abspath(self._path))
+            os.makedirs(dirname, exist_ok=True)
+            # other processes may share the cache file
+            self._conn = sqlite3.connect(self._path, timeout=60)
+            with self._conn:
+                self._conn.execute('CREATE TABLE IF NOT EXISTS parse_cache ('
+                                   'version TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+                                   'size INTEGER NOT NULL, last_used INTEGER NOT NULL, '
+                                   'PRIMARY KEY (version, key))')
+                self._conn.execute('CREATE INDEX IF NOT EXISTS parse_cache_last_used ON parse_cache (last_used)')
+            self._clock, self._total_bytes = self._conn.execute(
+                'SELECT COALESCE(MAX(last_used), 0), COALESCE(SUM(size), 0) FROM parse_cache').fetchone()
+        return self._conn
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def _evict(self, conn: sqlite3.Connection):
+        if self._total_bytes <= self._max_bytes:
+            return
+        evicted = 0
+        rows = conn.execute('SELECT version, key, size FROM parse_cache ORDER BY last_used')
+        victims: List[Tuple[str, str]] = []
+        for version, key, size in rows:
+            if self._total_bytes <= self._max_bytes:
+                break
+            victims.append((version, key))
+            self._total_bytes -= size
+            evicted += 1
+        conn.executemany('DELETE FROM parse_cache WHERE version = ? AND key = ?', victims)
+        _logger.debug("Evicted %d entries from parse cache %s.", evicted, self._path)
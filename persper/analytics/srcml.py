@@ -75,8 +75,13 @@ def src_to_tree(filename, src):
         return None
 
     xml_path = f.name + ".xml"
-    cmd = 'srcml {} --position --filename {} -o {}'.format(f.name, '\"/' + filename + '\"', xml_path)
-    subprocess.call(cmd, shell=True)
+    cmd = ['srcml', f.name, '--position', '--filename', '/' + filename, '-o', xml_path]
+    try:
+        subprocess.call(cmd)
+    except OSError as e:
+        print("ERROR: src_to_tree unable to run srcml:", e)
+        os.remove(f.name)
+        return None
     try:
         root = etree.parse(xml_path, parser=xml_parser).getroot()
     except:
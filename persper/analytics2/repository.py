@@ -1,11 +1,13 @@
 import logging
 import os.path
-from io import TextIOWrapper
+from io import BytesIO, TextIOWrapper
 from time import monotonic
-from typing import Union
+from typing import Dict, Optional, Union
 
 from git import Blob, Commit, Diff, DiffIndex, Repo
 
+from persper.analytics.git_tools import BlobReader
+
 from persper.analytics2.abstractions.repository import (FileDiffOperation,
                                                         ICommitInfo,
                                                         ICommitRepository,
@@ -27,6 +29,7 @@ class GitRepository(ICommitRepository):
         """
         self._repo = Repo(repo_path)
         self._first_parent_only = first_parent_only
+        self._blob_reader = BlobReader(self._repo)
 
     @staticmethod
     def _diff_with_commit(repo: Repo, current_commit: str, base_commit_sha: str):
@@ -48,12 +51,12 @@ class GitRepository(ICommitRepository):
         _logger.debug("enum_commits starts on %s, first_parent=%s",
                       commitSpec, self._first_parent_only)
         for commit in self._repo.iter_commits(commitSpec, topo_order=True, reverse=True, first_parent=self._first_parent_only):
-            yield GitCommitInfo(commit)
+            yield GitCommitInfo(commit, self._blob_reader)
         _logger.debug("enum_commits finishes on %s", commitSpec)
 
     def get_commit_info(self, commit_ref: str):
         commit = self._repo.rev_parse(commit_ref)
-        return GitCommitInfo(commit)
+        return GitCommitInfo(commit, self._blob_reader)
 
 
 class GitCommitInfo(ICommitInfo):
@@ -61,8 +64,14 @@ class GitCommitInfo(ICommitInfo):
     An immutable (git) commit information.
     """
 
-    def __init__(self, commit: Commit):
+    def __init__(self, commit: Commit, blob_reader: BlobReader = None):
+        """
+        params
+            blob_reader: Used to fetch the file contents of a diff in one round-trip.
+                            If `None`, file contents are read from the blobs one by one.
+        """
         self._commit = commit
+        self._blob_reader = blob_reader
         self._parents = None
 
     @property
@@ -100,7 +109,7 @@ class GitCommitInfo(ICommitInfo):
     @property
     def parents(self):
         if self._parents is None:
-            self._parents = [GitCommitInfo(c) for c in self._commit.parents]
+            self._parents = [GitCommitInfo(c, self._blob_reader) for c in self._commit.parents]
         return self._parents
 
     def get_file(self, file_path: str):
@@ -138,19 +147,34 @@ class GitCommitInfo(ICommitInfo):
             self._commit.repo, self._commit.hexsha, base_commit_hexsha)
         _logger.debug("diff_between %s and %s used %.2fs.",
                       base_commit_hexsha, self._commit.hexsha, monotonic() - t0)
+        file_diffs = []
         for diff in diff_index:
             hide_base_file = base_commit_filter and diff.a_blob and not base_commit_filter.filter_file(
                 diff.a_blob.name, diff.a_blob.path)
             hide_current_file = current_commit_filter and diff.b_blob and not current_commit_filter.filter_file(
                 diff.b_blob.name, diff.b_blob.path)
             if not hide_base_file or not hide_current_file:
-                yield GitFileDiff(self._commit.repo, diff, base_commit_ref, self._commit, hide_base_file, hide_current_file)
+                file_diffs.append((diff, hide_base_file, hide_current_file))
+        contents = None
+        if self._blob_reader:
+            # fetch all the visible blobs of this diff in one round-trip
+            t0 = monotonic()
+            contents = self._blob_reader.read_blobs(
+                [blob.hexsha for diff, hide_base_file, hide_current_file in file_diffs
+                 for blob, hidden in ((diff.a_blob, hide_base_file), (diff.b_blob, hide_current_file))
+                 if blob and not hidden])
+            _logger.debug("Reading %d blobs used %.2fs.", len(contents), monotonic() - t0)
+        for diff, hide_base_file, hide_current_file in file_diffs:
+            yield GitFileDiff(self._commit.repo, diff, base_commit_ref, self._commit, hide_base_file, hide_current_file,
+                              contents)
 
 
 class GitFileInfo(IFileInfo):
-    def __init__(self, blob: Blob = None, commit: Commit = None, path: str = None):
+    def __init__(self, blob: Blob = None, commit: Commit = None, path: str = None, content: bytes = None):
         """
         Initializes an instance either by an existing `Blob`, or the `Commit` and path reference.
+        params
+            content: The raw content of the blob, if it has already been fetched (e.g. by a `BlobReader`).
         """
         if (blob != None) == (commit != None or path != None):
             raise ValueError("Either blob or (commit, path) need to be set.")
@@ -161,6 +185,7 @@ class GitFileInfo(IFileInfo):
             self._commit = commit
             self._path = path
         self._is_missing = None
+        self._content = content
 
     def _ensure_blob(self):
         if not self._blob:
@@ -192,12 +217,18 @@ class GitFileInfo(IFileInfo):
 
     @property
     def raw_content(self) -> bytes:
+        if self._content is not None:
+            return self._content
         self._ensure_blob()
         if self.is_missing:
             return None
         return self._blob.data_stream.read()
 
     def get_content_text(self, encoding: str = 'utf-8') -> str:
+        if self._content is not None:
+            # the same newline translation as the blob stream below
+            with TextIOWrapper(BytesIO(self._content), encoding, "replace") as t:
+                return t.read()
         self._ensure_blob()
         if self.is_missing:
             return None
@@ -206,6 +237,8 @@ class GitFileInfo(IFileInfo):
 
     @property
     def raw_content_stream(self):
+        if self._content is not None:
+            return BytesIO(self._content)
         self._ensure_blob()
         if self.is_missing:
             return None
@@ -232,14 +265,17 @@ class GitFileDiff(IFileDiff):
 
     def __init__(self, repo: Repo, diff: Diff,
                  old_commit: Union[Commit, str], new_commit: Union[Commit, str],
-                 hide_old_file: bool = False, hide_new_file: bool = False):
+                 hide_old_file: bool = False, hide_new_file: bool = False,
+                 contents: Dict[str, Optional[bytes]] = None):
         """
         params
             hide_old_file: whether to treat the old file as if it does not exist in base commit.
             hide_new_file: whether to treat the new file as if it does not exist in current commit.
+            contents: prefetched raw blob contents, keyed by blob hexsha.
         """
         assert not hide_old_file or not hide_new_file
         self._diff = diff
+        self._contents = contents or {}
         self._old_file = GitFileDiff._LAZY_SENTINEL if not hide_old_file and diff.a_blob else None
         self._new_file = GitFileDiff._LAZY_SENTINEL if not hide_new_file and diff.b_blob else None
         if diff.renamed_file:
@@ -268,13 +304,13 @@ class GitFileDiff(IFileDiff):
     @property
     def old_file(self) -> IFileInfo:
         if self._old_file is GitFileDiff._LAZY_SENTINEL:
-            self._old_file = GitFileInfo(self._diff.a_blob)
+            self._old_file = GitFileInfo(self._diff.a_blob, content=self._contents.get(self._diff.a_blob.hexsha))
         return self._old_file
 
     @property
     def new_file(self) -> IFileInfo:
         if self._new_file is GitFileDiff._LAZY_SENTINEL:
-            self._new_file = GitFileInfo(self._diff.b_blob)
+            self._new_file = GitFileInfo(self._diff.b_blob, content=self._contents.get(self._diff.b_blob.hexsha))
         return self._new_file
 
     @property
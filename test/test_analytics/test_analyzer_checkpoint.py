@@ -0,0 +1,218 @@
+import os
+import pickle
+import subprocess
+import pytest
+from persper.analytics.analyzer2 import Analyzer
+from persper.analytics.call_commit_graph import CallCommitGraph
+from persper.analytics.checkpoint import AnalysisCheckpoint, CheckpointError
+from persper.analytics.compact_call_commit_graph import CompactCallCommitGraph
+from persper.analytics.graph_server import CommitSeekingMode, GraphServer
+from persper.util.path import root_path
+
+
+class FileGraphServer(GraphServer):
+    """
+    A GraphServer that treats each file as a function, which calls the files
+    changed before it in the same commit.
+    """
+
+    def __init__(self):
+        self._ccgraph = CallCommitGraph()
+        self._workspaceCommit = None
+        self._seekingMode = None
+        self._changedFiles = []
+
+    def start_commit(self, hexsha, seeking_mode, author_name, author_email, commit_message):
+        self._seekingMode = seeking_mode
+        self._changedFiles = []
+        if seeking_mode != CommitSeekingMode.Rewind:
+            self._ccgraph.add_commit(hexsha, author_name, author_email, commit_message)
+
+    def update_graph(self, old_filename, old_src, new_filename, new_src, patch):
+        if self._seekingMode == CommitSeekingMode.Rewind or new_filename is None:
+            return
+        if new_filename not in self._ccgraph.nodes():
+            self._ccgraph.add_node(new_filename, [new_filename])
+        for caller in self._changedFiles:
+            self._ccgraph.add_edge(caller, new_filename)
+        if self._seekingMode == CommitSeekingMode.NormalForward:
+            lines = patch.decode('utf-8', 'replace').split('\n') if patch else []
+            self._ccgraph.update_node_history(new_filename,
+                                              sum(1 for line in lines if line.startswith('+')),
+                                              sum(1 for line in lines if line.startswith('-')))
+        self._changedFiles.append(new_filename)
+
+    def end_commit(self, hexsha):
+        self._workspaceCommit = hexsha
+
+    def get_workspace_commit_hexsha(self):
+        return self._workspaceCommit
+
+    def get_graph(self):
+        return self._ccgraph
+
+    def reset_graph(self):
+        self._ccgraph.reset()
+
+    def filter_file(self, filename):
+        return True
+
+    def config(self, param):
+        pass
+
+
+@pytest.fixture(scope='module')
+def repo_path():
+    # build the repo first if not exists yet
+    repo_path = os.path.join(root_path, 'repos/test_feature_branch')
+    script_path = os.path.join(root_path, 'tools/repo_creater/create_repo.py')
+    test_src_path = os.path.join(root_path, 'test/test_feature_branch')
+    if not os.path.isdir(repo_path):
+        cmd = '{} {}'.format(script_path, test_src_path)
+        subprocess.call(cmd, shell=True)
+    return repo_path
+
+
+def assert_same_graph(actual, expected):
+    assert list(actual.nodes(data=True)) == list(expected.nodes(data=True))
+    assert sorted(actual.edges(data=True)) == sorted(expected.edges(data=True))
+    assert list(actual.commits().items()) == list(expected.commits().items())
+
+
+async def _analyze(repo_path, maxAnalyzedCommits=None, **kwargs):
+    az = Analyzer(repo_path, FileGraphServer(), **kwargs)
+    await az.analyze(maxAnalyzedCommits, suppressStdOutLogs=True)
+    return az
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('firstParentOnly', [False, True])
+async def test_checkpoint_resume(repo_path, tmp_path, firstParentOnly):
+    expected = await _analyze(repo_path, firstParentOnly=firstParentOnly)
+    assert len(expected.graph.edges()) > 0
+    checkpoint_dir = os.path.join(str(tmp_path), 'checkpoint')
+
+    partial = await _analyze(repo_path, 4, firstParentOnly=firstParentOnly,
+                             checkpoint_dir=checkpoint_dir, checkpoint_interval=3)
+    assert len(partial.visitedCommits) == 4
+    # the analyzer is still picklable
+    pickle.dumps(partial)
+
+    resumed = Analyzer(repo_path, FileGraphServer(), firstParentOnly=firstParentOnly,
+                       checkpoint_dir=checkpoint_dir)
+    await resumed.analyze(suppressStdOutLogs=True)
+    assert set(resumed.visitedCommits) == set(expected.visitedCommits)
+    assert_same_graph(resumed.graph, expected.graph)
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_discards_unsaved_records(repo_path, tmp_path):
+    expected = await _analyze(repo_path)
+    checkpoint_dir = os.path.join(str(tmp_path), 'checkpoint')
+    await _analyze(repo_path, 5, checkpoint_dir=checkpoint_dir)
+
+    # records appended after the last save, as if the analysis crashed
+    with open(os.path.join(checkpoint_dir, 'mutations.log'), 'ab') as f:
+        f.write(b'\x10\x00\x00\x00{"partial":')
+    resumed = await _analyze(repo_path, 2, checkpoint_dir=checkpoint_dir)
+    assert len(resumed.visitedCommits) == 7
+
+    resumed = await _analyze(repo_path, checkpoint_dir=checkpoint_dir)
+    assert set(resumed.visitedCommits) == set(expected.visitedCommits)
+    assert_same_graph(resumed.graph, expected.graph)
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_closes_log(repo_path, tmp_path):
+    expected = await _analyze(repo_path)
+    checkpoint_dir = os.path.join(str(tmp_path), 'checkpoint')
+    az = await _analyze(repo_path, 3, checkpoint_dir=checkpoint_dir)
+    assert az._checkpoint._log is None
+
+    # the same analyzer appends to the checkpoint again
+    await az.analyze(suppressStdOutLogs=True)
+    assert az._checkpoint._log is None
+    resumed = await _analyze(repo_path, checkpoint_dir=checkpoint_dir)
+    assert set(resumed.visitedCommits) == set(expected.visitedCommits)
+    assert_same_graph(resumed.graph, expected.graph)
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_requires_call_commit_graph(repo_path, tmp_path):
+    server = FileGraphServer()
+    server._ccgraph = CompactCallCommitGraph()
+    az = Analyzer(repo_path, server, checkpoint_dir=os.path.join(str(tmp_path), 'checkpoint'))
+    with pytest.raises(CheckpointError):
+        await az.analyze(suppressStdOutLogs=True)
+
+
+def _commit(graph, i):
+    graph.add_commit('c{0}'.format(i), 'koala', 'koala@persper.org', 'commit {0}'.format(i))
+    graph.add_node('f{0}'.format(i), ['f{0}.c'.format(i)])
+    graph.update_node_history('f{0}'.format(i), i + 1, 0)
+    if i:
+        graph.add_edge('f{0}'.format(i), 'f{0}'.format(i - 1))
+
+
+def _record_commits(checkpoint, graph, start, count):
+    for i in range(start, start + count):
+        _commit(graph, i)
+        checkpoint.record_commit('c{0}'.format(i), [0.5, 0.5] if i % 2 else None)
+
+
+def test_checkpoint_compaction(tmp_path):
+    path = os.path.join(str(tmp_path), 'checkpoint')
+    commits = ['c{0}'.format(i) for i in range(10)]
+    spec = {'terminal': 'c9', 'origin': None, 'firstParentOnly': False}
+    graph = CallCommitGraph()
+    checkpoint = AnalysisCheckpoint(path, interval=2, compact_interval=2)
+    checkpoint.create(graph)
+    checkpoint.set_commits(spec, commits, ())
+    checkpoint.attach(graph)
+    # compacted at the 2nd and 4th saves
+    _record_commits(checkpoint, graph, 0, 9)
+    checkpoint.close()
+    assert sorted(n for n in os.listdir(path) if n.startswith(('base', 'classifications'))) == \
+        ['base.2.snapshot', 'classifications.2.json']
+    # only the record after the last compaction is in the log
+    assert 0 < os.path.getsize(os.path.join(path, 'mutations.log')) < 1000
+
+    restored = CallCommitGraph()
+    checkpoint = AnalysisCheckpoint(path, interval=2, compact_interval=2)
+    visited, clf_results = checkpoint.restore(restored, lambda spec: commits)
+    # the 9th commit is not saved yet
+    assert visited == set(commits[:8])
+    assert clf_results == {sha: [0.5, 0.5] for sha in commits[1:8:2]}
+    expected = CallCommitGraph()
+    for i in range(8):
+        _commit(expected, i)
+    assert_same_graph(restored, expected)
+    checkpoint.close()
+
+
+def test_checkpoint_compaction_crash(tmp_path, monkeypatch):
+    path = os.path.join(str(tmp_path), 'checkpoint')
+    commits = ['c{0}'.format(i) for i in range(4)]
+    spec = {'terminal': 'c3', 'origin': None, 'firstParentOnly': False}
+    graph = CallCommitGraph()
+    checkpoint = AnalysisCheckpoint(path, interval=2, compact_interval=2)
+    checkpoint.create(graph)
+    checkpoint.set_commits(spec, commits, ())
+    checkpoint.attach(graph)
+    _record_commits(checkpoint, graph, 0, 2)
+
+    # crashed after the new base is written, before the checkpoint switches to it
+    def crash(*args):
+        raise OSError('crash')
+    monkeypatch.setattr(checkpoint, '_write_bitmap', crash)
+    with pytest.raises(OSError):
+        _record_commits(checkpoint, graph, 2, 2)
+    checkpoint.close()
+    assert os.path.exists(os.path.join(path, 'base.1.snapshot'))
+
+    restored = CallCommitGraph()
+    visited, clf_results = AnalysisCheckpoint(path).restore(restored, lambda spec: commits)
+    assert visited == set(commits[:2])
+    assert clf_results == {'c1': [0.5, 0.5]}
+    assert list(restored.commits()) == commits[:2]
+    assert sorted(restored.nodes()) == ['f0', 'f1']
@@ -0,0 +1,145 @@
+import os
+import subprocess
+import threading
+from types import SimpleNamespace
+import pytest
+from persper.analytics.analyzer2 import Analyzer, _CommitPrefetcher, _PreparedCommit
+from persper.analytics.graph_server import CommitSeekingMode, GraphServer
+from persper.util.path import root_path
+
+
+class RecordingGraphServer(GraphServer):
+    """
+    A GraphServer that records every notification it receives.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self._workspaceCommit = None
+
+    def start_commit(self, hexsha, seeking_mode, author_name, author_email, commit_message):
+        self.calls.append(('start_commit', hexsha, seeking_mode))
+
+    def update_graph(self, old_filename, old_src, new_filename, new_src, patch):
+        self.calls.append(('update_graph', old_filename, old_src, new_filename, new_src, patch))
+
+    def end_commit(self, hexsha):
+        self._workspaceCommit = hexsha
+        self.calls.append(('end_commit', hexsha))
+
+    def get_workspace_commit_hexsha(self):
+        return self._workspaceCommit
+
+    def get_graph(self):
+        return None
+
+    def reset_graph(self):
+        self.calls.clear()
+
+    def filter_file(self, filename):
+        return filename.endswith('.c')
+
+    def config(self, param):
+        pass
+
+
+@pytest.fixture(scope='module')
+def repo_path():
+    # build the repo first if not exists yet
+    repo_path = os.path.join(root_path, 'repos/test_feature_branch')
+    script_path = os.path.join(root_path, 'tools/repo_creater/create_repo.py')
+    test_src_path = os.path.join(root_path, 'test/test_feature_branch')
+    if not os.path.isdir(repo_path):
+        cmd = '{} {}'.format(script_path, test_src_path)
+        subprocess.call(cmd, shell=True)
+    return repo_path
+
+
+async def _analyze(repo_path, **kwargs):
+    graphServer = RecordingGraphServer()
+    maxAnalyzedCommits = kwargs.pop('maxAnalyzedCommits', None)
+    az = Analyzer(repo_path, graphServer, **kwargs)
+    analyzedCommits = await az.analyze(maxAnalyzedCommits, suppressStdOutLogs=True)
+    return graphServer.calls, analyzedCommits, set(az.visitedCommits)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('firstParentOnly', [False, True])
+@pytest.mark.parametrize('prefetch', [
+    dict(prefetch_depth=1),
+    dict(prefetch_depth=4),
+    # prepare one commit at a time once the memory limit is hit
+    dict(prefetch_depth=4, prefetch_memory_limit=1),
+])
+async def test_prefetch_matches_sequential(repo_path, firstParentOnly, prefetch):
+    expected = await _analyze(repo_path, firstParentOnly=firstParentOnly)
+    actual = await _analyze(repo_path, firstParentOnly=firstParentOnly, **prefetch)
+    assert actual == expected
+    assert len(expected[0]) > 0
+
+
+@pytest.mark.asyncio
+async def test_prefetch_max_analyzed_commits(repo_path):
+    expected = await _analyze(repo_path, maxAnalyzedCommits=5)
+    actual = await _analyze(repo_path, maxAnalyzedCommits=5, prefetch_depth=3)
+    assert actual == expected
+    assert actual[1] == 5
+
+
+@pytest.mark.asyncio
+async def test_sharded_analysis_not_supported(repo_path):
+    az = Analyzer(repo_path, RecordingGraphServer())
+    with pytest.raises(NotImplementedError):
+        await az.analyze_sharded(2)
+
+
+class ThreadCheckingGraphServer(RecordingGraphServer):
+
+    def __init__(self):
+        super().__init__()
+        self.threads = set()
+
+    def filter_file(self, filename):
+        self.threads.add(threading.current_thread())
+        return super().filter_file(filename)
+
+
+@pytest.mark.asyncio
+async def test_prefetch_filters_files_on_loop_thread(repo_path):
+    graphServer = ThreadCheckingGraphServer()
+    az = Analyzer(repo_path, graphServer, prefetch_depth=4)
+    await az.analyze(suppressStdOutLogs=True)
+    assert graphServer.threads == {threading.current_thread()}
+
+
+@pytest.mark.asyncio
+async def test_prefetch_reserves_memory():
+    steps = [SimpleNamespace(seekingMode=CommitSeekingMode.NormalForward) for _ in range(10)]
+    prefetcher = _CommitPrefetcher(None, steps, depth=3, memoryLimit=250)
+    reservations = []
+
+    def prepareOnWorker(step):
+        prepared = _PreparedCommit(None, None, step.seekingMode)
+        prepared.size = 100
+        return prepared
+
+    prepare = prefetcher._prepare
+
+    def recordingPrepare(step, reserved):
+        reservations.append(reserved)
+        return prepare(step, reserved)
+
+    prefetcher._prepareOnWorker = prepareOnWorker
+    prefetcher._prepare = recordingPrepare
+    async with prefetcher:
+        consumed = 0
+        async for step, prepared in prefetcher:
+            consumed += 1
+            # the commits prepared ahead count in, including the ones still being prepared
+            assert prefetcher._memoryUsage <= 250 + 100
+    assert consumed == 10
+    # the mean size of the commits prepared so far is reserved
+    assert set(reservations) <= {0, 100}
+    assert reservations[-1] == 100
+    # the reservations are settled
+    assert prefetcher._memoryUsage == 0
@@ -5,6 +5,8 @@ import subprocess
 from math import isclose
 from git import Repo
 from persper.analytics.call_commit_graph import CallCommitGraph
+from persper.analytics.compact_call_commit_graph import CompactCallCommitGraph
+from persper.analytics.devrank import devrank_from_csr
 from persper.analytics.cpp import CPPGraphServer
 from persper.analytics.analyzer import Analyzer
 from persper.analytics.graph_server import CPP_FILENAME_REGEXES
@@ -158,3 +160,121 @@ def test_remove_invalid_nodes():
 
     func_drs = ccgraph.function_devranks(0.85)
     assert isclose(func_drs['f1'], 1, rel_tol=1e-2)
+
+
+@pytest.mark.parametrize('graph_class', [CallCommitGraph, CompactCallCommitGraph])
+def test_incremental_devrank(graph_class):
+    ccgraph = graph_class()
+    ccgraph.add_commit('0x01', 'koala', 'koala@persper.org', 'first commit')
+    ccgraph.add_node('f1')
+    ccgraph.update_node_history('f1', 10, 0)
+    ccgraph.add_node('f2')
+    ccgraph.update_node_history('f2', 10, 0)
+    ccgraph.add_edge('f1', 'f2')
+    assert ccgraph.devrank_stats is None
+
+    func_drs = ccgraph.function_devranks(0.85, incremental=True)
+    assert isclose(func_drs['f1'], 0.35, rel_tol=1e-2)
+    assert isclose(func_drs['f2'], 0.65, rel_tol=1e-2)
+    assert not ccgraph.devrank_stats.warm_start
+
+    # nothing changed: starts from the solution
+    ccgraph.function_devranks(0.85, incremental=True)
+    assert ccgraph.devrank_stats.warm_start
+    assert ccgraph.devrank_stats.iterations == 1
+    assert ccgraph.devrank_stats.residual < 1e-5
+
+    ccgraph.add_commit('0x02', 'beaver', 'beaver@perpser.org', 'second commit')
+    ccgraph.add_node('f3')
+    ccgraph.update_node_history('f3', 10, 0)
+    ccgraph.add_edge('f1', 'f3')
+    ccgraph.add_commit('0x03', 'koala', 'koala@persper.org', 'third commit')
+    ccgraph.add_node('f4')
+    ccgraph.update_node_history('f4', 10, 0)
+    ccgraph.add_edge('f2', 'f4')
+    ccgraph.add_node('f5')
+    ccgraph.update_node_history('f5', 10, 0)
+    ccgraph.add_edge('f2', 'f5')
+
+    func_drs = ccgraph.function_devranks(0.85, incremental=True)
+    commit_drs = ccgraph.commit_devranks(0.85, incremental=True)
+    assert isclose(func_drs['f1'], 0.141, rel_tol=1e-2)
+    assert isclose(func_drs['f2'], 0.201, rel_tol=1e-2)
+    assert isclose(func_drs['f3'], 0.201, rel_tol=1e-2)
+    assert isclose(func_drs['f4'], 0.227, rel_tol=1e-2)
+    assert isclose(func_drs['f5'], 0.227, rel_tol=1e-2)
+    assert isclose(commit_drs['0x03'], 0.454, rel_tol=1e-2)
+
+    # size changes only
+    ccgraph.update_node_history('f1', 30, 0)
+    func_drs = ccgraph.function_devranks(0.85, incremental=True)
+    assert ccgraph.nodes(data=True)['f1']['size'] == 40
+    csr = ccgraph.to_csr()
+    expected = devrank_from_csr(csr, alpha=0.85)
+    for node, dr in zip(csr.nodes, expected):
+        assert isclose(func_drs[node], dr, rel_tol=1e-3)
+
+    commit_drs = ccgraph.commit_devranks(0.85, black_set={'0x02'}, incremental=True)
+    assert '0x02' not in commit_drs
+
+
+@pytest.mark.parametrize('graph_class', [CallCommitGraph, CompactCallCommitGraph])
+def test_devranks(graph_class):
+    ccgraph = graph_class()
+    ccgraph.add_commit('0x01', 'koala', 'koala@persper.org', 'first commit')
+    ccgraph.add_node('f1')
+    ccgraph.update_node_history('f1', 10, 0)
+    ccgraph.add_node('f2')
+    ccgraph.update_node_history_accurate('f2', {'adds': 10, 'dels': 0, 'added_units': 40, 'removed_units': 0})
+    ccgraph.add_edge('f1', 'f2')
+    ccgraph.add_commit('0x02', 'beaver', 'beaver@persper.org', 'second commit')
+    ccgraph.add_node('f3')
+    ccgraph.update_node_history('f3', 20, 10)
+    ccgraph.update_node_history('f1', 0, 5)
+    ccgraph.add_edge('f2', 'f3')
+    ccgraph.add_commit('0x03', 'koala', 'koala@persper.org', 'third commit')
+    ccgraph.update_node_history('f3', 5, 5)
+
+    for black_set in (None, {'0x02'}):
+        drs = ccgraph.devranks(0.85, black_set=black_set)
+        assert drs.function == ccgraph.function_devranks(0.85, black_set=black_set)
+        assert drs.commit == ccgraph.commit_devranks(0.85, black_set=black_set)
+        assert drs.developer == ccgraph.developer_devranks(0.85, black_set=black_set)
+        assert isclose(sum(drs.commit.values()), 1)
+        assert isclose(sum(drs.developer.values()), 1)
+        assert isclose(drs.developer['koala@persper.org'], drs.commit['0x01'] + drs.commit['0x03'])
+    assert '0x02' not in drs.commit
+    assert 'beaver@persper.org' not in drs.developer
+
+    # each edit gets its share of the function's DevRank
+    drs = ccgraph.devranks(0.85)
+    f3_share = drs.function['f3'] / 40
+    assert isclose(drs.commit['0x03'], 10 * f3_share)
+    assert isclose(drs.commit['0x02'], 30 * f3_share + drs.function['f1'] * 5 / 15)
+
+
+@pytest.mark.parametrize('graph_class', [CallCommitGraph, CompactCallCommitGraph])
+def test_batch_devranks(graph_class):
+    ccgraph = graph_class()
+    ccgraph.add_commit('0x01', 'koala', 'koala@persper.org', 'first commit')
+    for node in ('f1', 'f2', 'f3'):
+        ccgraph.add_node(node)
+        ccgraph.update_node_history(node, 10, 0)
+    ccgraph.add_edge('f1', 'f2')
+    ccgraph.add_edge('f1', 'f3')
+    ccgraph.add_commit('0x02', 'beaver', 'beaver@persper.org', 'second commit')
+    ccgraph.update_node_history('f2', 20, 5)
+    ccgraph.add_node('f4')
+    ccgraph.update_node_history('f4', 3, 0)
+    ccgraph.add_edge('f3', 'f4')
+
+    scenarios = [(0.85, None), (0.5, None), (0.85, {'0x02'}), (0.95, {'0x01'})]
+    results = ccgraph.batch_devranks(scenarios)
+    assert len(results) == len(scenarios)
+    for (alpha, black_set), drs in zip(scenarios, results):
+        expected = ccgraph.devranks(alpha, black_set=black_set)
+        for actual_drs, expected_drs in zip(drs, expected):
+            assert actual_drs.keys() == expected_drs.keys()
+            for key in expected_drs:
+                assert isclose(actual_drs[key], expected_drs[key], rel_tol=1e-9)
+    assert ccgraph.batch_devranks([]) == []
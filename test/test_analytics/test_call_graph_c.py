@@ -0,0 +1,109 @@
+import os
+import subprocess
+import pytest
+from git import Repo
+from lxml import etree
+from persper.analytics.analyzer2 import Analyzer
+from persper.analytics.c import CGraphServer
+from persper.analytics.call_commit_graph import CallCommitGraph
+from persper.analytics.call_graph.c import get_func_ranges_c, get_func_ranges_from_functions, \
+    parse_functions, update_graph, update_graph_with_functions
+from persper.analytics.graph_server import C_FILENAME_REGEXES
+from persper.util.path import root_path
+
+# srcml --position output of
+#
+# int foo() { return bar(1); }
+# int main() {
+#     foo();
+#     return foo() + baz(2);
+# }
+SRCML = b"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<unit xmlns="http://www.srcML.org/srcML/src" xmlns:pos="http://www.srcML.org/srcML/position" \
+revision="0.9.5" language="C" filename="/main.c" pos:tabs="8">\
+<function><type><name pos:line="1" pos:column="1">int</name></type> \
+<name pos:line="1" pos:column="5">foo</name><parameter_list pos:line="1" pos:column="8">()</parameter_list> \
+<block pos:line="1" pos:column="11">{ <return pos:line="1" pos:column="13">return <expr>\
+<call><name pos:line="1" pos:column="20">bar</name><argument_list pos:line="1" pos:column="23">(\
+<argument><expr><literal type="number" pos:line="1" pos:column="24">1</literal></expr></argument>)\
+</argument_list></call></expr>;</return> }<pos:position pos:line="1" pos:column="29"/></block></function>
+<function><type><name pos:line="2" pos:column="1">int</name></type> \
+<name pos:line="2" pos:column="5">main</name><parameter_list pos:line="2" pos:column="9">()</parameter_list> \
+<block pos:line="2" pos:column="12">{
+    <expr_stmt><expr><call><name pos:line="3" pos:column="5">foo</name>\
+<argument_list pos:line="3" pos:column="8">()</argument_list></call></expr>;</expr_stmt>
+    <return pos:line="4" pos:column="5">return <expr><call><name pos:line="4" pos:column="12">foo</name>\
+<argument_list pos:line="4" pos:column="15">()</argument_list></call> <operator pos:line="4" pos:column="18">+</operator> \
+<call><name pos:line="4" pos:column="20">baz</name><argument_list pos:line="4" pos:column="23">(\
+<argument><expr><literal type="number" pos:line="4" pos:column="24">2</literal></expr></argument>)\
+</argument_list></call></expr>;</return>
+}<pos:position pos:line="5" pos:column="2"/></block></function>
+</unit>
+"""
+
+
+def test_parse_functions():
+    root = etree.fromstring(SRCML)
+    functions = parse_functions(root)
+    assert functions == [('foo', 1, 1, ['bar']), ('main', 2, 5, ['foo', 'baz'])]
+    assert get_func_ranges_from_functions(functions) == get_func_ranges_c(root)
+
+
+def test_update_graph_with_functions():
+    root = etree.fromstring(SRCML)
+    change_stats = {'main': {'adds': 4, 'dels': 0, 'added_units': 10, 'removed_units': 0}}
+
+    expected = CallCommitGraph()
+    expected.add_commit('0' * 40, 'author', 'author@example.com', 'message')
+    update_graph(expected, [root], change_stats, {})
+
+    actual = CallCommitGraph()
+    actual.add_commit('0' * 40, 'author', 'author@example.com', 'message')
+    update_graph_with_functions(actual, [(root.attrib['filename'], parse_functions(root))], change_stats, {})
+
+    assert list(actual.nodes(data=True)) == list(expected.nodes(data=True))
+    assert list(actual.edges(data=True)) == list(expected.edges(data=True))
+    assert set(actual.edges()) == {('foo', 'bar'), ('main', 'foo'), ('main', 'baz')}
+
+
+@pytest.mark.asyncio
+async def test_parallel_parsing_matches_serial():
+    # build the repo first if not exists yet
+    repo_path = os.path.join(root_path, 'repos/test_feature_branch')
+    script_path = os.path.join(root_path, 'tools/repo_creater/create_repo.py')
+    test_src_path = os.path.join(root_path, 'test/test_feature_branch')
+    if not os.path.isdir(repo_path):
+        cmd = '{} {}'.format(script_path, test_src_path)
+        subprocess.call(cmd, shell=True)
+
+    graphs = []
+    for parse_workers in (0, 2):
+        az = Analyzer(repo_path, CGraphServer(C_FILENAME_REGEXES, parse_workers=parse_workers))
+        await az.analyze()
+        graphs.append(az.graph)
+    serial, parallel = graphs
+    assert len(serial.nodes()) > 0
+    assert list(parallel.nodes(data=True)) == list(serial.nodes(data=True))
+    assert list(parallel.edges(data=True)) == list(serial.edges(data=True))
+
+
+@pytest.mark.asyncio
+async def test_sharded_analysis_matches_sequential():
+    # build the repo first if not exists yet
+    repo_path = os.path.join(root_path, 'repos/test_feature_branch')
+    script_path = os.path.join(root_path, 'tools/repo_creater/create_repo.py')
+    test_src_path = os.path.join(root_path, 'test/test_feature_branch')
+    if not os.path.isdir(repo_path):
+        cmd = '{} {}'.format(script_path, test_src_path)
+        subprocess.call(cmd, shell=True)
+
+    sequential = Analyzer(repo_path, CGraphServer(C_FILENAME_REGEXES, parse_workers=0))
+    await sequential.analyze()
+    for shards in (2, 3):
+        sharded = Analyzer(repo_path, CGraphServer(C_FILENAME_REGEXES, parse_workers=0))
+        await sharded.analyze_sharded(shards)
+        assert len(sharded.graph.nodes()) > 0
+        assert list(sharded.graph.nodes(data=True)) == list(sequential.graph.nodes(data=True))
+        assert list(sharded.graph.edges(data=True)) == list(sequential.graph.edges(data=True))
+        assert list(sharded.graph.commits().items()) == list(sequential.graph.commits().items())
+        assert sharded.visitedCommits == sequential.visitedCommits
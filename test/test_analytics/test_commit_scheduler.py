@@ -0,0 +1,85 @@
+import pytest
+from git import Git, Repo
+from persper.analytics.analyzer2 import Analyzer
+from persper.analytics.commit_scheduler import GitOrderScheduler, MinRewindScheduler
+from persper.analytics.git_tools import EMPTY_TREE_SHA
+from persper.analytics.history_index import HistoryIndex, lazy_commit
+from .test_analyzer_checkpoint import FileGraphServer, repo_path
+
+
+def assert_topological(order, commits):
+    assert sorted(c.hexsha for c in order) == sorted(c.hexsha for c in commits)
+    positions = {c.hexsha: i for i, c in enumerate(order)}
+    for commit in order:
+        for parent in commit.parents:
+            if parent.hexsha in positions:
+                assert positions[parent.hexsha] < positions[commit.hexsha]
+
+
+@pytest.mark.parametrize('first_parent_only', [False, True])
+def test_min_rewind_schedule(repo_path, first_parent_only):
+    commits = list(Repo(repo_path).iter_commits(topo_order=True, reverse=True, first_parent=first_parent_only))
+    scheduler = MinRewindScheduler()
+    order = scheduler.schedule(commits, None, first_parent_only)
+    assert_topological(order, commits)
+    stats = scheduler.stats
+    assert (stats.rewinds, stats.rewind_files) == scheduler.rewinds(order, None, first_parent_only)
+    assert (stats.git_rewinds, stats.git_rewind_files) == scheduler.rewinds(commits, None, first_parent_only)
+    assert stats.saved_rewinds >= 0
+    if first_parent_only:
+        assert order == commits
+        assert stats.rewinds == 0
+    assert GitOrderScheduler().schedule(commits, None, first_parent_only) == commits
+
+
+@pytest.mark.parametrize('first_parent_only', [False, True])
+def test_min_rewind_schedule_with_history_index(repo_path, first_parent_only, monkeypatch):
+    repo = Repo(repo_path)
+    commits = list(repo.iter_commits(topo_order=True, reverse=True, first_parent=first_parent_only))
+    expected = MinRewindScheduler().schedule(commits, None, first_parent_only)
+
+    index = HistoryIndex.build(repo_path)
+    scheduler = MinRewindScheduler(history_index=index)
+
+    def diff_tree(self, *args):
+        raise AssertionError('git diff-tree is run for indexed commits.')
+
+    # git diff-tree is not run
+    monkeypatch.setattr(Git, 'diff_tree', diff_tree, raising=False)
+    order = scheduler.schedule([lazy_commit(repo, c.hexsha) for c in commits], None, first_parent_only)
+    assert_topological([repo.commit(c.hexsha) for c in order], commits)
+    if first_parent_only:
+        assert [c.hexsha for c in order] == [c.hexsha for c in expected]
+        assert scheduler.stats.rewinds == 0
+
+
+def test_indexed_diff_size(repo_path):
+    repo = Repo(repo_path)
+    index = HistoryIndex.build(repo_path)
+    scheduler = MinRewindScheduler(history_index=index)
+    hexshas = index.hexshas() + [EMPTY_TREE_SHA]
+    for a in hexshas:
+        for b in hexshas:
+            names = repo.git.diff_tree('-r', '--name-only', '--no-renames', a, b)
+            expected = len(names.splitlines()) if names else 0
+            size = scheduler._indexed_diff_size(a, b)
+            # an upper bound of git's count
+            assert size >= expected
+            if a == b:
+                assert size == 0
+    assert scheduler._indexed_diff_size(hexshas[0], '0' * 40) is None
+
+
+@pytest.mark.asyncio
+async def test_analyze_with_scheduler(repo_path):
+    expected = Analyzer(repo_path, FileGraphServer())
+    await expected.analyze(suppressStdOutLogs=True)
+
+    scheduler = MinRewindScheduler()
+    az = Analyzer(repo_path, FileGraphServer(), commit_scheduler=scheduler)
+    await az.analyze(3, suppressStdOutLogs=True)
+    await az.analyze(suppressStdOutLogs=True)
+    assert az.visitedCommits == expected.visitedCommits
+    # node histories do not depend on the order of the commits
+    for node, data in expected.graph.nodes(data=True):
+        assert dict(az.graph.nodes(data=True)[node]['history']) == dict(data['history'])
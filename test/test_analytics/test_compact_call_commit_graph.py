@@ -0,0 +1,177 @@
+import pickle
+from math import isclose
+from persper.analytics.call_commit_graph import CallCommitGraph
+from persper.analytics.compact_call_commit_graph import CompactCallCommitGraph
+
+
+def _build(ccgraph):
+    ccgraph.add_commit('0x01', 'koala', 'koala@persper.org', 'first commit')
+    ccgraph.add_node('f1', ['a.c'])
+    ccgraph.update_node_history('f1', 10, 0)
+    ccgraph.add_node('f2', ['a.c'])
+    ccgraph.update_node_history('f2', 10, 0)
+    ccgraph.add_edge('f1', 'f2')
+
+    ccgraph.add_commit('0x02', 'beaver', 'beaver@perpser.org', 'second commit')
+    ccgraph.add_node('f3', ['b.c'])
+    ccgraph.update_node_history('f3', 10, 0)
+    ccgraph.add_edge('f1', 'f3')
+
+    ccgraph.add_commit('0x03', 'koala', 'koala@persper.org', 'third commit')
+    ccgraph.add_node('f4', ['b.c'])
+    ccgraph.update_node_history('f4', 4, 0)
+    # a commit might update a node more than once
+    ccgraph.update_node_history('f4', 6, 0)
+    ccgraph.add_edge('f2', 'f4')
+    ccgraph.add_node('f5')
+    ccgraph.update_node_history('f5', 10, 0)
+    ccgraph.add_edge('f2', 'f5')
+    ccgraph.update_node_files('f5', ['b.c', 'c.c'])
+    return ccgraph
+
+
+def test_compact_call_commit_graph_matches_call_commit_graph():
+    expected = _build(CallCommitGraph())
+    actual = _build(CompactCallCommitGraph())
+    assert list(actual.nodes(data=True)) == list(expected.nodes(data=True))
+    assert list(actual.edges(data=True)) == list(expected.edges(data=True))
+    assert actual.commits() == expected.commits()
+    assert actual.files('f5') == {'b.c', 'c.c'}
+    assert 'f1' in actual and 'f6' not in actual
+    assert 'f1' in actual.nodes() and len(actual.nodes()) == 5
+    assert ('f1', 'f2') in actual.edges() and len(actual.edges()) == 4
+    assert actual.nodes(data=True)['f4']['history'] == {'0x03': {'adds': 10, 'dels': 0}}
+    assert actual.eval_project_complexity(2, 3) == expected.eval_project_complexity(2, 3)
+
+    # re-adding a node resets its attributes
+    expected.add_node('f4')
+    actual.add_node('f4')
+    assert list(actual.nodes(data=True)) == list(expected.nodes(data=True))
+
+    restored = pickle.loads(pickle.dumps(actual))
+    assert list(restored.nodes(data=True)) == list(actual.nodes(data=True))
+    assert list(restored.edges(data=True)) == list(actual.edges(data=True))
+
+
+def test_compact_devranks():
+    ccgraph = _build(CompactCallCommitGraph())
+    func_drs = ccgraph.function_devranks(0.85)
+    commit_drs = ccgraph.commit_devranks(0.85)
+    dev_drs = ccgraph.developer_devranks(0.85)
+    assert isclose(func_drs['f1'], 0.141, rel_tol=1e-2)
+    assert isclose(func_drs['f2'], 0.201, rel_tol=1e-2)
+    assert isclose(func_drs['f3'], 0.201, rel_tol=1e-2)
+    assert isclose(func_drs['f4'], 0.227, rel_tol=1e-2)
+    assert isclose(func_drs['f5'], 0.227, rel_tol=1e-2)
+    assert isclose(commit_drs['0x01'], 0.343, rel_tol=1e-2)
+    assert isclose(commit_drs['0x02'], 0.201, rel_tol=1e-2)
+    assert isclose(commit_drs['0x03'], 0.454, rel_tol=1e-2)
+    assert isclose(dev_drs['koala@persper.org'], 0.798, rel_tol=1e-2)
+    assert isclose(dev_drs['beaver@perpser.org'], 0.201, rel_tol=1e-2)
+
+    commit_drs = ccgraph.commit_devranks(0.85, black_set={'0x02'})
+    assert set(commit_drs) == {'0x01', '0x03'}
+
+
+def test_compact_devrank_with_accurate_history():
+    ccgraph = CompactCallCommitGraph()
+    ccgraph.add_commit('0x01', 'koala', 'koala@persper.org', 'first commit')
+    ccgraph.add_node('f1')
+    ccgraph.update_node_history_accurate('f1', {'adds': 10, 'dels': 0, 'added_units': 20, 'removed_units': 0})
+    ccgraph.add_node('f2')
+    ccgraph.update_node_history_accurate('f2', {'adds': 10, 'dels': 0, 'added_units': 40, 'removed_units': 0})
+    ccgraph.add_edge('f1', 'f2')
+
+    func_drs = ccgraph.function_devranks(0.85)
+    assert isclose(func_drs['f1'], 0.26, rel_tol=1e-2)
+    assert isclose(func_drs['f2'], 0.74, rel_tol=1e-2)
+    assert isclose(ccgraph.commit_devranks(0.85)['0x01'], 1)
+    assert isclose(ccgraph.developer_devranks(0.85)['koala@persper.org'], 1)
+
+
+def test_compact_to_csr():
+    expected = _build(CallCommitGraph())
+    actual = _build(CompactCallCommitGraph())
+    expected.function_devranks(0.85)
+    actual.function_devranks(0.85)
+    expected_csr, actual_csr = expected.to_csr(), actual.to_csr()
+    assert actual_csr.nodes == expected_csr.nodes
+    assert actual_csr.indptr.tolist() == expected_csr.indptr.tolist()
+    assert actual_csr.indices.tolist() == expected_csr.indices.tolist()
+    assert actual_csr.sizes.tolist() == expected_csr.sizes.tolist() == [10, 10, 10, 10, 10]
+    assert actual.to_csr(with_sizes=False).sizes is None
+
+
+def test_compact_history_revisited_commits_and_readded_nodes():
+    def build(ccgraph, pickled=False):
+        _build(ccgraph)
+        if pickled:
+            ccgraph = pickle.loads(pickle.dumps(ccgraph))
+        # the history of a re-added node starts over
+        ccgraph.add_node('f2', ['a.c'])
+        ccgraph.update_node_history('f2', 3, 1)
+        # a commit visited again, e.g. after rewinding
+        ccgraph.add_commit('0x01', 'koala', 'koala@persper.org', 'first commit')
+        ccgraph.update_node_history('f1', 1, 2)
+        ccgraph.update_node_history('f2', 5, 0)
+        return ccgraph
+
+    expected = build(CallCommitGraph())
+    for pickled in (False, True):
+        actual = build(CompactCallCommitGraph(), pickled)
+        assert list(actual.nodes(data=True)) == list(expected.nodes(data=True))
+
+
+def _assert_devranks_close(actual, expected):
+    assert actual.keys() == expected.keys()
+    for node in expected:
+        assert isclose(actual[node], expected[node], rel_tol=1e-3)
+
+
+def test_compact_incremental_devranks_dirty_sizes():
+    ccgraph = _build(CompactCallCommitGraph())
+    computed = []
+    compute_nodes_size = ccgraph._compute_nodes_size
+
+    def recording_compute_nodes_size(indices, black_set=None):
+        computed.append(list(indices))
+        return compute_nodes_size(indices, black_set)
+
+    ccgraph._compute_nodes_size = recording_compute_nodes_size
+    ccgraph.function_devranks(0.85, incremental=True)
+    assert computed == []
+
+    ccgraph.add_commit('0x04', 'koala', 'koala@persper.org', 'fourth commit')
+    ccgraph.update_node_history('f2', 30, 0)
+    ccgraph.add_node('f6')
+    ccgraph.update_node_history_accurate('f6', {'adds': 1, 'dels': 0, 'added_units': 7, 'removed_units': 0})
+    ccgraph.add_edge('f5', 'f6')
+    # re-adding a node drops its history
+    ccgraph.add_node('f3')
+    incremental = ccgraph.function_devranks(0.85, incremental=True)
+    # only the edited and the new nodes
+    assert computed == [[1, 2, 5]]
+    sizes = {node: data['size'] for node, data in ccgraph.nodes(data=True)}
+    assert sizes == {'f1': 10, 'f2': 40, 'f3': 1, 'f4': 10, 'f5': 10, 'f6': 7}
+    _assert_devranks_close(incremental, ccgraph.function_devranks(0.85))
+
+    # a new black set recomputes every size
+    computed.clear()
+    incremental = ccgraph.function_devranks(0.85, black_set={'0x04'}, incremental=True)
+    assert computed == []
+    assert ccgraph.nodes(data=True)['f2']['size'] == 10
+    ccgraph.update_node_history('f1', 5, 0)
+    incremental = ccgraph.function_devranks(0.85, black_set={'0x04'}, incremental=True)
+    assert computed == [[0]]
+    # the 0x04 edit of f1 is blacklisted
+    assert ccgraph.nodes(data=True)['f1']['size'] == 10
+    expected = ccgraph.function_devranks(0.85, black_set={'0x04'})
+    _assert_devranks_close(incremental, expected)
+
+    # a non-incremental call may change the sizes
+    computed.clear()
+    ccgraph.function_devranks(0.85)
+    incremental = ccgraph.function_devranks(0.85, black_set={'0x04'}, incremental=True)
+    assert computed == []
+    _assert_devranks_close(incremental, expected)
+    assert ccgraph.nodes(data=True)['f2']['size'] == 10
@@ -1,5 +1,8 @@
 import networkx as nx
-from persper.analytics.devrank import devrank
+import numpy as np
+from persper.analytics.csr import digraph_to_csr
+from persper.analytics.devrank import devrank, devrank_batch_from_csr, devrank_from_csr
+from persper.analytics.pagerank import pagerank
 
 
 def test_devrank():
@@ -13,13 +16,58 @@ def test_devrank():
     G2 = nx.DiGraph()
     G2.add_edges_from([(1, 2), (2, 3), (3, 4), (4, 1)])
     for u in G2:
-        G2.node[u]['weight'] = 10
+        G2.nodes[u]['weight'] = 10
     assert devrank(G2, 'weight') == {1: 0.25, 2: 0.25, 3: 0.25, 4: 0.25}
 
     G3 = nx.DiGraph()
     G3.add_edge(1, 2)
     for u in G3:
-        G3.node[u]['weight'] = 10
+        G3.nodes[u]['weight'] = 10
     dr = devrank(G3, 'weight', alpha=1.0)
     assert abs(dr[1] - 0.3333) < 0.0001
     assert abs(dr[2] - 0.6666) < 0.0001
+
+
+def test_digraph_to_csr():
+    G = nx.DiGraph()
+    G.add_node('a', size=1)
+    G.add_node('b', size=2)
+    G.add_node('c', size=3)
+    G.add_edge('a', 'c')
+    G.add_edge('a', 'b')
+    G.add_edge('c', 'a')
+    csr = digraph_to_csr(G, 'size')
+    assert csr.nodes == ['a', 'b', 'c']
+    assert csr.indptr.tolist() == [0, 2, 2, 3]
+    assert csr.indices.tolist() == [2, 1, 0]
+    assert csr.sources.tolist() == [0, 0, 2]
+    assert csr.sizes.tolist() == [1, 2, 3]
+    assert digraph_to_csr(G).sizes is None
+
+    dr = devrank(G, 'size')
+    assert dr == dict(zip(csr.nodes, devrank_from_csr(csr).tolist()))
+
+
+def test_devrank_batch_from_csr():
+    G = nx.gnp_random_graph(40, 0.1, seed=1, directed=True)
+    rng = np.random.RandomState(1)
+    csr = digraph_to_csr(G)
+    alphas = [0.5, 0.85, 0.95]
+    sizes = rng.randint(1, 50, size=(40, 3))
+    ranks = devrank_batch_from_csr(csr, sizes, alphas)
+    assert ranks.shape == (40, 3)
+    for j, alpha in enumerate(alphas):
+        expected = devrank_from_csr(csr._replace(sizes=sizes[:, j].astype(np.float64)), alpha=alpha)
+        assert np.allclose(ranks[:, j], expected, rtol=0, atol=1e-12)
+
+
+def test_pagerank():
+    G = nx.DiGraph()
+    G.add_edges_from([(1, 2), (2, 3), (3, 4), (4, 1)])
+    assert pagerank(G) == {1: 0.25, 2: 0.25, 3: 0.25, 4: 0.25}
+
+    G2 = nx.DiGraph()
+    G2.add_edge(1, 2)
+    pr = pagerank(G2, alpha=1.0)
+    assert abs(pr[1] - 0.3333) < 0.0001
+    assert abs(pr[2] - 0.6666) < 0.0001
@@ -33,8 +33,9 @@ def test_analyzer_filter_monolithic_commit(az):
     case_1_files = {
         'main.c': {'lines': threshold + 1},
     }
-    case_1_commit = MockCommit(case_1_files, 0)
-    case_1_seeking_mode = az._filter_monolithic_commit(case_1_commit, CommitSeekingMode.NormalForward)
+    case_1_commit = MockCommit(0)
+    case_1_seeking_mode = az._filter_monolithic_commit(case_1_commit, CommitSeekingMode.NormalForward,
+                                                       mock_diff_index(case_1_files))
     assert case_1_seeking_mode == CommitSeekingMode.MergeCommit
 
     # case 2: changes equal to threshold, the commit has one parent commit
@@ -42,8 +43,9 @@ def test_analyzer_filter_monolithic_commit(az):
     case_2_files = {
         'a.c': {'lines': threshold},
     }
-    case_2_commit = MockCommit(case_2_files, 1)
-    case_2_seeking_mode = az._filter_monolithic_commit(case_2_commit, CommitSeekingMode.NormalForward)
+    case_2_commit = MockCommit(1)
+    case_2_seeking_mode = az._filter_monolithic_commit(case_2_commit, CommitSeekingMode.NormalForward,
+                                                       mock_diff_index(case_2_files))
     assert case_2_seeking_mode == CommitSeekingMode.NormalForward
 
     # case 3: changes above threshold, the commit has one parent commit
@@ -52,8 +54,9 @@ def test_analyzer_filter_monolithic_commit(az):
         'a.c': {'lines': threshold},
         'b.c': {'lines': 1},
     }
-    case_3_commit = MockCommit(case_3_files, 1)
-    case_3_seeking_mode = az._filter_monolithic_commit(case_3_commit, CommitSeekingMode.NormalForward)
+    case_3_commit = MockCommit(1)
+    case_3_seeking_mode = az._filter_monolithic_commit(case_3_commit, CommitSeekingMode.NormalForward,
+                                                       mock_diff_index(case_3_files))
     assert case_3_seeking_mode == CommitSeekingMode.MergeCommit
 
     # case 4: changes equal to threshold, the commit is a merge commit
@@ -61,18 +64,34 @@ def test_analyzer_filter_monolithic_commit(az):
     case_4_files = {
         'a.c': {'lines': threshold},
     }
-    case_4_commit = MockCommit(case_4_files, 2)
-    case_4_seeking_mode = az._filter_monolithic_commit(case_4_commit, CommitSeekingMode.MergeCommit)
+    case_4_commit = MockCommit(2)
+    case_4_seeking_mode = az._filter_monolithic_commit(case_4_commit, CommitSeekingMode.MergeCommit,
+                                                       mock_diff_index(case_4_files))
     assert case_4_seeking_mode == CommitSeekingMode.MergeCommit
 
 
 class MockCommit:
-    def __init__(self, files: dict, parent_number: int = 1):
+    def __init__(self, parent_number: int = 1):
         self.hexsha = 'test'
-        self.stats = MockCommitStats(files)
         self.parents = [{}] * parent_number
 
 
-class MockCommitStats:
-    def __init__(self, files: dict):
-        self.files = files
+class MockBlob:
+    def __init__(self, path: str):
+        self.path = path
+
+
+class MockDiff:
+    """A file added with the given number of lines"""
+
+    def __init__(self, fname: str, lines: int):
+        self.new_file = True
+        self.deleted_file = False
+        self.renamed = False
+        self.a_blob = None
+        self.b_blob = MockBlob(fname)
+        self.diff = '@@ -0,0 +1,{} @@\n'.format(lines).encode() + b'+line\n' * lines
+
+
+def mock_diff_index(files: dict):
+    return [MockDiff(fname, stats['lines']) for fname, stats in files.items()]
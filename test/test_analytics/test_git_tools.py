@@ -0,0 +1,56 @@
+import codecs
+import os
+import subprocess
+import pytest
+from git import Repo
+from persper.analytics.git_tools import BlobReader, get_contents
+from persper.util.path import root_path
+
+
+@pytest.fixture(scope='module')
+def repo():
+    # build the repo first if not exists yet
+    repo_path = os.path.join(root_path, 'repos/test_feature_branch')
+    script_path = os.path.join(root_path, 'tools/repo_creater/create_repo.py')
+    test_src_path = os.path.join(root_path, 'test/test_feature_branch')
+    if not os.path.isdir(repo_path):
+        cmd = '{} {}'.format(script_path, test_src_path)
+        subprocess.call(cmd, shell=True)
+    return Repo(repo_path)
+
+
+def test_blob_reader_matches_get_contents(repo):
+    with BlobReader(repo) as reader:
+        for commit in repo.iter_commits('--all'):
+            blobs = [b for b in commit.tree.traverse() if b.type == 'blob']
+            contents = reader.get_contents(b.hexsha for b in blobs)
+            assert len(contents) == len(set(b.hexsha for b in blobs))
+            for b in blobs:
+                assert contents[b.hexsha] == get_contents(repo, commit, b.path)
+
+
+def test_blob_reader_missing_object(repo):
+    with BlobReader(repo) as reader:
+        sha = repo.head.commit.tree.traverse().__next__().hexsha
+        contents = reader.read_blobs(['0' * 40, sha])
+        assert contents['0' * 40] is None
+        assert contents[sha] is not None
+        # the process stays usable after a missing object
+        assert reader.read_blob(sha) == contents[sha]
+
+
+def test_blob_reader_bom(tmp_path):
+    repo = Repo.init(str(tmp_path))
+    text = 'int main() { return 0; }\n'
+    with open(os.path.join(str(tmp_path), 'utf16.c'), 'wb') as f:
+        f.write(codecs.BOM_LE + text.encode('utf-16-le'))
+    with open(os.path.join(str(tmp_path), 'utf8.c'), 'wb') as f:
+        f.write(codecs.BOM_UTF8 + text.encode('utf-8'))
+    repo.index.add(['utf16.c', 'utf8.c'])
+    commit = repo.index.commit('BOM')
+    with BlobReader(repo) as reader:
+        blobs = {b.path: b.hexsha for b in commit.tree.traverse()}
+        contents = reader.get_contents(blobs.values())
+        assert contents[blobs['utf8.c']] == text.rstrip('\n')
+        assert contents[blobs['utf8.c']] == get_contents(repo, commit, 'utf8.c')
+        assert contents[blobs['utf16.c']] == get_contents(repo, commit, 'utf16.c')
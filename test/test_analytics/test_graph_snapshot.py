@@ -0,0 +1,83 @@
+import os
+import pickle
+import pytest
+from persper.analytics.call_commit_graph import CallCommitGraph
+from persper.analytics.compact_call_commit_graph import CompactCallCommitGraph
+from persper.analytics.graph_snapshot import SnapshotFormatError, load_snapshot, save_snapshot
+
+
+def build_graph(graph_class):
+    ccgraph = graph_class()
+    ccgraph.add_commit('0x01', 'koala', 'koala@persper.org', 'first commit')
+    ccgraph.add_node('f1', ['a.c'])
+    ccgraph.update_node_history('f1', 10, 0)
+    ccgraph.add_node('f2', ['a.c', 'b.c'])
+    ccgraph.update_node_history_accurate('f2', {'adds': 10, 'dels': 0, 'added_units': 40, 'removed_units': 0})
+    ccgraph.add_edge('f1', 'f2')
+    ccgraph.add_commit('0x02', 'beaver', 'beaver@persper.org', 'second commit')
+    ccgraph.add_node('f3', ['b.c'])
+    ccgraph.update_node_history('f3', 20, 10)
+    ccgraph.update_node_history('f1', 0, 5)
+    ccgraph.add_node('f4')
+    ccgraph.add_edge('f2', 'f3')
+    ccgraph.add_edge('f3', 'f1')
+    return ccgraph
+
+
+def assert_same_graph(actual, expected):
+    assert list(actual.nodes()) == list(expected.nodes())
+    for node, data in expected.nodes(data=True):
+        actual_data = actual.nodes(data=True)[node]
+        assert actual_data['size'] == data['size']
+        assert actual_data['files'] == data['files']
+        assert dict(actual_data['history']) == dict(data['history'])
+    assert sorted(actual.edges(data=True)) == sorted(expected.edges(data=True))
+    assert actual.commits().keys() == expected.commits().keys()
+
+
+@pytest.mark.parametrize('graph_class', [CallCommitGraph, CompactCallCommitGraph])
+@pytest.mark.parametrize('lazy_history', [False, True])
+def test_snapshot_round_trip(tmp_path, graph_class, lazy_history):
+    ccgraph = build_graph(graph_class)
+    ccgraph.function_devranks(0.85)
+    path = os.path.join(str(tmp_path), 'graph.snapshot')
+    # tiny chunks, so that the history spans several chunks
+    save_snapshot(ccgraph, path, chunk_records=2)
+    loaded = load_snapshot(path, lazy_history=lazy_history)
+    assert_same_graph(loaded, ccgraph)
+    assert loaded.devranks(0.85) == ccgraph.devranks(0.85)
+    # lazily loaded histories are pickled as dicts
+    assert_same_graph(pickle.loads(pickle.dumps(loaded)), ccgraph)
+
+
+@pytest.mark.parametrize('lazy_history', [False, True])
+def test_snapshot_resume(tmp_path, lazy_history):
+    ccgraph = build_graph(CallCommitGraph)
+    path = os.path.join(str(tmp_path), 'graph.snapshot')
+    save_snapshot(ccgraph, path)
+    loaded = load_snapshot(path, lazy_history=lazy_history)
+    # the analysis can continue on the loaded graph, in the current commit
+    for g in (ccgraph, loaded):
+        g.update_node_history('f3', 1, 1)
+        g.add_commit('0x03', 'koala', 'koala@persper.org', 'third commit')
+        g.update_node_history('f2', 3, 0)
+    assert_same_graph(loaded, ccgraph)
+    assert loaded.nodes(data=True)['f3']['history']['0x02'] == {'adds': 21, 'dels': 11}
+
+
+def test_snapshot_format_error(tmp_path):
+    path = os.path.join(str(tmp_path), 'graph.snapshot')
+    with open(path, 'wb') as f:
+        f.write(b'not a snapshot' * 10)
+    with pytest.raises(SnapshotFormatError):
+        load_snapshot(path)
+
+
+def test_snapshot_load_into_compact_graph(tmp_path):
+    path = os.path.join(str(tmp_path), 'graph.snapshot')
+    save_snapshot(build_graph(CallCommitGraph), path)
+    graph = build_graph(CompactCallCommitGraph)
+    with pytest.raises(TypeError):
+        load_snapshot(path, graph=graph)
+    # left untouched
+    assert_same_graph(graph, build_graph(CompactCallCommitGraph))
@@ -0,0 +1,90 @@
+import os
+import pickle
+import pytest
+from git import Repo
+from persper.analytics.analyzer2 import Analyzer
+from persper.analytics.history_index import FileStat, HistoryIndex
+from persper.analytics.iterator import RepoIterator
+from .test_analyzer_checkpoint import FileGraphServer, assert_same_graph, repo_path
+
+
+def test_history_index(repo_path, tmp_path):
+    path = os.path.join(str(tmp_path), 'history.npz')
+    HistoryIndex.build(repo_path, path=path)
+    index = HistoryIndex.load(path)
+    repo = Repo(repo_path)
+    commits = list(repo.iter_commits('--all'))
+    assert sorted(index.hexshas()) == sorted(c.hexsha for c in commits)
+    for commit in commits:
+        sha = commit.hexsha
+        assert index.parents(sha) == [p.hexsha for p in commit.parents]
+        assert index.is_merge(sha) == (len(commit.parents) > 1)
+        assert index.author(sha) == (commit.author.name, commit.author.email)
+        assert index.authored_date(sha) == commit.authored_date
+        assert index.committed_date(sha) == commit.committed_date
+        assert index.summary(sha) == commit.summary
+        if not any(f.old_path for f in index.files(sha)):
+            assert index.stats(sha) == {path: {k: stats[k] for k in ('insertions', 'deletions', 'lines')}
+                                        for path, stats in commit.stats.files.items()}
+    # feature-J.c is renamed to feature-K.c
+    assert FileStat('feature-K.c', 1, 6, 'feature-J.c') in [f for sha in index.hexshas() for f in index.files(sha)]
+    head = repo.head.commit.hexsha
+    assert index.first_parent_chain(head) == [c.hexsha for c in repo.iter_commits(head, first_parent=True)]
+    assert pickle.loads(pickle.dumps(index)).hexshas() == index.hexshas()
+
+
+def test_repo_iterator_with_history_index(repo_path):
+    index = HistoryIndex.build(repo_path)
+    expected = RepoIterator(repo_path).iter(from_beginning=True, into_branches=True)
+    actual = RepoIterator(repo_path, history_index=index).iter(from_beginning=True, into_branches=True)
+    for expected_commits, actual_commits in zip(expected, actual):
+        assert [c.hexsha for c in actual_commits] == [c.hexsha for c in expected_commits]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('firstParentOnly', [False, True])
+async def test_analyze_with_history_index(repo_path, firstParentOnly):
+    expected = Analyzer(repo_path, FileGraphServer(), firstParentOnly=firstParentOnly)
+    await expected.analyze(suppressStdOutLogs=True)
+    az = Analyzer(repo_path, FileGraphServer(), firstParentOnly=firstParentOnly,
+                  history_index=HistoryIndex.build(repo_path))
+    await az.analyze(suppressStdOutLogs=True)
+    assert az.visitedCommits == expected.visitedCommits
+    assert_same_graph(az.graph, expected.graph)
+
+
+def test_history_index_partial(repo_path):
+    repo = Repo(repo_path)
+    index = HistoryIndex.build(repo_path, revs=['HEAD~3..HEAD'])
+    commits = list(repo.iter_commits('HEAD~3..HEAD'))
+    assert sorted(index.hexshas()) == sorted(c.hexsha for c in commits)
+    outside = 0
+    for commit in commits:
+        sha = commit.hexsha
+        assert index.is_merge(sha) == (len(commit.parents) > 1)
+        if all(p.hexsha in index for p in commit.parents):
+            assert index.covers(sha)
+            assert index.parents(sha) == [p.hexsha for p in commit.parents]
+        else:
+            outside += 1
+            assert not index.covers(sha)
+            with pytest.raises(KeyError):
+                index.parents(sha)
+    assert outside > 0
+    assert not index.covers(repo.commit('HEAD~3').hexsha)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('revs', [
+    # the commits after HEAD~3 are made after the index was built
+    ['HEAD~3'],
+    # the parents of the first commits are outside the index
+    ['HEAD~3..HEAD'],
+])
+async def test_analyze_with_partial_history_index(repo_path, revs):
+    expected = Analyzer(repo_path, FileGraphServer())
+    await expected.analyze(suppressStdOutLogs=True)
+    az = Analyzer(repo_path, FileGraphServer(), history_index=HistoryIndex.build(repo_path, revs=revs))
+    await az.analyze(suppressStdOutLogs=True)
+    assert az.visitedCommits == expected.visitedCommits
+    assert_same_graph(az.graph, expected.graph)
@@ -0,0 +1,78 @@
+from pathlib import PurePath
+
+import pytest
+
+pytest.importorskip("antlr4")
+pytest.importorskip("jsonrpc")
+
+from persper.analytics.lsp_graph_server.callgraph import CallGraph, CallGraphBranch, CallGraphNode, CallGraphScope
+from persper.analytics.lsp_graph_server.languageclient.lspcontract import Position, SymbolKind
+
+_A, _B, _C = PurePath("/ws/a.cpp"), PurePath("/ws/b.cpp"), PurePath("/ws/c.h")
+
+
+def _branch(sourceFile, sourceName, definitionFile, definitionName, line=1):
+    sourceScope = CallGraphScope(sourceName, SymbolKind.Function, sourceFile, Position(0, 0), Position(10, 0))
+    definitionScope = CallGraphScope(definitionName, SymbolKind.Function, definitionFile,
+                                     Position(0, 0), Position(10, 0))
+    return CallGraphBranch(sourceScope, definitionScope,
+                           CallGraphNode(definitionName, SymbolKind.Function, sourceFile, Position(line, 4), 1),
+                           CallGraphNode(definitionName, SymbolKind.Function, definitionFile, Position(0, 4), 1))
+
+
+def test_position_hash():
+    assert Position(1, 2) == Position(1, 2)
+    assert hash(Position(1, 2)) == hash(Position(1, 2))
+    assert len({Position(1, 2), Position(1, 2), Position(2, 1)}) == 2
+
+
+def test_call_graph_add():
+    graph = CallGraph()
+    ab = _branch(_A, "a", _B, "b")
+    graph.add(ab)
+    # equal branches are added once
+    graph.add(_branch(_A, "a", _B, "b"))
+    assert graph.items == {ab}
+    with pytest.raises(ValueError):
+        graph.add(CallGraphBranch(None, ab.definitionScope, ab.sourceToken, ab.definitionToken))
+    with pytest.raises(ValueError):
+        graph.add(CallGraphBranch(ab.sourceScope, None, ab.sourceToken, ab.definitionToken))
+
+
+def test_call_graph_source_files_referencing():
+    graph = CallGraph()
+    graph.add(_branch(_A, "a", _C, "c"))
+    graph.add(_branch(_B, "b", _C, "c"))
+    graph.add(_branch(_B, "b", _A, "a"))
+    assert graph.sourceFilesReferencing([_C]) == {_A, _B}
+    assert graph.sourceFilesReferencing([_A]) == {_B}
+    assert graph.sourceFilesReferencing([_B]) == set()
+    assert graph.sourceFilesReferencing([PurePath("/ws/d.cpp")]) == set()
+
+
+def test_call_graph_remove_by_source_files():
+    graph = CallGraph()
+    ac = _branch(_A, "a", _C, "c")
+    ac2 = _branch(_A, "a", _C, "c", line=2)
+    bc = _branch(_B, "b", _C, "c")
+    ba = _branch(_B, "b", _A, "a")
+    for b in (ac, ac2, bc, ba):
+        graph.add(b)
+    graph.removeBySourceFiles([_A])
+    assert graph.items == {bc, ba}
+    assert graph.sourceFilesReferencing([_C]) == {_B}
+    # removing again, or files without branches, does nothing
+    graph.removeBySourceFiles([_A, _C])
+    assert graph.items == {bc, ba}
+
+    graph.removeBySourceFiles([_B])
+    assert graph.items == set()
+    assert graph.sourceFilesReferencing([_A, _C]) == set()
+    # the emptied indexes are dropped
+    assert not graph._bySourceFile and not graph._byDefinitionFile
+
+    graph.add(ac)
+    assert graph.sourceFilesReferencing([_C]) == {_A}
+    graph.clear()
+    assert graph.items == set()
+    assert graph.sourceFilesReferencing([_C]) == set()
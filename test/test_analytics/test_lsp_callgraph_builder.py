@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import re
+import urllib.parse
+from collections import Counter
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("antlr4")
+pytest.importorskip("jsonrpc")
+
+from persper.analytics.lsp_graph_server.callgraph.builder import CallGraphBuilder, TokenizedDocument
+from persper.analytics.lsp_graph_server.languageclient.lspclient import LspClient
+from persper.analytics.lsp_graph_server.languageclient.lspcontract import \
+    DocumentSymbol, Location, Position, Range, SymbolKind, TextDocument
+
+
+class _CallGraphBuilder(CallGraphBuilder):
+
+    def createLexer(self, fileStream):
+        raise NotImplementedError
+
+    def filterToken(self, token):
+        return True
+
+    def inferLanguageId(self, path):
+        return "cpp"
+
+
+def test_write_file_within_one_second(tmp_path):
+    # the client is not used when writing files
+    builder = _CallGraphBuilder(LspClient.__new__(LspClient))
+    path = tmp_path / "a.c"
+    builder._writeFile(path, "int a;")
+    first = path.stat().st_mtime_ns
+    builder._writeFile(path, "int b;")
+    second = path.stat().st_mtime_ns
+    assert path.read_text() == "int b;"
+    # language servers keeping whole seconds still see the change
+    assert second // 10**9 > first // 10**9
+
+    # deleted and created again
+    path.unlink()
+    builder._writeFile(path, "int c;")
+    assert path.stat().st_mtime_ns // 10**9 > second // 10**9
+
+
+class _Token:
+    # the fields TokenizedDocument reads from antlr4 tokens
+    def __init__(self, text, line, column, start):
+        self.text, self.line, self.column = text, line, column
+        self.start, self.stop = start, start + len(text) - 1
+
+
+class _StubServer:
+    """
+    Resolves each identifier to the file defining it as `int <name>()`.
+    """
+
+    def __init__(self, root):
+        self._root = root
+        self.requests = Counter()
+
+    def _definitions(self):
+        for path in self._root.glob("*.cpp"):
+            for m in re.finditer(r"int (\w+)\(\)", path.read_text()):
+                yield m.group(1), path, m.start(1)
+
+    async def textDocumentGetSymbols(self, uri):
+        path = Path(urllib.parse.urlparse(uri).path)
+        return [DocumentSymbol(name, None, SymbolKind.Function, False,
+                               Range(Position(0, 0), Position(0, len(path.read_text()))),
+                               Range(Position(0, column), Position(0, column + len(name))), [])
+                for name, p, column in self._definitions() if p == path]
+
+    async def textDocumentGotoDefinition(self, uri, cursor):
+        path = Path(urllib.parse.urlparse(uri).path)
+        line, character = cursor
+        name = next(m.group(0) for m in re.finditer(r"\w+", path.read_text())
+                    if m.start() <= character < m.end())
+        self.requests[(path.name, name)] += 1
+        return [Location(TextDocument.fileNameToUri(str(p)), Range(Position(0, column), Position(0, column)))
+                for n, p, column in self._definitions() if n == name]
+
+    def textDocumentDidOpen(self, textDoc):
+        pass
+
+    def textDocumentDidClose(self, uri):
+        pass
+
+
+class _StubLspClient(LspClient):
+    def __init__(self, server):
+        self._server = server
+
+    @property
+    def server(self):
+        return self._server
+
+
+class _StubCallGraphBuilder(_CallGraphBuilder):
+
+    async def getTokenizedDocument(self, path):
+        # tokenizes the identifiers instead of lexing
+        path = Path(path).resolve()
+        doc = self._tokenizedDocCache.get(path)
+        if doc:
+            return doc
+        text = path.read_text()
+        tokens = [_Token(m.group(0), 1, m.start(), m.start()) for m in re.finditer(r"[A-Za-z_]\w*", text)
+                  if m.group(0) not in ("int", "return")]
+        symbols = await self._lspClient.server.textDocumentGetSymbols(TextDocument.fileNameToUri(str(path)))
+        doc = self._tokenizedDocCache[path] = TokenizedDocument(tokens, symbols, path, lambda s: True)
+        return doc
+
+    async def openDocument(self, textDoc):
+        return True
+
+    async def closeDocument(self, uri):
+        pass
+
+
+def _build(builder, *paths):
+    async def build():
+        return [(b.sourceToken.name, b.definitionToken.file.name)
+                for p in paths async for b in builder.buildCallGraphInFile(str(p))]
+    return sorted(asyncio.get_event_loop().run_until_complete(build()))
+
+
+def test_definition_cache(tmp_path):
+    server = _StubServer(tmp_path)
+    builder = _StubCallGraphBuilder(_StubLspClient(server))
+    a, b, c = tmp_path / "a.cpp", tmp_path / "b.cpp", tmp_path / "c.cpp"
+    a.write_text("int a() { return b() + c(); }")
+    b.write_text("int b() { return 1; }")
+    c.write_text("int c() { return missing(); }")
+
+    # the first commit
+    assert _build(builder, a, b, c) == [("b", "b.cpp"), ("c", "c.cpp")]
+    assert server.requests == Counter({("a.cpp", "a"): 1, ("a.cpp", "b"): 1, ("a.cpp", "c"): 1,
+                                       ("b.cpp", "b"): 1, ("c.cpp", "c"): 1, ("c.cpp", "missing"): 1})
+
+    # the next commit changes b.cpp, moving b() and adding missing()
+    server.requests.clear()
+    b.write_text("int missing() { return 0; } int b() { return missing(); }")
+    builder.removeDocumentCache(str(b))
+    assert _build(builder, a, b, c) == [("b", "b.cpp"), ("c", "c.cpp"), ("missing", "b.cpp"), ("missing", "b.cpp")]
+    assert server.requests == Counter({
+        # the result resolved into b.cpp is dropped, the others are still cached
+        ("a.cpp", "b"): 1,
+        # the changed file is requested again
+        ("b.cpp", "missing"): 2, ("b.cpp", "b"): 1,
+        # the empty result is not cached
+        ("c.cpp", "missing"): 1})
+    assert (b.resolve(), hashlib.sha1(b"int b() { return 1; }").hexdigest()) not in builder._definitionCache
+
+    # nothing changes
+    server.requests.clear()
+    assert len(_build(builder, a, b, c)) == 4
+    assert server.requests == Counter()
@@ -0,0 +1,113 @@
+import random
+
+import pytest
+
+pytest.importorskip("antlr4")
+pytest.importorskip("jsonrpc")
+
+from persper.analytics.lsp_graph_server.callgraph.builder import TokenizedDocument
+from persper.analytics.lsp_graph_server.callgraph.intervals import IntervalIndex
+from persper.analytics.lsp_graph_server.languageclient.lspcontract import \
+    DocumentSymbol, Position, Range, SymbolKind
+
+
+def _linearOverlapping(intervals, lo, hi=None):
+    if hi is None:
+        hi = lo
+    return [i for i, (start, end) in enumerate(intervals) if start <= end and start <= hi and lo <= end]
+
+
+def _linearScopesOnLine(scopes, line):
+    # TokenizedDocument.scopesOnLine before IntervalIndex
+    result = []
+    for scope in scopes:
+        if scope.startPos.line > line:
+            break
+        if scope.endPos.line >= line:
+            result.append(scope)
+    return result
+
+
+def _linearScopeAt(scopes, line, character):
+    # TokenizedDocument.scopeAt before IntervalIndex
+    pos = Position(line, character)
+    lastScope = None
+    for scope in scopes:
+        if scope.startPos > pos:
+            break
+        if pos < scope.endPos:
+            lastScope = scope
+    return lastScope
+
+
+def _symbol(name, start, end, children=()):
+    range = Range(Position(*start), Position(*end))
+    return DocumentSymbol(name, None, SymbolKind.Function, False, range,
+                          Range(range.start, Position(start[0], start[1] + len(name))), list(children))
+
+
+def test_interval_index_nested_overlapping_single():
+    intervals = [
+        (0, 100),       # nested
+        (2, 50),
+        (3, 10),
+        (5, 5),         # single line
+        (10, 20),       # overlapping its siblings at the ends
+        (20, 30),
+        (25, 60),
+        (60, 60),
+        (70, 69),       # empty
+        (101, 101),
+    ]
+    index = IntervalIndex(intervals)
+    assert len(index) == len(intervals)
+    for lo in range(-2, 104):
+        assert index.overlapping(lo) == _linearOverlapping(intervals, lo), lo
+        for hi in range(lo, 104, 7):
+            assert index.overlapping(lo, hi) == _linearOverlapping(intervals, lo, hi), (lo, hi)
+
+
+def test_interval_index_random():
+    rnd = random.Random(17)
+    for _ in range(50):
+        intervals = []
+        for _ in range(rnd.randrange(0, 40)):
+            start = rnd.randrange(0, 200)
+            intervals.append((start, start + rnd.choice((0, 0, 1, rnd.randrange(0, 80)))))
+        index = IntervalIndex(intervals)
+        for _ in range(50):
+            lo = rnd.randrange(-5, 300)
+            hi = lo + rnd.choice((0, rnd.randrange(0, 30)))
+            assert index.overlapping(lo) == _linearOverlapping(intervals, lo)
+            assert index.overlapping(lo, hi) == _linearOverlapping(intervals, lo, hi)
+
+
+def test_tokenized_document_scopes():
+    symbols = [
+        _symbol("ns", (0, 0), (40, 1), [
+            _symbol("C", (1, 4), (20, 5), [
+                _symbol("f", (2, 8), (2, 30)),                # single line
+                _symbol("g", (3, 8), (3, 12)),
+                _symbol("h", (3, 14), (3, 20)),               # sharing a line with g
+                _symbol("k", (4, 8), (10, 9), [
+                    _symbol("lambda", (5, 12), (7, 13)),
+                ]),
+                _symbol("m", (10, 10), (19, 9)),              # starting on the line k ends
+            ]),
+            _symbol("main", (22, 0), (39, 1)),
+        ]),
+        _symbol("tail", (40, 2), (40, 20)),                   # starting on the line ns ends
+    ]
+    doc = TokenizedDocument([], symbols, "a.cpp", lambda s: True)
+    scopes = doc.scopes
+    for line in range(-1, 43):
+        assert doc.scopesOnLine(line) == _linearScopesOnLine(scopes, line), line
+        for character in range(0, 35):
+            assert doc.scopeAt(line, character) == _linearScopeAt(scopes, line, character), (line, character)
+    for startLine in range(-1, 43):
+        for endLine in range(startLine, 43):
+            expected = []
+            for line in range(startLine, endLine + 1):
+                expected.extend(s for s in _linearScopesOnLine(scopes, line) if s not in expected)
+            expected.sort(key=scopes.index)
+            assert doc.scopesInLines(startLine, endLine) == expected, (startLine, endLine)
@@ -0,0 +1,137 @@
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("antlr4")
+pytest.importorskip("jsonrpc")
+
+from persper.analytics.lsp_graph_server.cclscache import CclsIndexCache, CclsIndexCacheStats
+
+_NS_PER_SECOND = 1000000000
+
+
+def _write(path: Path, content: str):
+    os.makedirs(str(path.parent), exist_ok=True)
+    path.write_text(content)
+
+
+def _seconds(path: Path):
+    return path.stat().st_mtime_ns // _NS_PER_SECOND
+
+
+def _index(cache: CclsIndexCache, path: Path, header: Path):
+    # the fields ccls writes into a json cache file, with the modification times in seconds
+    return {"mtime": _seconds(path),
+            "language": 2,
+            "lid2path": [[0, header.as_posix()]],
+            "import_file": "",
+            "args": ["clang++", path.as_posix()],
+            "dependencies": {header.as_posix(): _seconds(header)},
+            "includes": [{"line": 0, "resolved_path": header.as_posix()}],
+            "skipped_ranges": [],
+            "usr2func": [], "usr2type": [], "usr2var": []}
+
+
+def _ccls_writes_index(cache: CclsIndexCache, path: Path, index: dict):
+    # what ccls does after parsing the file
+    cachePath = cache.cachePathOf(path)
+    os.makedirs(str(cachePath.parent), exist_ok=True)
+    cachePath.write_bytes(path.read_bytes())
+    with open(str(cachePath) + ".json", "wt", encoding="utf-8") as f:
+        json.dump(index, f)
+
+
+def _workspace(root: Path, mtime: int):
+    source, header = root.joinpath("src/a.cpp"), root.joinpath("src/a.h")
+    _write(header, "int f();\n")
+    _write(source, '#include "a.h"\nint f() { return 1; }\n')
+    for p in (header, source):
+        os.utime(str(p), (mtime, mtime))
+    return source, header
+
+
+def test_cache_path_of(tmp_path):
+    workspace = tmp_path.joinpath("ws").resolve()
+    cache = CclsIndexCache(tmp_path.joinpath("store"), workspace, tmp_path.joinpath("cache"))
+    rootDir = workspace.as_posix().replace("/", "@").replace(":", "@")
+    cacheRoot = tmp_path.joinpath("cache").resolve()
+    assert cache.cachePathOf(workspace.joinpath("src/a.cpp")) == cacheRoot.joinpath(rootDir, "src@a.cpp")
+    external = tmp_path.joinpath("include/b.h").resolve()
+    assert cache.cachePathOf(external) == \
+        cacheRoot.joinpath("@" + rootDir, external.as_posix().replace("/", "@").replace(":", "@"))
+
+
+def test_seed_and_harvest(tmp_path):
+    # the first analysis stores the index ccls writes
+    first = tmp_path.joinpath("ws1").resolve()
+    source, header = _workspace(first, 1500000000)
+    cache = CclsIndexCache(tmp_path.joinpath("store"), first, tmp_path.joinpath("cache1"))
+    assert not cache.seed(source, source.read_text())
+    cache.harvest()
+    # not indexed yet
+    assert cache.stats == CclsIndexCacheStats(0, 1, 0)
+    _ccls_writes_index(cache, source, _index(cache, source, header))
+    cache.markIndexed(source)
+    cache.harvest()
+    assert cache.stats == CclsIndexCacheStats(0, 1, 1)
+
+    # the next analysis, in another workspace, seeds the stored index
+    second = tmp_path.joinpath("ws2").resolve()
+    source, header = _workspace(second, 1600000000)
+    cache = CclsIndexCache(tmp_path.joinpath("store"), second, tmp_path.joinpath("cache2"))
+    assert cache.seed(source, source.read_text())
+    cachePath = cache.cachePathOf(source)
+    assert cachePath.read_bytes() == source.read_bytes()
+    with open(str(cachePath) + ".json", "rt", encoding="utf-8") as f:
+        seeded = json.load(f)
+    expected = _index(cache, source, header)
+    assert seeded == expected
+    assert seeded["mtime"] == 1600000000
+    # counted once ccls has loaded it
+    assert cache.stats == CclsIndexCacheStats(0, 0, 0)
+    cache.markIndexed(source)
+    cache.harvest()
+    assert cache.stats == CclsIndexCacheStats(1, 0, 0)
+
+
+def test_seed_reindexed(tmp_path):
+    first = tmp_path.joinpath("ws1").resolve()
+    source, header = _workspace(first, 1500000000)
+    cache = CclsIndexCache(tmp_path.joinpath("store"), first, tmp_path.joinpath("cache1"))
+    cache.seed(source, source.read_text())
+    _ccls_writes_index(cache, source, _index(cache, source, header))
+    cache.harvest()
+
+    second = tmp_path.joinpath("ws2").resolve()
+    source, header = _workspace(second, 1600000000)
+    cache = CclsIndexCache(tmp_path.joinpath("store"), second, tmp_path.joinpath("cache2"))
+    assert cache.seed(source, source.read_text())
+    # ccls parses the file again, e.g. with other arguments, writing its own index
+    index = _index(cache, source, header)
+    index["args"].append("-DNDEBUG")
+    _ccls_writes_index(cache, source, index)
+    cache.harvest()
+    assert cache.stats == CclsIndexCacheStats(0, 1, 1)
+    # which replaces the stored one
+    assert cache.seed(source, source.read_text())
+    with open(str(cache.cachePathOf(source)) + ".json", "rt", encoding="utf-8") as f:
+        assert json.load(f)["args"][-1] == "-DNDEBUG"
+
+
+def test_seed_dependency_changed(tmp_path):
+    first = tmp_path.joinpath("ws1").resolve()
+    source, header = _workspace(first, 1500000000)
+    cache = CclsIndexCache(tmp_path.joinpath("store"), first, tmp_path.joinpath("cache1"))
+    cache.seed(source, source.read_text())
+    _ccls_writes_index(cache, source, _index(cache, source, header))
+    cache.harvest()
+
+    second = tmp_path.joinpath("ws2").resolve()
+    source, header = _workspace(second, 1600000000)
+    header.write_text("long f();\n")
+    cache = CclsIndexCache(tmp_path.joinpath("store"), second, tmp_path.joinpath("cache2"))
+    assert not cache.seed(source, source.read_text())
+    assert not os.path.exists(str(cache.cachePathOf(source)) + ".json")
+    assert cache.stats == CclsIndexCacheStats(0, 1, 0)
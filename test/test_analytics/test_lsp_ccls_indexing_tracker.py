@@ -0,0 +1,80 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("antlr4")
+pytest.importorskip("jsonrpc")
+
+from persper.analytics.lsp_graph_server.ccls import CclsIndexingTracker
+
+
+def test_wait_notified_from_another_thread():
+    # without notifications, the waiter would sleep for maxDelay
+    tracker = CclsIndexingTracker(minDelay=10, maxDelay=10)
+    jobs = [3]
+    queried = threading.Event()
+    stopped = threading.Event()
+    errors = []
+
+    async def pendingJobs():
+        queried.set()
+        return jobs[0]
+
+    def notifier():
+        # as the listener thread of LspClient, also before and while the tracker starts waiting
+        try:
+            while not stopped.is_set():
+                if queried.is_set():
+                    queried.clear()
+                    jobs[0] -= 1
+                tracker.notify()
+                time.sleep(0.001)
+        except Exception as ex:
+            errors.append(ex)
+
+    thread = threading.Thread(target=notifier)
+    thread.start()
+    try:
+        start = time.monotonic()
+        asyncio.get_event_loop().run_until_complete(asyncio.wait_for(tracker.wait(pendingJobs), 5))
+        assert time.monotonic() - start < 5
+    finally:
+        stopped.set()
+        thread.join()
+    assert not errors
+    assert jobs[0] <= 0
+
+
+def test_notify_while_wait_starts(monkeypatch):
+    tracker = CclsIndexingTracker(minDelay=10, maxDelay=10)
+    createEvent = asyncio.Event
+
+    def notifyAndCreateEvent():
+        # the listener thread notifies while the tracker sets up
+        tracker.notify()
+        return createEvent()
+
+    monkeypatch.setattr(asyncio, "Event", notifyAndCreateEvent)
+    jobs = [1]
+
+    async def pendingJobs():
+        tracker.notify()
+        jobs[0] -= 1
+        return jobs[0]
+
+    asyncio.get_event_loop().run_until_complete(tracker.wait(pendingJobs))
+    assert jobs[0] == 0
+
+
+def test_wait_without_notifications():
+    tracker = CclsIndexingTracker(minDelay=0.001, maxDelay=0.01)
+    jobs = [3]
+
+    async def pendingJobs():
+        jobs[0] -= 1
+        return max(jobs[0], 0)
+
+    asyncio.get_event_loop().run_until_complete(tracker.wait(pendingJobs))
+    assert jobs[0] == 0
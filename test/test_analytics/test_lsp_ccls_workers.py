@@ -0,0 +1,88 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("antlr4")
+pytest.importorskip("jsonrpc")
+
+from persper.analytics.lsp_graph_server.callgraph.builder import CallGraphBuilder
+from persper.analytics.lsp_graph_server.callgraph.manager import CallGraphManager
+from persper.analytics.lsp_graph_server.ccls import CclsGraphServer
+from persper.analytics.lsp_graph_server.languageclient.lspclient import LspClient
+
+
+class _CallGraphBuilder(CallGraphBuilder):
+
+    def createLexer(self, fileStream):
+        raise NotImplementedError
+
+    def filterToken(self, token):
+        return True
+
+    def inferLanguageId(self, path):
+        return "cpp"
+
+
+def _server(workspace: Path, workers: int):
+    # the language servers are not started
+    server = CclsGraphServer.__new__(CclsGraphServer)
+    server._cacheRoot = workspace.joinpath(".ccls-cache")
+    builders = [_CallGraphBuilder(LspClient.__new__(LspClient)) for _ in range(workers)]
+    server._callGraphManager = CallGraphManager(builders[0], workers=builders[1:])
+    return server
+
+
+def _write(path: Path, content: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+    return path.resolve()
+
+
+def test_worker_cache_roots(tmp_path):
+    server = _server(tmp_path, 3)
+    roots = [server._workerCacheRoot(i) for i in range(3)]
+    assert roots == [tmp_path.joinpath(".ccls-cache"),
+                     tmp_path.joinpath(".ccls-cache.1"),
+                     tmp_path.joinpath(".ccls-cache.2")]
+
+
+def test_headers_routed_with_sources(tmp_path):
+    server = _server(tmp_path, 4)
+    manager = server._callGraphManager
+    headers = [_write(tmp_path.joinpath("src/h{0}.h".format(i)), "int f{0}();\n".format(i)) for i in range(8)]
+    sources = [_write(tmp_path.joinpath("src/c{0}.cpp".format(i)),
+                      '#include "h{0}.h"\n# include "../include/common.h"\nint f{0}() {{ return 0; }}\n'.format(i))
+               for i in range(8)]
+    common = _write(tmp_path.joinpath("include/common.h"), "")
+    # included by a path relative to the include directories
+    other = _write(tmp_path.joinpath("lib/other.h"), "")
+    _write(tmp_path.joinpath("src/c0.cpp"), '#include "h0.h"\n#include "other.h"\n')
+
+    paths = server._orderAffectedFiles(headers + [common, other] + sources)
+    assert paths == sources + headers + [common, other]
+    for source, header in zip(sources, headers):
+        assert manager.builderFor(header) is manager.builderFor(source)
+    # the first source including it
+    assert manager.builderFor(common) is manager.builderFor(sources[1])
+    assert manager.builderFor(other) is manager.builderFor(sources[0])
+
+    # each worker opens the headers after the sources including them
+    opened = {}
+
+    async def enumScopes(builder, fileName):
+        opened.setdefault(builder, []).append(fileName)
+
+    asyncio.get_event_loop().run_until_complete(manager.mapFiles(paths, enumScopes))
+    for files in opened.values():
+        for source, header in zip(sources, headers):
+            if header in files:
+                assert files.index(source) < files.index(header)
+
+
+def test_single_worker_not_routed(tmp_path):
+    server = _server(tmp_path, 1)
+    header = _write(tmp_path.joinpath("a.h"), "")
+    source = _write(tmp_path.joinpath("a.cpp"), '#include "a.h"\n')
+    assert server._orderAffectedFiles([header, source]) == [source, header]
+    assert not server._callGraphManager._routes
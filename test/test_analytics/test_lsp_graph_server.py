@@ -0,0 +1,141 @@
+import asyncio
+import os
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("antlr4")
+pytest.importorskip("jsonrpc")
+
+from persper.analytics.call_commit_graph import CallCommitGraph
+from persper.analytics.graph_server import CommitSeekingMode
+from persper.analytics.lsp_graph_server import LspClientGraphServer
+from persper.analytics.lsp_graph_server.callgraph.builder import CallGraphBuilder, TokenizedDocument
+from persper.analytics.lsp_graph_server.languageclient.lspclient import LspClient
+from persper.analytics.lsp_graph_server.languageclient.lspcontract import \
+    DocumentSymbol, FileChangeType, Position, Range, SymbolKind, TextDocument
+
+
+def _symbol(name, startLine, endLine, children=()):
+    range = Range(Position(startLine, 0), Position(endLine, 1))
+    return DocumentSymbol(name, None, SymbolKind.Function, False, range,
+                          Range(Position(startLine, 4), Position(startLine, 4 + len(name))), list(children))
+
+
+def _document():
+    symbols = [
+        _symbol("ns", 0, 60, [
+            _symbol("C", 1, 30, [
+                _symbol("f", 2, 2),
+                _symbol("g", 3, 12, [_symbol("lambda", 5, 7)]),
+                _symbol("h", 12, 20),
+            ]),
+            _symbol("main", 32, 59),
+        ]),
+        _symbol("tail", 60, 62),
+    ]
+    return TokenizedDocument([], symbols, Path("a.cpp"), lambda s: True)
+
+
+def _history(graph: CallCommitGraph):
+    return {node: dict(data["history"]) for node, data in graph.nodes(data=True)}
+
+
+def test_hunk_attribution(tmp_path):
+    doc = _document()
+    hunks = [(1, 1), (2, 4), (3, 3), (5, 9), (7, 14), (13, 13), (20, 35), (31, 33), (60, 70), (64, 80)]
+    server = LspClientGraphServer(str(tmp_path))
+    graph = server.get_graph()
+    graph.add_commit("c1", "author", "author@example.com", "message")
+    for start, end in hunks:
+        server._markHunkAsChanged(doc, start, end, False)
+        server._markHunkAsChanged(doc, start, end, True)
+    server._flushNodeHistory()
+
+    # attributed line by line
+    expected = CallCommitGraph()
+    expected.add_commit("c1", "author", "author@example.com", "message")
+    for start, end in hunks:
+        for markAsRemoved in (False, True):
+            for i in range(start - 1, end):
+                for scope in doc.scopesOnLine(i):
+                    if scope.name not in expected.nodes():
+                        expected.add_node(scope.name)
+                    expected.update_node_history(scope.name, 0 if markAsRemoved else 1, 1 if markAsRemoved else 0)
+    assert _history(graph) == _history(expected)
+    assert _history(graph)["C"]
+
+
+class _StubServer:
+    def __init__(self):
+        self.fileEvents = []
+
+    def workspaceDidChangeWatchedFiles(self, events):
+        self.fileEvents.append([(e.uri, e.type) for e in events])
+
+
+class _StubLspClient(LspClient):
+    def __init__(self, server):
+        self._server = server
+
+    @property
+    def server(self):
+        return self._server
+
+
+class _CallGraphBuilder(CallGraphBuilder):
+
+    def createLexer(self, fileStream):
+        raise NotImplementedError
+
+    def filterToken(self, token):
+        return True
+
+    def inferLanguageId(self, path):
+        return "cpp"
+
+
+def test_rewind_changes(tmp_path):
+    workspace = tmp_path.joinpath("ws")
+    workspace.mkdir()
+    for name in ("changed.cpp", "deleted.cpp", "renamed.cpp", "renamedTo.h"):
+        workspace.joinpath(name).write_text(name)
+    stub = _StubServer()
+    server = LspClientGraphServer(str(workspace))
+    server._callGraphBuilder = _CallGraphBuilder(_StubLspClient(stub))
+
+    async def rewind():
+        server.start_commit("c0", CommitSeekingMode.Rewind, "author", "author@example.com", "message")
+        await server.update_graph("changed.cpp", "changed.cpp", "changed.cpp", "changed", b"")
+        await server.update_graph("deleted.cpp", "deleted.cpp", None, None, b"")
+        await server.update_graph(None, None, "created/new.cpp", "new", b"")
+        # the target of a rename is also renamed away
+        await server.update_graph("renamed.cpp", "renamed.cpp", "renamedTo.h", "renamed", b"")
+        await server.update_graph("renamedTo.h", "renamedTo.h", "renamedAgain.h", "renamedTo.h", b"")
+        # nothing is written before end_commit
+        assert stub.fileEvents == []
+        await server.end_commit("c0")
+
+    asyncio.get_event_loop().run_until_complete(rewind())
+    assert len(stub.fileEvents) == 1
+
+    def uri(name):
+        return TextDocument.fileNameToUri(workspace.joinpath(name).resolve())
+    assert sorted(stub.fileEvents[0], key=lambda e: e[0]) == sorted([
+        (uri("changed.cpp"), FileChangeType.Changed),
+        (uri("deleted.cpp"), FileChangeType.Deleted),
+        (uri("created/new.cpp"), FileChangeType.Created),
+        (uri("renamed.cpp"), FileChangeType.Deleted),
+        (uri("renamedTo.h"), FileChangeType.Changed),
+        (uri("renamedAgain.h"), FileChangeType.Created),
+    ], key=lambda e: e[0])
+    assert sorted(os.listdir(str(workspace))) == ["changed.cpp", "created", "renamedAgain.h", "renamedTo.h"]
+    assert workspace.joinpath("renamedTo.h").read_text() == "renamed"
+    assert workspace.joinpath("created/new.cpp").read_text() == "new"
+    # the graph of the changed files is updated in the next commit
+    assert server._invalidatedFiles == {workspace.joinpath(name).resolve() for name in
+                                        ("changed.cpp", "deleted.cpp", "created/new.cpp", "renamed.cpp",
+                                         "renamedTo.h", "renamedAgain.h")}
+    assert not server._rewindChanges
+    # rewinding does not touch the graph
+    assert not list(server.get_graph().commits())
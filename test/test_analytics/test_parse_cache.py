@@ -0,0 +1,51 @@
+import os
+import pickle
+from persper.analytics.parse_cache import ParseCache, source_key
+
+FUNCTIONS = [('foo', 1, 1, ['bar']), ('main', 2, 5, ['foo', 'baz'])]
+
+
+def test_source_key():
+    assert source_key('a.c', 'int x;') == source_key('dir/b.c', 'int x;')
+    assert source_key('a.c', 'int x;') != source_key('a.cpp', 'int x;')
+    assert source_key('a.c', 'int x;') != source_key('a.c', 'int y;')
+
+
+def test_parse_cache_persistence(tmp_path):
+    path = os.path.join(str(tmp_path), 'cache.db')
+    cache = ParseCache(path, '1')
+    key = source_key('a.c', 'int x;')
+    assert cache.get(key) is None
+    cache.put(key, FUNCTIONS)
+    assert cache.get(key) == [list(f) for f in FUNCTIONS]
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+
+    # survives restarts, but only for the same parser version
+    assert ParseCache(path, '1').get(key) is not None
+    assert ParseCache(path, '2').get(key) is None
+
+    # the connection is reopened after unpickling
+    cache = pickle.loads(pickle.dumps(ParseCache(path, '1')))
+    assert cache.get_many([key, 'missing']) == {key: [list(f) for f in FUNCTIONS]}
+
+
+def test_parse_cache_lru(tmp_path):
+    path = os.path.join(str(tmp_path), 'cache.db')
+    value = ['x' * 100]
+    entry_size = len('["{}"]'.format('x' * 100))
+    cache = ParseCache(path, '1', max_bytes=entry_size * 3)
+    cache.put_many([('a', value), ('b', value), ('c', value)])
+    assert cache.total_bytes == entry_size * 3
+    # 'a' becomes the most recently used one
+    assert cache.get('a') == value
+    cache.put('d', value)
+    assert cache.get_many(['a', 'b', 'c', 'd']).keys() == {'a', 'c', 'd'}
+    assert cache.total_bytes == entry_size * 3
+
+    # the size is tracked across restarts
+    cache.close()
+    cache = ParseCache(path, '1', max_bytes=entry_size * 2)
+    cache.put('e', value)
+    assert cache.total_bytes == entry_size * 2
+    assert set(cache.get_many(['a', 'c', 'd', 'e'])) == {'d', 'e'}
@@ -2,7 +2,9 @@ import os.path
 import subprocess
 import test.test_analytics2.helpers.repository as repositoryhelper
 
-from persper.analytics2.repository import GitRepository
+from git import Repo
+
+from persper.analytics2.repository import GitFileInfo, GitRepository
 from persper.util.path import root_path
 
 
@@ -24,3 +26,16 @@ def test_git_repository():
     # repoPath = r"F:\WRS\testrepos\ccls"
     repo = GitRepository(repoPath)
     repositoryhelper.test_repository_history_provider(repo)
+
+
+def test_prefetched_content_text_crlf(tmp_path):
+    repo = Repo.init(str(tmp_path))
+    repo.git.config("core.autocrlf", "false")
+    with open(os.path.join(str(tmp_path), "crlf.c"), "wb") as f:
+        f.write(b"a\r\nb\r\n")
+    repo.index.add(["crlf.c"])
+    commit = repo.index.commit("crlf")
+    blob = commit.tree["crlf.c"]
+    # prefetched content is decoded the same way as the blob stream, with universal newlines
+    text = GitFileInfo(blob=blob, content=blob.data_stream.read()).get_content_text()
+    assert text == "a\nb\n"
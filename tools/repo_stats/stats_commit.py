@@ -3,8 +3,27 @@
 import argparse
 import git
 import json
+import os
 import re
 import sys
+from types import SimpleNamespace
+
+from persper.analytics.history_index import HistoryIndex, rev_list
+
+
+def indexed_commits(repo, index, rev, max_count, skip):
+    """The commits in rev, with the attributes read below taken from the history index"""
+    for hexsha in rev_list(repo, rev, max_count=max_count, skip=skip):
+        if not index.covers(hexsha):
+            # e.g. made after the index was built
+            yield repo.commit(hexsha)
+            continue
+        name, email = index.author(hexsha)
+        yield SimpleNamespace(hexsha=hexsha,
+                              parents=index.parents(hexsha),
+                              author=git.Actor(name, email),
+                              summary=index.summary(hexsha),
+                              stats=SimpleNamespace(files=index.stats(hexsha)))
 
 
 def main():
@@ -22,11 +41,20 @@ def main():
                         help='Min number of commit to begin with')
     parser.add_argument('-u', '--max-count', type=int, default=sys.maxsize,
                         help='Max number of commit to end with')
+    parser.add_argument('-i', '--history-index', metavar='FILE',
+                        help='History index (.npz) to read the commits from, built first if it does not exist')
     args = parser.parse_args()
 
     repo = git.Repo(args.repo_dir)
-    commits = repo.iter_commits(args.branch, max_count=args.max_count,
-                                skip=args.min_count)
+    if args.history_index:
+        if os.path.isfile(args.history_index):
+            index = HistoryIndex.load(args.history_index)
+        else:
+            index = HistoryIndex.build(args.repo_dir, path=args.history_index)
+        commits = indexed_commits(repo, index, args.branch, args.max_count, args.min_count)
+    else:
+        commits = repo.iter_commits(args.branch, max_count=args.max_count,
+                                    skip=args.min_count)
     if args.show_stats:
         email2stats = {}
         for i, commit in enumerate(commits):